@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "tables.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -82,6 +83,25 @@ WSGI_APPLICATION = "dynamic_tables.wsgi.application"
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 DATABASES = {"default": env.db("DATABASE_URL")}
 
+# Pooled connections with prepared statements of dynamic table queries,
+# see tables/backends/postgresql_pool
+if env.bool("DATABASE_POOL", default=False):
+    DATABASES["default"]["ENGINE"] = "tables.backends.postgresql_pool"
+    DATABASES["default"].setdefault("OPTIONS", {}).update(
+        {
+            "pool": {
+                "max_size": env.int("DATABASE_POOL_MAX_SIZE", default=20),
+                "timeout": env.float("DATABASE_POOL_TIMEOUT", default=10),
+                "max_lifetime": env.float("DATABASE_POOL_MAX_LIFETIME", default=3600),
+                "check_interval": env.float("DATABASE_POOL_CHECK_INTERVAL", default=30),
+            },
+            "statement_cache": {
+                "max_size": env.int("DATABASE_STATEMENT_CACHE_SIZE", default=100),
+                "prepare_threshold": env.int("DATABASE_PREPARE_THRESHOLD", default=2),
+            },
+        }
+    )
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -106,8 +126,74 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
+# "rows" cache keeps rendered pages of table rows, local memory of the process
+# unless ROWS_CACHE_URL points to a shared cache, e.g. redis://
+CACHES = {
+    "default": env.cache_url("CACHE_URL", default="locmemcache://"),
+    "rows": env.cache_url(
+        "ROWS_CACHE_URL", default="locmemcache://dynamic-tables-rows"
+    ),
+}
+
 LOGIN_REDIRECT_URL = "table_create"
 
+# Dynamic tables
+# Max number of built dynamic model classes kept in memory
+DYNAMIC_TABLES_MODEL_CACHE_SIZE = env.int(
+    "DYNAMIC_TABLES_MODEL_CACHE_SIZE", default=1000
+)
+# Number of rows inserted with a single multi-row INSERT
+DYNAMIC_TABLES_ROW_BATCH_SIZE = env.int("DYNAMIC_TABLES_ROW_BATCH_SIZE", default=1000)
+# Default and max number of rows in a page of table rows
+DYNAMIC_TABLES_PAGE_SIZE = env.int("DYNAMIC_TABLES_PAGE_SIZE", default=100)
+DYNAMIC_TABLES_MAX_PAGE_SIZE = env.int("DYNAMIC_TABLES_MAX_PAGE_SIZE", default=1000)
+# Number of rows fetched from server-side cursor at once by streaming export
+DYNAMIC_TABLES_EXPORT_CHUNK_SIZE = env.int(
+    "DYNAMIC_TABLES_EXPORT_CHUNK_SIZE", default=2000
+)
+# Number of rows in a record batch of Arrow and Parquet export and import,
+# every batch of Parquet export is a row group
+DYNAMIC_TABLES_ARROW_BATCH_SIZE = env.int(
+    "DYNAMIC_TABLES_ARROW_BATCH_SIZE", default=50000
+)
+# Max number of rejected lines listed in a bulk upload report
+DYNAMIC_TABLES_INGEST_MAX_ERRORS = env.int(
+    "DYNAMIC_TABLES_INGEST_MAX_ERRORS", default=1000
+)
+# Max number of groups returned by table rows aggregation
+DYNAMIC_TABLES_AGGREGATE_MAX_GROUPS = env.int(
+    "DYNAMIC_TABLES_AGGREGATE_MAX_GROUPS", default=10000
+)
+# Online column type changes: rows copied to shadow column per transaction,
+# pause between batches and max wait for table lock of the short DDL steps
+DYNAMIC_TABLES_ALTER_BATCH_SIZE = env.int(
+    "DYNAMIC_TABLES_ALTER_BATCH_SIZE", default=10000
+)
+DYNAMIC_TABLES_ALTER_BATCH_DELAY_MS = env.int(
+    "DYNAMIC_TABLES_ALTER_BATCH_DELAY_MS", default=50
+)
+DYNAMIC_TABLES_ALTER_LOCK_TIMEOUT_MS = env.int(
+    "DYNAMIC_TABLES_ALTER_LOCK_TIMEOUT_MS", default=5000
+)
+# Worker threads of each server process running queued table updates and uploads,
+# 0 leaves jobs to "manage.py run_jobs" worker processes. Uploads are spooled
+# to DYNAMIC_TABLES_JOB_SPOOL_DIR (system temp directory by default), which
+# worker processes must be able to read
+DYNAMIC_TABLES_JOB_WORKERS = env.int("DYNAMIC_TABLES_JOB_WORKERS", default=2)
+DYNAMIC_TABLES_JOB_SPOOL_DIR = env.str("DYNAMIC_TABLES_JOB_SPOOL_DIR", default="")
+# Seconds a running job is kept without a heartbeat of its worker, afterwards
+# the worker is taken as stopped and the job fails, so the table gets free
+DYNAMIC_TABLES_JOB_LEASE = env.int("DYNAMIC_TABLES_JOB_LEASE", default=60)
+# Seconds rendered pages of table rows stay in "rows" cache, 0 disables the cache.
+# Pages are keyed by table write version, writes never serve stale pages
+DYNAMIC_TABLES_ROWS_CACHE_TIMEOUT = env.int(
+    "DYNAMIC_TABLES_ROWS_CACHE_TIMEOUT", default=0
+)
+# Phase timings and query counts of requests exported on /metrics,
+# requests slower than DYNAMIC_TABLES_SLOW_REQUEST_MS are logged with them
+DYNAMIC_TABLES_METRICS = env.bool("DYNAMIC_TABLES_METRICS", default=False)
+DYNAMIC_TABLES_SLOW_REQUEST_MS = env.int("DYNAMIC_TABLES_SLOW_REQUEST_MS", default=0)
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.db import models
+from django.db.models.query import QuerySet
+from rest_framework import serializers
+
+from .filters import get_model_field_types
+
+AGGREGATES = {
+    "count": models.Count,
+    "sum": models.Sum,
+    "avg": models.Avg,
+    "min": models.Min,
+    "max": models.Max,
+}
+
+# field types every aggregate function accepts
+AGGREGATE_TYPES = {
+    "count": {"string", "int", "float", "bool"},
+    "sum": {"int", "float"},
+    "avg": {"int", "float"},
+    "min": {"string", "int", "float"},
+    "max": {"string", "int", "float"},
+}
+
+
+def compile_aggregate(
+    field_types: dict, aggregate: str
+) -> tuple[str, models.Aggregate]:
+    """
+    Compile "<function>[:<field>]" to ORM aggregate, count without field counts rows
+    :param field_types:
+    :param aggregate:
+    :return: result name and aggregate expression
+    """
+    function, _, name = aggregate.partition(":")
+    if function not in AGGREGATES:
+        raise serializers.ValidationError(
+            {"aggregate": f"unknown function {function}, use one of {list(AGGREGATES)}"}
+        )
+
+    if not name:
+        if function != "count":
+            raise serializers.ValidationError(
+                {"aggregate": f"{function} needs a field, e.g. {function}:<field>"}
+            )
+        return "count", models.Count("pk")
+
+    if name not in field_types:
+        raise serializers.ValidationError({"aggregate": f"unknown field {name}"})
+    field_type = field_types[name]
+    if field_type not in AGGREGATE_TYPES[function]:
+        raise serializers.ValidationError(
+            {"aggregate": f"{function} is not supported for {field_type} field {name}"}
+        )
+
+    if function == "avg":
+        expression = models.Avg(name, output_field=models.FloatField())
+    else:
+        expression = AGGREGATES[function](name)
+    return f"{function}_{name}", expression
+
+
+def aggregate_rows(
+    queryset: QuerySet, group_by: list[str], aggregates: list[str]
+) -> list[dict]:
+    """
+    Group rows by fields and compute aggregates of every group in a single query,
+    without group_by fields the whole queryset is one group
+    :param queryset:
+    :param group_by: field names
+    :param aggregates: "<function>[:<field>]" items, e.g. count, sum:price
+    :return: one dict per group with group_by fields and aggregate results
+    """
+    field_types = get_model_field_types(queryset.model)
+    unknown_fields = [name for name in group_by if name not in field_types]
+    if unknown_fields:
+        raise serializers.ValidationError(
+            {"group_by": f"unknown fields {unknown_fields}"}
+        )
+
+    annotations = dict(
+        compile_aggregate(field_types, aggregate)
+        for aggregate in aggregates or ["count"]
+    )
+    clashes = set(annotations) & set(group_by)
+    if clashes:
+        raise serializers.ValidationError(
+            {"aggregate": f"result names {sorted(clashes)} clash with group_by fields"}
+        )
+
+    if not group_by:
+        return [queryset.aggregate(**annotations)]
+
+    max_groups = settings.DYNAMIC_TABLES_AGGREGATE_MAX_GROUPS
+    groups = list(
+        queryset.order_by()
+        .values(*group_by)
+        .annotate(**annotations)
+        .order_by(*group_by)[: max_groups + 1]
+    )
+    if len(groups) > max_groups:
+        raise serializers.ValidationError(
+            {"group_by": f"more than {max_groups} groups, narrow rows with filters"}
+        )
+    return groups
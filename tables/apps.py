@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class TablesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "tables"
+
+    def ready(self):
+        from .jobs import start_workers
+        from .metrics import install_query_counter
+
+        # counts queries of measured requests only, others pass straight through
+        connection_created.connect(install_query_counter)
+        # job workers of server process, not started by management commands
+        request_started.connect(start_workers)
@@ -0,0 +1,212 @@
+import json
+from typing import Any
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import serializers, status
+from rest_framework.exceptions import (
+    APIException,
+    AuthenticationFailed,
+    NotAuthenticated,
+)
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from .caching import (
+    acache_page,
+    aget_cached_page,
+    get_not_modified_response,
+    get_page_cache_key,
+    set_validators,
+)
+from .export import astream_rows
+from .filters import DynamicTableFilter, DynamicTableOrderingFilter
+from .metrics import phase
+from .models import DynamicModel
+from .pagination import DynamicTableCursorPagination
+from .serializers import (
+    AddRowsOptionsSerializer,
+    get_row_validator,
+    get_row_values_serializer,
+)
+from .utils import aget_model, ainsert_rows, aupsert_rows
+
+
+class AsyncAPIView(View):
+    """
+    Base class for native async views, served without a thread per request
+    under ASGI. DRF views are synchronous, so the configured authentication,
+    permission and throttle classes are run here by a DRF view in a thread,
+    and API errors are answered the way DRF answers them for the rest of the API
+    """
+
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # as for DRF views, CSRF is checked by SessionAuthentication only
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def check_access(self, request: Any):
+        """
+        Authenticate request and check its permissions and throttles,
+        the way APIView.initial does
+        :param request: Django request, gets the authenticated user
+        :return:
+        """
+        api_view = APIView(
+            authentication_classes=self.authentication_classes,
+            permission_classes=self.permission_classes,
+            throttle_classes=self.throttle_classes,
+        )
+        api_view.args, api_view.kwargs = self.args, self.kwargs
+        drf_request = Request(request, authenticators=api_view.get_authenticators())
+        api_view.request = drf_request
+        try:
+            api_view.perform_authentication(drf_request)
+            api_view.check_permissions(drf_request)
+            api_view.check_throttles(drf_request)
+        except (NotAuthenticated, AuthenticationFailed) as exc:
+            # 401 with a challenge of the first authenticator, 403 without one
+            auth_header = api_view.get_authenticate_header(drf_request)
+            if auth_header:
+                exc.auth_header = auth_header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+            raise
+
+        request.user, request.auth = drf_request.user, drf_request.auth
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            # authenticators load sessions and users with sync calls
+            await sync_to_async(self.check_access)(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            detail = exc.detail
+            if not isinstance(detail, (list, dict)):
+                detail = {"detail": detail}
+            response = JsonResponse(detail, status=exc.status_code, safe=False)
+            if getattr(exc, "auth_header", None):
+                response["WWW-Authenticate"] = exc.auth_header
+            return response
+
+
+class AsyncAddRowsDynamicModelView(AsyncAPIView):
+    """
+    Async version of AddRowsDynamicModelView, rows are inserted with abulk_create
+    """
+
+    async def post(self, request, *args, **kwargs):
+        model, model_object = await aget_model(kwargs.get("id"))
+
+        try:
+            data = json.loads(request.body)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        if not isinstance(data, dict) or not isinstance(data.get("rows"), list):
+            raise serializers.ValidationError({"rows": "expected a list of rows"})
+
+        options = AddRowsOptionsSerializer(data=data)
+        options.is_valid(raise_exception=True)
+
+        # rows are checked against model fields without touching database
+        with phase("validate"):
+            rows = get_row_validator(model).clean(
+                data["rows"], settings.DYNAMIC_TABLES_INGEST_MAX_ERRORS
+            )
+
+        if options.validated_data["upsert"] and not model_object.natural_key:
+            raise serializers.ValidationError(
+                {"upsert": f"model {model_object.name} has no natural_key"}
+            )
+
+        try:
+            if options.validated_data["upsert"]:
+                with phase("upsert_rows"):
+                    upserted = await aupsert_rows(
+                        model,
+                        rows,
+                        model_object.natural_key,
+                        batch_size=options.validated_data.get("batch_size"),
+                        atomic=options.validated_data["atomic"],
+                    )
+                return JsonResponse({"upserted": upserted})
+
+            with phase("insert_rows"):
+                row_ids = await ainsert_rows(
+                    model,
+                    rows,
+                    batch_size=options.validated_data.get("batch_size"),
+                    atomic=options.validated_data["atomic"],
+                )
+        finally:
+            await DynamicModel.objects.abump_write_version(model_object.id)
+        return JsonResponse(row_ids, status=status.HTTP_201_CREATED, safe=False)
+
+
+class AsyncListDynamicTableRowsView(AsyncAPIView):
+    """
+    Async version of ListDynamicTableRowsView with the same filters,
+    ordering, keyset pagination and streaming export
+    """
+
+    pagination_class = DynamicTableCursorPagination
+    filter_backends = (DynamicTableFilter, DynamicTableOrderingFilter)
+
+    async def get(self, request, *args, **kwargs):
+        model, model_object = await aget_model(kwargs.get("id"))
+        not_modified = get_not_modified_response(request, model_object)
+        if not_modified is not None:
+            return not_modified
+        # DRF request gives filters and paginator the query_params they expect
+        request = Request(request)
+
+        queryset = model.objects.all()
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+
+        export_format = request.query_params.get("export")
+        if export_format:
+            return set_validators(
+                astream_rows(queryset, export_format, model_object.name), model_object
+            )
+
+        cache_key = get_page_cache_key(request, model_object, "application/json")
+        with phase("cache"):
+            response = await aget_cached_page(cache_key)
+        if response is None:
+            response = await self.get_page(request, model, queryset)
+            await acache_page(cache_key, response)
+        return set_validators(response, model_object)
+
+    async def get_page(self, request: Request, model: Any, queryset: Any):
+        """
+        Page of filtered rows rendered as JSON
+        :param request:
+        :param model:
+        :param queryset:
+        :return:
+        """
+        row_serializer = get_row_values_serializer(model)
+        queryset = queryset.values_list(*row_serializer.columns)
+
+        paginator = self.pagination_class()
+        with phase("paginate"):
+            page = await paginator.apaginate_queryset(queryset, request, view=self)
+        if page is not None:
+            with phase("serialize"):
+                rows = row_serializer.to_representation(page)
+            # JSON is encoded by JsonResponse
+            with phase("render"):
+                return JsonResponse(paginator.get_paginated_data(rows))
+
+        rows = [row async for row in queryset]
+        with phase("render"):
+            return JsonResponse(row_serializer.to_representation(rows), safe=False)
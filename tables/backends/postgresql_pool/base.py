@@ -0,0 +1,110 @@
+"""
+PostgreSQL backend with pooled connections and server-side prepared statements
+of dynamic table queries. Enabled with
+
+    DATABASES["default"]["ENGINE"] = "tables.backends.postgresql_pool"
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {"max_size": 20, "timeout": 10, "max_lifetime": 3600,
+                 "check_interval": 30},
+        "statement_cache": {"max_size": 100, "prepare_threshold": 2},
+    }
+
+Closing a connection, e.g. at the end of a request, returns it to the pool
+"""
+import threading
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import (
+    DatabaseCreation as BaseDatabaseCreation,
+)
+
+from .pool import ConnectionPool
+from .statements import (
+    PooledConnection,
+    PreparingCursor,
+    StatementCache,
+    get_statement_stats,
+)
+
+# pools by database alias and connection parameters
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, conn_params: dict, connect, options: dict):
+    key = (alias, repr(sorted(conn_params.items())))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(connect, **options)
+        return pools[key]
+
+
+def close_pools(alias: str):
+    """
+    Close idle connections of database pools, e.g. before the database is dropped
+    :param alias:
+    :return:
+    """
+    with pools_lock:
+        alias_pools = [pool for key, pool in pools.items() if key[0] == alias]
+    for pool in alias_pools:
+        pool.close()
+
+
+def get_pool_stats(alias: str) -> dict:
+    """
+    Connection pool wait times and prepared statement cache hit rate
+    :param alias:
+    :return:
+    """
+    with pools_lock:
+        alias_pools = [pool for key, pool in pools.items() if key[0] == alias]
+    return {
+        "pools": [pool.stats() for pool in alias_pools],
+        "statements": get_statement_stats(),
+    }
+
+
+class DatabaseCreation(BaseDatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle pooled connections would keep the test database in use
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    @property
+    def pool_options(self) -> dict:
+        return self.settings_dict["OPTIONS"].get("pool", {})
+
+    @property
+    def statement_cache_options(self) -> dict:
+        return self.settings_dict["OPTIONS"].get("statement_cache", {})
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop("pool", None)
+        conn_params.pop("statement_cache", None)
+        conn_params["connection_factory"] = PooledConnection
+        conn_params["cursor_factory"] = PreparingCursor
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        def connect():
+            connection = super(DatabaseWrapper, self).get_new_connection(conn_params)
+            connection.statements = StatementCache(**self.statement_cache_options)
+            return connection
+
+        self.pool = get_pool(self.alias, conn_params, connect, self.pool_options)
+        return self.pool.acquire()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.in_atomic_block:
+            # Django keeps using the connection until the atomic block exits
+            self.connection.close()
+        with self.wrap_database_errors:
+            self.pool.release(self.connection)
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable
+
+from django.db import DatabaseError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class PoolTimeout(DatabaseError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of database connections shared by threads of the process.
+    Connections idle for longer than check_interval are checked before reuse,
+    connections older than max_lifetime are closed instead of being reused
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        max_size: int = 20,
+        timeout: float = 10,
+        max_lifetime: float = 3600,
+        check_interval: float = 30,
+    ):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+
+        self.pid = os.getpid()
+        # connections opened before close() are not reused
+        self.generation = 0
+        # idle connections, the most recently used one is reused first
+        self._idle = []
+        self._size = 0
+        # connections inherited from parent process, never used nor closed here
+        self._inherited = []
+        self._condition = threading.Condition()
+        self.counters = Counter()
+        self.max_wait = 0.0
+
+    def acquire(self) -> Any:
+        """
+        Take idle connection or open a new one while the pool is not full,
+        otherwise wait until a connection is released
+        :return: connection
+        """
+        if self.pid != os.getpid():
+            self._reset_after_fork()
+
+        start = time.monotonic()
+        while True:
+            connection = self._checkout(start)
+            if connection is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+                connection.created_at = time.monotonic()
+                connection.generation = self.generation
+                self.counters["created"] += 1
+                break
+            if self._check(connection):
+                break
+            self._discard(connection)
+
+        wait = time.monotonic() - start
+        self.counters["acquired"] += 1
+        self.counters["wait_time"] += wait
+        self.max_wait = max(self.max_wait, wait)
+        return connection
+
+    def release(self, connection: Any):
+        """
+        Return connection to the pool, broken and expired ones are closed
+        :param connection:
+        :return:
+        """
+        if self.pid != os.getpid():
+            return
+        if (
+            not connection.closed
+            and connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+        ):
+            try:
+                connection.rollback()
+            except Exception:
+                connection.close()
+
+        if (
+            connection.closed
+            or connection.generation != self.generation
+            or self._expired(connection)
+        ):
+            self._discard(connection)
+            return
+
+        connection.released_at = time.monotonic()
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def close(self):
+        """
+        Close idle connections, connections in use are closed on release
+        :return:
+        """
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self.generation += 1
+            self._condition.notify_all()
+        for connection in idle:
+            connection.close()
+
+    def stats(self) -> dict:
+        acquired = self.counters["acquired"]
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "max_size": self.max_size,
+            "acquired": acquired,
+            "created": self.counters["created"],
+            "closed_expired": self.counters["expired"],
+            "closed_broken": self.counters["broken"],
+            "timeouts": self.counters["timeouts"],
+            "wait_time_avg_ms": round(
+                self.counters["wait_time"] / acquired * 1000 if acquired else 0, 3
+            ),
+            "wait_time_max_ms": round(self.max_wait * 1000, 3),
+        }
+
+    def _reset_after_fork(self):
+        # sockets are shared with the parent process, closing them would end
+        # parent's sessions
+        with self._condition:
+            self._inherited += self._idle
+            self._idle, self._size = [], 0
+            self.counters.clear()
+            self.max_wait = 0.0
+            self.pid = os.getpid()
+
+    def _checkout(self, start: float) -> Any:
+        # idle connection, or None when a slot for a new connection is reserved
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None
+
+                remaining = start + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    self.max_wait = max(self.max_wait, time.monotonic() - start)
+                    raise PoolTimeout(
+                        f"no database connection available in {self.timeout}s, "
+                        f"all {self.max_size} are in use"
+                    )
+                self._condition.wait(remaining)
+
+    def _check(self, connection: Any) -> bool:
+        if connection.closed:
+            self.counters["broken"] += 1
+            return False
+        if self._expired(connection):
+            return False
+        if time.monotonic() - connection.released_at < self.check_interval:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if not connection.autocommit:
+                connection.rollback()
+        except Exception:
+            self.counters["broken"] += 1
+            return False
+        return True
+
+    def _expired(self, connection: Any) -> bool:
+        if time.monotonic() - connection.created_at > self.max_lifetime:
+            self.counters["expired"] += 1
+            return True
+        return False
+
+    def _discard(self, connection: Any):
+        # free the slot of connection which is not coming back to the pool
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
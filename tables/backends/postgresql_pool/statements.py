@@ -0,0 +1,199 @@
+import re
+from collections import Counter, OrderedDict
+from typing import Optional
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection, cursor
+
+from tables.registry import model_registry
+
+# target table of a statement generated by Django ORM
+TABLE_RE = re.compile(
+    r'^(?:SELECT .*? FROM|INSERT INTO|UPDATE|DELETE FROM) "(\w+)"', re.DOTALL
+)
+PLACEHOLDER_RE = re.compile(r"%s|%%")
+
+# statement cache counters of all connections of the process
+statement_counters = Counter()
+
+
+def to_positional(sql: str) -> tuple[str, int]:
+    """
+    Convert %s placeholders of psycopg2 query to $n parameters of PREPARE
+    :param sql:
+    :return: converted query and number of parameters
+    """
+    count = 0
+
+    def replace(match: re.Match) -> str:
+        nonlocal count
+        if match.group() == "%%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return PLACEHOLDER_RE.sub(replace, sql), count
+
+
+class StatementCache:
+    """
+    Server-side prepared statements of a connection, least recently used
+    ones are deallocated when there are more than max_size of them.
+    Statements are keyed by table, its schema version and query shape,
+    a query is prepared once it was run prepare_threshold times
+    """
+
+    def __init__(self, max_size: int = 100, prepare_threshold: int = 2):
+        self.max_size = max_size
+        self.prepare_threshold = prepare_threshold
+        # key to (statement name, number of parameters)
+        self.statements = OrderedDict()
+        self.seen = Counter()
+        # queries PostgreSQL could not prepare
+        self.failed = set()
+        self.deallocate = []
+        self.next_id = 0
+
+    def get(self, key: tuple) -> Optional[tuple[str, int]]:
+        statement = self.statements.get(key)
+        if statement is not None:
+            self.statements.move_to_end(key)
+        return statement
+
+    def should_prepare(self, key: tuple) -> bool:
+        if key in self.failed:
+            return False
+        if len(self.seen) > self.max_size * 10:
+            # one-off queries don't pile up
+            self.seen.clear()
+        self.seen[key] += 1
+        return self.seen[key] >= self.prepare_threshold
+
+    def next_name(self) -> str:
+        self.next_id += 1
+        return f"dt_{self.next_id}"
+
+    def add(self, key: tuple, name: str, param_count: int):
+        self.statements[key] = (name, param_count)
+        self.seen.pop(key, None)
+        while len(self.statements) > self.max_size:
+            self.deallocate.append(self.statements.popitem(last=False)[1][0])
+            statement_counters["evicted"] += 1
+
+    def remove(self, key: tuple):
+        statement = self.statements.pop(key, None)
+        if statement is not None:
+            self.deallocate.append(statement[0])
+
+
+class PreparingCursor(cursor):
+    """
+    Runs repeated queries of dynamic tables as server-side prepared statements,
+    so PostgreSQL parses and plans them once per connection.
+    Statements of a table are keyed by its schema version and are never reused
+    after the table is altered
+    """
+
+    def execute(self, sql, params=None):
+        key = self.get_key(sql, params)
+        if key is None:
+            statement_counters["bypassed"] += 1
+            return super().execute(sql, params)
+
+        statements = self.connection.statements
+        statement = statements.get(key)
+        if statement is None:
+            if not statements.should_prepare(key):
+                statement_counters["unprepared"] += 1
+                return super().execute(sql, params)
+            statement = self.prepare(key, sql)
+            if statement is None:
+                return super().execute(sql, params)
+        else:
+            statement_counters["hits"] += 1
+
+        name, param_count = statement
+        if param_count != len(params):
+            statements.remove(key)
+            return super().execute(sql, params)
+        try:
+            return super().execute(
+                f"EXECUTE {name}({', '.join(['%s'] * param_count)})"
+                if param_count
+                else f"EXECUTE {name}",
+                params,
+            )
+        except Exception:
+            # e.g. table was changed by something else than dynamic model update
+            statements.remove(key)
+            raise
+
+    def get_key(self, sql: str, params) -> Optional[tuple]:
+        if self.name is not None or not isinstance(params, (list, tuple)):
+            # server-side cursors and named parameters
+            return None
+        match = TABLE_RE.match(sql)
+        if match is None:
+            return None
+        version = model_registry.get_table_version(match.group(1))
+        if version is None:
+            return None
+        return match.group(1), version, sql
+
+    def prepare(self, key: tuple, sql: str) -> Optional[tuple[str, int]]:
+        statements = self.connection.statements
+        positional_sql, param_count = to_positional(sql)
+        in_transaction = (
+            self.connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+            or not self.connection.autocommit
+        )
+
+        # failed PREPARE must not abort the transaction of the query
+        if in_transaction:
+            super().execute("SAVEPOINT dt_prepare")
+        try:
+            # names stay queued until their DEALLOCATE went through
+            while statements.deallocate:
+                super().execute(f"DEALLOCATE {statements.deallocate[0]}")
+                del statements.deallocate[0]
+            name = statements.next_name()
+            super().execute(f"PREPARE {name} AS {positional_sql}")
+        except Exception:
+            if in_transaction:
+                super().execute("ROLLBACK TO SAVEPOINT dt_prepare")
+            if len(statements.failed) < statements.max_size * 10:
+                statements.failed.add(key)
+            statement_counters["failed"] += 1
+            return None
+        if in_transaction:
+            super().execute("RELEASE SAVEPOINT dt_prepare")
+        # evicts least recently used statements only once this one exists
+        statements.add(key, name, param_count)
+
+        statement_counters["prepared"] += 1
+        return name, param_count
+
+
+class PooledConnection(connection):
+    """
+    psycopg2 connection with its own prepared statements cache
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = StatementCache()
+
+
+def get_statement_stats() -> dict:
+    executed = statement_counters["hits"] + statement_counters["prepared"]
+    candidates = executed + statement_counters["unprepared"]
+    return {
+        "hits": statement_counters["hits"],
+        "prepared": statement_counters["prepared"],
+        "unprepared": statement_counters["unprepared"],
+        "bypassed": statement_counters["bypassed"],
+        "evicted": statement_counters["evicted"],
+        "failed": statement_counters["failed"],
+        "hit_rate": (
+            round(statement_counters["hits"] / candidates, 4) if candidates else None
+        ),
+    }
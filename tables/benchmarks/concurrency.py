@@ -0,0 +1,177 @@
+"""
+Concurrent connections benchmark of table rows endpoints.
+
+Keeps a number of slow clients reading table export while other clients
+request pages of rows, and reports page throughput and latency.
+Run it against the same table served by WSGI and ASGI servers, e.g.
+
+    gunicorn dynamic_tables.wsgi -k gthread --threads 32
+    uvicorn dynamic_tables.asgi:application
+
+    python -m tables.benchmarks.concurrency http://127.0.0.1:8000 1 \
+        --cookie sessionid=... --slow-clients 200
+
+and compare rows/ (sync views) with rows/async (async views) paths.
+Only standard library is used, so it runs anywhere the project runs
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+
+async def http_get(
+    url: str, cookie: str, read_rate: Optional[int] = None
+) -> tuple[int, int]:
+    """
+    GET url over a new connection
+    :param url:
+    :param cookie:
+    :param read_rate: bytes per second the client reads body with, all at once if None
+    :return: status code and body size
+    """
+    parts = urlsplit(url)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if read_rate:
+        # small receive buffer makes server wait for the client instead of
+        # pushing the whole response into kernel buffers
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(
+        sock, (parts.hostname, parts.port or 80)
+    )
+    reader, writer = await asyncio.open_connection(
+        sock=sock, limit=read_rate or 2**16
+    )
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    writer.write(
+        (
+            f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+            f"Cookie: {cookie}\r\nConnection: close\r\n\r\n"
+        ).encode()
+    )
+    await writer.drain()
+
+    status_line = await reader.readline()
+    size = 0
+    while True:
+        chunk = await reader.read(read_rate or 65536)
+        if not chunk:
+            break
+        size += len(chunk)
+        if read_rate:
+            await asyncio.sleep(1)
+
+    writer.close()
+    return int(status_line.split()[1]), size
+
+
+async def run(
+    base_url: str,
+    table_id: int,
+    cookie: str,
+    path: str,
+    clients: int,
+    requests: int,
+    slow_clients: int,
+    read_rate: int,
+    timeout: float,
+    warmup: float,
+) -> dict:
+    rows_url = f"{base_url}/api/table/{table_id}/{path}"
+
+    # slow clients hold export responses open for the whole run
+    slow_tasks = [
+        asyncio.create_task(http_get(f"{rows_url}?export=ndjson", cookie, read_rate))
+        for _ in range(slow_clients)
+    ]
+    # responses fill socket buffers first, measure once clients hold them back
+    await asyncio.sleep(warmup)
+
+    latencies, errors, timeouts = [], 0, 0
+
+    async def client():
+        nonlocal errors, timeouts
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                status, _ = await asyncio.wait_for(
+                    http_get(f"{rows_url}?page_size=100", cookie), timeout
+                )
+            except asyncio.TimeoutError:
+                # server has no free worker left for the request
+                timeouts += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    for task in slow_tasks:
+        task.cancel()
+    await asyncio.gather(*slow_tasks, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        "path": path,
+        "slow_clients": slow_clients,
+        "requests": len(latencies),
+        "errors": errors,
+        "timeouts": timeouts,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": (
+            round(statistics.median(latencies) * 1000, 1) if latencies else None
+        ),
+        "latency_p95_ms": (
+            round(latencies[int(len(latencies) * 0.95)] * 1000, 1)
+            if latencies
+            else None
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base_url", help="e.g. http://127.0.0.1:8000")
+    parser.add_argument("table_id", type=int)
+    parser.add_argument("--cookie", default="", help="session cookie of a user")
+    parser.add_argument("--path", default="rows", help="rows or rows/async")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--slow-clients", type=int, default=100)
+    parser.add_argument(
+        "--read-rate", type=int, default=1024, help="bytes/s of slow clients"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=10, help="seconds to wait for a page"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=30, help="seconds before pages are requested"
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(
+        run(
+            args.base_url.rstrip("/"),
+            args.table_id,
+            args.cookie,
+            args.path,
+            args.clients,
+            args.requests,
+            args.slow_clients,
+            args.read_rate,
+            args.timeout,
+            args.warmup,
+        )
+    )
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
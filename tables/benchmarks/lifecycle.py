@@ -0,0 +1,507 @@
+"""
+Micro-benchmarks of table lifecycle and row paths.
+
+Measures wall time, number of queries and peak Python memory of building
+and creating tables, getting model classes, inserting and listing rows
+at several table sizes, and compares them with a stored baseline.
+Inserts also report rows per second, batched insert_rows next to
+the row by row path of model.objects.create()
+
+    python -m tables.benchmarks.lifecycle --save    # record baseline
+    python -m tables.benchmarks.lifecycle           # fails on regressions
+    python -m tables.benchmarks.lifecycle --profile full
+
+Runs in a throwaway test database of DATABASE_URL, PostgreSQL or SQLite,
+baselines are kept per database vendor and profile in baselines/.
+Time is the best of several runs, queries and memory are measured
+by one more run, tracemalloc slows down the code it traces
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dynamic_tables.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from rest_framework.test import APIRequestFactory, force_authenticate  # noqa: E402
+
+from tables.models import DynamicModel  # noqa: E402
+from tables.registry import model_registry, unregister_model  # noqa: E402
+from tables.schema import update_model  # noqa: E402
+from tables.serializers import DynamicModelSerializer  # noqa: E402
+from tables.utils import (  # noqa: E402
+    create_model,
+    get_model,
+    insert_rows,
+    prepare_fields,
+)
+from tables.views import AddRowsDynamicModelView, ListDynamicTableRowsView  # noqa: E402
+
+BASELINES_DIR = Path(__file__).resolve().parent / "baselines"
+
+PROFILES = {
+    "quick": {"columns": [5, 50], "rows": [10, 1000, 10000]},
+    "full": {"columns": [5, 50, 500], "rows": [10, 1000, 100000, 1000000]},
+}
+# number of columns of tables of row benchmarks
+ROW_COLUMNS = 5
+# rows posted with a single insert request
+REQUEST_ROWS = 10000
+# row by row inserts of larger tables take minutes and are not run
+PER_ROW_MAX_ROWS = 10000
+# absolute differences below these are noise, not regressions
+TIME_FLOOR_MS = 1.0
+MEMORY_FLOOR_KB = 64
+
+FIELD_TYPES = ("string", "int", "float", "bool")
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting queries, unlike connection.queries
+    it keeps no SQL in memory
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Case:
+    """
+    Benchmarked operation, setup and teardown run around every run
+    and are not measured. setup returns state passed to run and teardown
+    """
+
+    def __init__(
+        self,
+        name: str,
+        params: dict,
+        run: Callable[[Any], Any],
+        setup: Optional[Callable[[], Any]] = None,
+        teardown: Optional[Callable[[Any], Any]] = None,
+        repeat: int = 5,
+        rows: Optional[int] = None,
+    ):
+        self.name = name
+        self.params = params
+        self.run = run
+        self.setup = setup or (lambda: None)
+        self.teardown = teardown or (lambda state: None)
+        self.repeat = repeat
+        # rows written by a run, adds rows_per_sec to results
+        self.rows = rows
+
+    @property
+    def key(self) -> str:
+        params = ",".join(f"{key}={value}" for key, value in self.params.items())
+        return f"{self.name}[{params}]"
+
+    def measure(self) -> dict:
+        times = []
+        # first run warms up caches and is not counted, like collection
+        # pauses that belong to garbage of previous runs
+        for i in range(self.repeat + 1):
+            state = self.setup()
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                self.run(state)
+                elapsed = time.perf_counter() - start
+            finally:
+                gc.enable()
+            if i:
+                times.append(elapsed)
+            self.teardown(state)
+
+        state = self.setup()
+        counter = QueryCounter()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            with connection.execute_wrapper(counter):
+                self.run(state)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.teardown(state)
+
+        result = {
+            "time_ms": round(min(times) * 1000, 3),
+            "queries": counter.count,
+            "peak_memory_kb": round(peak / 1024, 1),
+        }
+        if self.rows is not None:
+            result["rows_per_sec"] = round(self.rows / max(min(times), 1e-9))
+        return result
+
+
+def get_fields(columns: int) -> list[dict]:
+    return [
+        {
+            "name": f"field_{i}",
+            "type": FIELD_TYPES[i % len(FIELD_TYPES)],
+            "options": (
+                {"max_length": 64}
+                if FIELD_TYPES[i % len(FIELD_TYPES)] == "string"
+                else {}
+            ),
+        }
+        for i in range(columns)
+    ]
+
+
+def get_rows(columns: int, count: int) -> list[dict]:
+    values = {
+        "string": lambda n: f"value {n}",
+        "int": lambda n: n,
+        "float": lambda n: n / 7,
+        "bool": lambda n: n % 2 == 0,
+    }
+    fields = get_fields(columns)
+    return [
+        {field["name"]: values[field["type"]](n) for field in fields}
+        for n in range(count)
+    ]
+
+
+class Tables:
+    """
+    Tables created for benchmarks, dropped when the run is over
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def new_name(self) -> str:
+        self.count += 1
+        return f"benchmark_table_{self.count}"
+
+    def create(self, columns: int, rows: int = 0) -> DynamicModel:
+        serializer = DynamicModelSerializer(
+            data={"name": self.new_name(), "fields": get_fields(columns)}
+        )
+        serializer.is_valid(raise_exception=True)
+        model_object = serializer.save()
+        if rows:
+            model, _ = get_model(model_object.id)
+            for start in range(0, rows, REQUEST_ROWS):
+                insert_rows(model, get_rows(columns, min(REQUEST_ROWS, rows - start)))
+        return model_object
+
+    @staticmethod
+    def drop(model_object: DynamicModel):
+        model, _ = get_model(model_object.id)
+        model_registry.invalidate(model_object.id)
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(model)
+        model_object.delete()
+
+    @staticmethod
+    def truncate(model_object: DynamicModel):
+        model, _ = get_model(model_object.id)
+        model.objects.all().delete()
+
+
+def get_schema_cases(tables: Tables, columns: int) -> list[Case]:
+    params = {"columns": columns}
+    model_object = tables.create(columns)
+
+    def new_validated_data() -> dict:
+        serializer = DynamicModelSerializer(
+            data={"name": tables.new_name(), "fields": get_fields(columns)}
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def create_model_run(state: dict):
+        state["model"] = create_model(state["name"], state["fields"])
+
+    def table_create_run(state: dict):
+        state["model_object"] = DynamicModelSerializer().create(state["data"])
+
+    def update_model_setup() -> dict:
+        instance = tables.create(columns)
+        serializer = DynamicModelSerializer(
+            instance,
+            data={
+                "name": instance.name,
+                "fields": get_fields(columns)
+                + [{"name": "added_field", "type": "int", "options": {"null": True}}],
+            },
+        )
+        serializer.is_valid(raise_exception=True)
+        return {"model_object": instance, "data": serializer.validated_data}
+
+    return [
+        Case(
+            "prepare_fields",
+            params,
+            run=lambda fields: prepare_fields(fields, remove_extra_options=True),
+            setup=lambda: get_fields(columns),
+        ),
+        Case(
+            "create_model",
+            params,
+            run=create_model_run,
+            setup=lambda: {
+                "name": tables.new_name(),
+                "fields": prepare_fields(
+                    get_fields(columns), remove_extra_options=True
+                ),
+            },
+            teardown=lambda state: unregister_model(state["model"]),
+        ),
+        Case(
+            "get_model_cold",
+            params,
+            run=lambda _: get_model(model_object.id),
+            setup=lambda: model_registry.invalidate(model_object.id),
+        ),
+        Case("get_model_warm", params, run=lambda _: get_model(model_object.id)),
+        Case(
+            "table_create",
+            params,
+            run=table_create_run,
+            setup=lambda: {"data": new_validated_data()},
+            teardown=lambda state: tables.drop(state["model_object"]),
+        ),
+        Case(
+            "update_model",
+            params,
+            run=lambda state: update_model(state["model_object"], state["data"]),
+            setup=update_model_setup,
+            teardown=lambda state: tables.drop(state["model_object"]),
+            repeat=3,
+        ),
+    ]
+
+
+def get_row_cases(tables: Tables, user: Any, rows: int) -> list[Case]:
+    params = {"rows": rows, "columns": ROW_COLUMNS}
+    repeat = 5 if rows <= 10000 else 1
+    # host allowed by ALLOWED_HOSTS, pages build absolute links
+    factory = APIRequestFactory(SERVER_NAME="localhost")
+    insert_view = AddRowsDynamicModelView.as_view()
+    list_view = ListDynamicTableRowsView.as_view()
+    insert_table = tables.create(ROW_COLUMNS)
+    list_table = tables.create(ROW_COLUMNS, rows)
+
+    def insert_setup() -> list:
+        tables.truncate(insert_table)
+        requests = []
+        for start in range(0, rows, REQUEST_ROWS):
+            request = factory.post(
+                "/",
+                {"rows": get_rows(ROW_COLUMNS, min(REQUEST_ROWS, rows - start))},
+                format="json",
+            )
+            force_authenticate(request, user)
+            requests.append(request)
+        return requests
+
+    def insert_run(requests: list):
+        for request in requests:
+            response = insert_view(request, id=insert_table.id)
+            assert response.status_code == 201, response.data
+
+    def insert_rows_setup() -> tuple[Any, list[dict]]:
+        tables.truncate(insert_table)
+        model, _ = get_model(insert_table.id)
+        return model, get_rows(ROW_COLUMNS, rows)
+
+    def insert_rows_run(state: tuple[Any, list[dict]]):
+        model, row_values = state
+        insert_rows(model, row_values)
+
+    def insert_per_row_run(state: tuple[Any, list[dict]]):
+        # a round trip and a transaction for every row
+        model, row_values = state
+        for row in row_values:
+            model.objects.create(**row)
+
+    def list_run(page_size: int):
+        request = factory.get("/", {"page_size": page_size})
+        force_authenticate(request, user)
+        response = list_view(request, id=list_table.id)
+        response.render()
+        assert response.status_code == 200, response.data
+
+    cases = [
+        Case(
+            "insert_rows_view",
+            params,
+            run=insert_run,
+            setup=insert_setup,
+            repeat=repeat,
+            rows=rows,
+        ),
+        Case(
+            "insert_rows",
+            params,
+            run=insert_rows_run,
+            setup=insert_rows_setup,
+            repeat=repeat,
+            rows=rows,
+        ),
+        Case(
+            "list_rows_view",
+            {**params, "page_size": settings.DYNAMIC_TABLES_PAGE_SIZE},
+            run=list_run,
+            setup=lambda: settings.DYNAMIC_TABLES_PAGE_SIZE,
+        ),
+        Case(
+            "list_rows_view",
+            {**params, "page_size": settings.DYNAMIC_TABLES_MAX_PAGE_SIZE},
+            run=list_run,
+            setup=lambda: settings.DYNAMIC_TABLES_MAX_PAGE_SIZE,
+        ),
+    ]
+    if rows <= PER_ROW_MAX_ROWS:
+        cases.append(
+            Case(
+                "insert_per_row",
+                params,
+                run=insert_per_row_run,
+                setup=insert_rows_setup,
+                repeat=repeat if rows <= 1000 else 1,
+                rows=rows,
+            )
+        )
+    return cases
+
+
+def run_benchmarks(profile: dict, only: Optional[str] = None) -> dict:
+    """
+    Run benchmarks of the profile in a new test database
+    :param profile:
+    :param only: run only cases with names containing this
+    :return: measurements by case key
+    """
+    # queries are not logged, so they don't use memory
+    settings.DEBUG = False
+    if connection.vendor != "sqlite":
+        # test runs against the same server keep their own database
+        connection.settings_dict["TEST"][
+            "NAME"
+        ] = f"benchmark_{connection.settings_dict['NAME']}"
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user = get_user_model().objects.create_user(username="benchmark")
+        tables = Tables()
+        results = {}
+        # tables of a group are created only when its turn comes
+        groups = [partial(get_schema_cases, tables, c) for c in profile["columns"]]
+        groups += [partial(get_row_cases, tables, user, r) for r in profile["rows"]]
+        for get_cases in groups:
+            for case in get_cases():
+                if only and only not in case.name:
+                    continue
+                results[case.key] = case.measure()
+                print(f"{case.key}: {json.dumps(results[case.key])}", file=sys.stderr)
+        return results
+    finally:
+        model_registry.clear()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Find results worse than baseline ones.
+    Any additional query is a regression, time and memory are regressions
+    when they grew by more than threshold share and more than a noise floor
+    :param results:
+    :param baseline:
+    :param threshold: e.g. 0.5 for 50%
+    :return: regressions descriptions
+    """
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result["queries"] > expected["queries"]:
+            regressions.append(
+                f"{key}: {result['queries']} queries, baseline {expected['queries']}"
+            )
+        for metric, floor in (
+            ("time_ms", TIME_FLOOR_MS),
+            ("peak_memory_kb", MEMORY_FLOOR_KB),
+        ):
+            if (
+                result[metric] > expected[metric] * (1 + threshold)
+                and result[metric] - expected[metric] > floor
+            ):
+                regressions.append(
+                    f"{key}: {metric} {result[metric]}, baseline {expected[metric]}"
+                )
+    return regressions
+
+
+def get_baseline_path(profile_name: str) -> Path:
+    return BASELINES_DIR / f"{connection.vendor}-{profile_name}.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--profile", choices=PROFILES, default="quick")
+    parser.add_argument("--only", help="run only benchmarks with this in name")
+    parser.add_argument(
+        "--save", action="store_true", help="write results as the new baseline"
+    )
+    parser.add_argument("--baseline", type=Path, help="baseline file to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="allowed growth of time and memory, 0.5 is 50%%",
+    )
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or get_baseline_path(args.profile)
+    results = run_benchmarks(PROFILES[args.profile], args.only)
+
+    if args.save:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline = {
+            "vendor": connection.vendor,
+            "profile": args.profile,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "results": results,
+        }
+        baseline_path.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"baseline written to {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print(f"no baseline {baseline_path}, record one with --save")
+        return
+    baseline = json.loads(baseline_path.read_text())
+    regressions = compare(results, baseline["results"], args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions against {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Conditional GET and page cache of table rows.
+
+Every write of rows and schema change bumps DynamicModel.write_version,
+ETag and Last-Modified of table rows come from it, so polling clients
+sending If-None-Match get 304 after the dynamic model lookup alone.
+Rendered pages are cached under the write version they were read at,
+pages of older versions are never looked up again and expire
+"""
+import hashlib
+from typing import Any, Optional
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import DynamicModel
+
+ROWS_CACHE = "rows"
+
+
+def get_rows_etag(model_object: DynamicModel) -> str:
+    # weak, the same rows are rendered as JSON or browsable API page
+    return f'W/"{model_object.id}-{model_object.write_version}"'
+
+
+def get_not_modified_response(
+    request: Any, model_object: DynamicModel
+) -> Optional[HttpResponse]:
+    """
+    304 response if the client has the current version of table rows
+    :param request:
+    :param model_object:
+    :return: None if rows have to be sent
+    """
+    return get_conditional_response(
+        request,
+        etag=get_rows_etag(model_object),
+        last_modified=int(model_object.modified_at.timestamp()),
+    )
+
+
+def set_validators(response: Any, model_object: DynamicModel) -> Any:
+    """
+    Add ETag and Last-Modified of table rows to response, clients
+    revalidate them on every request
+    :param response:
+    :param model_object:
+    :return:
+    """
+    response["ETag"] = get_rows_etag(model_object)
+    response["Last-Modified"] = http_date(model_object.modified_at.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def get_page_cache_key(
+    request: Any, model_object: DynamicModel, media_type: str
+) -> Optional[str]:
+    """
+    Cache key of rendered page of table rows
+    :param request:
+    :param model_object:
+    :param media_type: rendered media type
+    :return: None if pages are not cached
+    """
+    if not settings.DYNAMIC_TABLES_ROWS_CACHE_TIMEOUT:
+        return None
+    # pagination links are absolute, host is part of the page
+    params = sorted(request.GET.lists())
+    query = hashlib.sha256(
+        f"{request.build_absolute_uri(request.path)}?{urlencode(params, True)}|"
+        f"{media_type}".encode()
+    ).hexdigest()
+    return f"dynamic_tables:rows:{model_object.id}:{model_object.write_version}:{query}"
+
+
+def get_page_response(cached: Optional[tuple]) -> Optional[HttpResponse]:
+    if cached is None:
+        return None
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def get_cached_page(key: Optional[str]) -> Optional[HttpResponse]:
+    if key is None:
+        return None
+    return get_page_response(caches[ROWS_CACHE].get(key))
+
+
+async def aget_cached_page(key: Optional[str]) -> Optional[HttpResponse]:
+    if key is None:
+        return None
+    return get_page_response(await caches[ROWS_CACHE].aget(key))
+
+
+def cache_page(key: Optional[str], response: Any):
+    """
+    Cache page once response is rendered, rendering stays where it is measured
+    :param key:
+    :param response: DRF response
+    :return:
+    """
+    if key is None or response.status_code != 200:
+        return
+
+    def store(rendered):
+        caches[ROWS_CACHE].set(
+            key,
+            (rendered.content, rendered["Content-Type"]),
+            settings.DYNAMIC_TABLES_ROWS_CACHE_TIMEOUT,
+        )
+
+    response.add_post_render_callback(store)
+
+
+async def acache_page(key: Optional[str], response: HttpResponse):
+    if key is None or response.status_code != 200:
+        return
+    await caches[ROWS_CACHE].aset(
+        key,
+        (response.content, response["Content-Type"]),
+        settings.DYNAMIC_TABLES_ROWS_CACHE_TIMEOUT,
+    )
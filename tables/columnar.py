@@ -0,0 +1,279 @@
+"""
+Arrow IPC stream and Parquet encoding of dynamic table rows.
+Columns are typed from DynamicModelField types, rows are converted
+a batch at a time, column by column. pyarrow is an optional dependency,
+only these formats need it
+"""
+import io
+import shutil
+import tempfile
+from typing import Any, Iterator, Optional
+
+from django.conf import settings
+from django.db import models
+from rest_framework import serializers
+
+from .serializers import get_field_limits
+from .utils import FIELD_CLASSES
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+COLUMNAR_CONTENT_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+ARROW_CONTENT_TYPES = ("application/vnd.apache.arrow.stream",)
+PARQUET_CONTENT_TYPES = ("application/vnd.apache.parquet", "application/x-parquet")
+
+# DynamicModelField.type of Django model field class
+FIELD_TYPES = {field_class: name for name, field_class in FIELD_CLASSES.items()}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise serializers.ValidationError(
+            "arrow and parquet formats need pyarrow, which is not installed"
+        )
+
+
+def get_arrow_type(field: models.Field) -> "pa.DataType":
+    # id is the only field which is not a DynamicModelField
+    field_type = "int" if field.primary_key else FIELD_TYPES[type(field)]
+    return {
+        "string": pa.string(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+    }[field_type]
+
+
+def get_arrow_schema(model: models.Model) -> "pa.Schema":
+    """
+    Arrow schema of dynamic model table, columns are ordered as concrete fields
+    :param model:
+    :return:
+    """
+    return pa.schema(
+        [
+            pa.field(field.name, get_arrow_type(field), nullable=field.null)
+            for field in model._meta.concrete_fields
+        ]
+    )
+
+
+class ChunkSink:
+    """
+    Write-only file keeping written bytes until they are taken.
+    Position grows on, Parquet footer refers to row groups by their offsets
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class ColumnarEncoder:
+    """
+    Encodes chunks of values_list() rows as Arrow record batches,
+    every chunk is a record batch of the stream or a Parquet row group
+    """
+
+    def __init__(self, model: models.Model, export_format: str):
+        require_pyarrow()
+        self.columns = tuple(field.name for field in model._meta.concrete_fields)
+        self.schema = get_arrow_schema(model)
+        self.sink = ChunkSink()
+        file = pa.PythonFile(self.sink, mode="w")
+        if export_format == "parquet":
+            self.writer = pq.ParquetWriter(file, self.schema)
+        else:
+            self.writer = pa.ipc.new_stream(file, self.schema)
+
+    def encode(self, rows: list[tuple]) -> bytes:
+        """
+        Encode rows transposed into columns
+        :param rows:
+        :return: encoded bytes ready to be sent
+        """
+        arrays = [
+            pa.array(values, type=field.type)
+            for values, field in zip(zip(*rows), self.schema)
+        ]
+        self.writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        return self.sink.take()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self.sink.take()
+
+
+class BodyReader:
+    """
+    Read-only file over request body stream, which has no file attributes
+    Arrow looks for
+    """
+
+    closed = False
+
+    def __init__(self, stream: Any):
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read() if size < 0 else self._stream.read(size)
+
+    def close(self):
+        self.closed = True
+
+
+def read_batches(
+    stream: Any, media_type: str
+) -> tuple[list[str], Iterator["pa.RecordBatch"]]:
+    """
+    Read Arrow IPC stream or Parquet request body as record batches.
+    Arrow stream is read as it arrives, Parquet file is spooled
+    to a temporary file first, its footer is at the end
+    :param stream:
+    :param media_type:
+    :return: column names and iterator of record batches
+    """
+    require_pyarrow()
+    stream = stream if stream is not None else io.BytesIO()
+    try:
+        if media_type in PARQUET_CONTENT_TYPES:
+            spool = tempfile.TemporaryFile()
+            shutil.copyfileobj(stream, spool)
+            spool.seek(0)
+            parquet_file = pq.ParquetFile(spool)
+            columns = parquet_file.schema_arrow.names
+            batches = parquet_file.iter_batches(
+                batch_size=settings.DYNAMIC_TABLES_ARROW_BATCH_SIZE
+            )
+        else:
+            reader = pa.ipc.open_stream(pa.PythonFile(BodyReader(stream), mode="r"))
+            columns = reader.schema.names
+            batches = iter(reader)
+    except pa.ArrowException as exc:
+        raise serializers.ValidationError(str(exc))
+
+    if len(set(columns)) != len(columns):
+        raise serializers.ValidationError(f"duplicate column names in {columns}")
+
+    def checked_batches():
+        try:
+            yield from batches
+        except pa.ArrowException as exc:
+            raise serializers.ValidationError(str(exc))
+
+    return columns, checked_batches()
+
+
+def is_clean(field: models.Field, array: "pa.Array") -> bool:
+    """
+    Check array cast to field type against field options,
+    like field.clean() does for a single value
+    :param field:
+    :param array:
+    :return:
+    """
+    if array.null_count and not field.null:
+        return False
+    if field.choices and array.null_count < len(array):
+        choices = pa.array([value for value, _ in field.flatchoices], array.type)
+        if not pc.all(pc.is_in(array.drop_null(), value_set=choices)).as_py():
+            return False
+
+    if pa.types.is_string(array.type):
+        if not field.blank and pc.any(pc.equal(array, "")).as_py():
+            return False
+        max_length = pc.max(pc.utf8_length(array)).as_py()
+        if field.max_length is not None and (max_length or 0) > field.max_length:
+            return False
+    elif pa.types.is_integer(array.type):
+        min_value, max_value = get_field_limits(field)
+        limits = pc.min_max(array).as_py()
+        if min_value is not None and limits["min"] is not None:
+            if limits["min"] < min_value:
+                return False
+        if max_value is not None and limits["max"] is not None:
+            if limits["max"] > max_value:
+                return False
+    return True
+
+
+def clean_batch(
+    fields: dict[str, models.Field], batch: "pa.RecordBatch"
+) -> Optional[list["pa.Array"]]:
+    """
+    Cast record batch columns to model field types and check them column by column.
+    Missing columns get field defaults
+    :param fields: model fields by name, without primary key
+    :param batch:
+    :return: arrays ordered as fields or None, if some values are not valid
+        and the batch has to be checked row by row to report them
+    """
+    names = set(batch.schema.names)
+    arrays = []
+    for name, field in fields.items():
+        arrow_type = get_arrow_type(field)
+        if name in names:
+            try:
+                array = batch.column(name).cast(arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                return None
+        else:
+            array = pa.array([field.get_default()] * batch.num_rows, arrow_type)
+
+        if not is_clean(field, array):
+            return None
+        arrays.append(array)
+    return arrays
+
+
+def write_csv(arrays: list["pa.Array"], names: list[str]) -> bytes:
+    """
+    Encode arrays as CSV for COPY ... FROM STDIN WITH (FORMAT csv),
+    strings are always quoted, so empty string and NULL stay different
+    :param arrays:
+    :param names:
+    :return:
+    """
+    sink = io.BytesIO()
+    pa_csv.write_csv(
+        pa.table(arrays, names=names),
+        sink,
+        pa_csv.WriteOptions(include_header=False),
+    )
+    return sink.getvalue()
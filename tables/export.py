@@ -0,0 +1,190 @@
+import csv
+import json
+from itertools import islice
+from typing import AsyncIterator, Iterator, Union
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+
+from .columnar import COLUMNAR_CONTENT_TYPES, ColumnarEncoder, require_pyarrow
+from .serializers import RowValuesSerializer, get_row_values_serializer
+
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    **COLUMNAR_CONTENT_TYPES,
+}
+
+
+class Echo:
+    """
+    Pseudo buffer for csv.writer, returns written line instead of storing it
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def ndjson_lines(
+    row_serializer: RowValuesSerializer, rows: Iterator[tuple]
+) -> Iterator[str]:
+    encode = row_serializer.encode
+    for row in rows:
+        yield json.dumps(encode(row)) + "\n"
+
+
+def csv_lines(
+    row_serializer: RowValuesSerializer, rows: Iterator[tuple]
+) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(row_serializer.columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+async def ndjson_alines(
+    row_serializer: RowValuesSerializer, chunks: AsyncIterator[list[tuple]]
+) -> AsyncIterator[str]:
+    # ASGI server sends every yielded part as a message, so rows go out in chunks
+    async for chunk in chunks:
+        yield "".join(ndjson_lines(row_serializer, chunk))
+
+
+async def csv_alines(
+    row_serializer: RowValuesSerializer, chunks: AsyncIterator[list[tuple]]
+) -> AsyncIterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(row_serializer.columns)
+    async for chunk in chunks:
+        yield "".join(map(writer.writerow, chunk))
+
+
+def columnar_parts(
+    encoder: ColumnarEncoder, chunks: Iterator[list[tuple]]
+) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield encoder.encode(chunk)
+    yield encoder.finish()
+
+
+async def columnar_aparts(
+    encoder: ColumnarEncoder, chunks: AsyncIterator[list[tuple]]
+) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield encoder.encode(chunk)
+    yield encoder.finish()
+
+
+async def achunks(queryset: QuerySet, chunk_size: int) -> AsyncIterator[list]:
+    """
+    Async iteration over chunks of queryset rows fetched from server-side cursor.
+    QuerySet.aiterator() of Django 4.2 runs values_list() query in the event loop,
+    so here the sync iterator is advanced in a thread, one chunk at a time
+    :param queryset:
+    :param chunk_size:
+    :return:
+    """
+    rows = queryset.iterator(chunk_size=chunk_size)
+    fetch_chunk = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    while True:
+        chunk = await fetch_chunk()
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            break
+
+
+def check_export_format(export_format: str):
+    if export_format not in EXPORT_CONTENT_TYPES:
+        raise serializers.ValidationError(
+            f"unsupported export format {export_format}, "
+            f"use one of {list(EXPORT_CONTENT_TYPES)}"
+        )
+    if export_format in COLUMNAR_CONTENT_TYPES:
+        require_pyarrow()
+
+
+def export_response(
+    lines: Union[Iterator, AsyncIterator], export_format: str, filename: str
+) -> StreamingHttpResponse:
+    return StreamingHttpResponse(
+        lines,
+        content_type=EXPORT_CONTENT_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{export_format}"'
+        },
+    )
+
+
+def stream_rows(
+    queryset: QuerySet, export_format: str, filename: str
+) -> StreamingHttpResponse:
+    """
+    Stream all rows of queryset encoded one at a time.
+    Rows are fetched with a server-side cursor on PostgreSQL,
+    so memory stays constant whatever the size of the table
+    :param queryset:
+    :param export_format: ndjson, csv, arrow or parquet
+    :param filename:
+    :return:
+    """
+    check_export_format(export_format)
+
+    row_serializer = get_row_values_serializer(queryset.model)
+    if export_format in COLUMNAR_CONTENT_TYPES:
+        # rows are encoded a record batch at a time
+        chunk_size = settings.DYNAMIC_TABLES_ARROW_BATCH_SIZE
+        rows = queryset.values_list(*row_serializer.columns).iterator(chunk_size)
+        encoder = ColumnarEncoder(queryset.model, export_format)
+        batches = iter(lambda: list(islice(rows, chunk_size)), [])
+        parts = columnar_parts(encoder, batches)
+        return export_response(parts, export_format, filename)
+
+    rows = queryset.values_list(*row_serializer.columns).iterator(
+        chunk_size=settings.DYNAMIC_TABLES_EXPORT_CHUNK_SIZE
+    )
+    lines = (
+        ndjson_lines(row_serializer, rows)
+        if export_format == "ndjson"
+        else csv_lines(row_serializer, rows)
+    )
+    return export_response(lines, export_format, filename)
+
+
+def astream_rows(
+    queryset: QuerySet, export_format: str, filename: str
+) -> StreamingHttpResponse:
+    """
+    stream_rows() for async views. Response body is an async iterator,
+    so under ASGI a slow client does not hold a worker thread
+    while rows are waiting to be sent
+    :param queryset:
+    :param export_format: ndjson, csv, arrow or parquet
+    :param filename:
+    :return:
+    """
+    check_export_format(export_format)
+
+    row_serializer = get_row_values_serializer(queryset.model)
+    if export_format in COLUMNAR_CONTENT_TYPES:
+        batches = achunks(
+            queryset.values_list(*row_serializer.columns),
+            settings.DYNAMIC_TABLES_ARROW_BATCH_SIZE,
+        )
+        encoder = ColumnarEncoder(queryset.model, export_format)
+        parts = columnar_aparts(encoder, batches)
+        return export_response(parts, export_format, filename)
+
+    chunks = achunks(
+        queryset.values_list(*row_serializer.columns),
+        settings.DYNAMIC_TABLES_EXPORT_CHUNK_SIZE,
+    )
+    lines = (
+        ndjson_alines(row_serializer, chunks)
+        if export_format == "ndjson"
+        else csv_alines(row_serializer, chunks)
+    )
+    return export_response(lines, export_format, filename)
@@ -0,0 +1,244 @@
+from typing import Any, Optional
+
+from django.db import models
+from django.db.models import F, Lookup, Q
+from django.db.models.lookups import In
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .utils import get_field_type
+
+
+def coerce_string(value: Any) -> str:
+    if not isinstance(value, str):
+        raise ValueError
+    return value
+
+
+def coerce_int(value: Any) -> int:
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError
+    return int(value)
+
+
+def coerce_float(value: Any) -> float:
+    if isinstance(value, bool):
+        raise ValueError
+    return float(value)
+
+
+def coerce_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "t", "1"):
+        return True
+    if isinstance(value, str) and value.lower() in ("false", "f", "0"):
+        return False
+    raise ValueError
+
+
+COERCERS = {
+    "string": coerce_string,
+    "int": coerce_int,
+    "float": coerce_float,
+    "bool": coerce_bool,
+}
+
+# filter operator to ORM lookup
+LOOKUPS = {
+    "eq": "exact",
+    "gt": "gt",
+    "gte": "gte",
+    "lt": "lt",
+    "lte": "lte",
+    "range": "range",
+    "in": "in",
+    "prefix": "startswith",
+    "isnull": "isnull",
+}
+
+# operators every field type supports
+TYPE_OPERATORS = {
+    "string": {"eq", "gt", "gte", "lt", "lte", "range", "in", "prefix", "isnull"},
+    "int": {"eq", "gt", "gte", "lt", "lte", "range", "in", "isnull"},
+    "float": {"eq", "gt", "gte", "lt", "lte", "range", "in", "isnull"},
+    "bool": {"eq", "in", "isnull"},
+}
+
+LIST_OPERATORS = ("in", "range")
+
+
+class AnyLookup(Lookup):
+    """
+    AnyLookup(F(field), [...]) compiles to field = ANY(%s) with the whole list
+    as a single array parameter on PostgreSQL, so the query is the same
+    for any number of values. Other backends get IN (...).
+    It is not registered on fields, querysets filter with the expression
+    """
+
+    lookup_name = "any"
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        if connection.vendor != "postgresql":
+            return In(self.lhs, self.rhs).as_sql(compiler, connection)
+
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        field = self.lhs.output_field
+        values = [
+            field.get_db_prep_value(value, connection, prepared=False)
+            for value in self.rhs
+        ]
+        return f"{lhs} = ANY(%s)", [*lhs_params, values]
+
+
+def get_model_field_types(model: models.Model) -> dict:
+    """
+    Map field name to DynamicModelField type, primary key is an int
+    :param model:
+    :return:
+    """
+    field_types = {}
+    for field in model._meta.concrete_fields:
+        field_types[field.name] = "int" if field.primary_key else get_field_type(field)
+    return field_types
+
+
+def compile_condition(field_types: dict, key: str, value: Any) -> Q:
+    """
+    Compile single "<field>[__<operator>]" condition to ORM lookup
+    :param field_types:
+    :param key:
+    :param value:
+    :return:
+    """
+    name, _, operator = key.partition("__")
+    operator = operator or "eq"
+
+    if name not in field_types:
+        raise serializers.ValidationError({key: f"unknown field {name}"})
+    field_type = field_types[name]
+    if operator not in TYPE_OPERATORS[field_type]:
+        raise serializers.ValidationError(
+            {key: f"operator {operator} is not supported for {field_type} field"}
+        )
+
+    try:
+        if operator == "isnull":
+            value = coerce_bool(value)
+        elif operator in LIST_OPERATORS:
+            if not isinstance(value, (list, tuple)):
+                raise ValueError
+            value = [COERCERS[field_type](item) for item in value]
+            if operator == "range" and len(value) != 2:
+                raise ValueError
+        else:
+            value = COERCERS[field_type](value)
+    except (TypeError, ValueError):
+        raise serializers.ValidationError(
+            {key: f"invalid value {value!r} for {operator} on {field_type} field"}
+        )
+
+    return Q(**{f"{name}__{LOOKUPS[operator]}": value})
+
+
+def compile_filters(model: models.Model, filters: dict) -> Q:
+    """
+    Compile filters to ORM lookups, all conditions must match.
+    Unknown fields, operators and type mismatches raise ValidationError
+    :param model:
+    :param filters: mapping "<field>[__<operator>]" to value, list for in and range
+    :return:
+    """
+    field_types = get_model_field_types(model)
+    condition = Q()
+    for key, value in filters.items():
+        condition &= compile_condition(field_types, key, value)
+    return condition
+
+
+def select_rows(
+    queryset: models.QuerySet,
+    ids: Optional[list[int]] = None,
+    filters: Optional[dict] = None,
+) -> models.QuerySet:
+    """
+    Narrow rows down to the listed ids or to rows matching filters
+    :param queryset:
+    :param ids:
+    :param filters: same conditions as in compile_filters
+    :return:
+    """
+    if ids is not None:
+        return queryset.filter(AnyLookup(F("pk"), ids))
+    return queryset.filter(compile_filters(queryset.model, filters))
+
+
+class DynamicTableFilter(BaseFilterBackend):
+    """
+    Filters rows with query parameters like
+    ?name=abc&price__gte=10&category__in=a,b&deleted__isnull=true
+    """
+
+    # query parameters which are not filters
+    reserved_params = {
+        "cursor",
+        "page_size",
+        "count",
+        "export",
+        "ordering",
+        "format",
+        "group_by",
+        "aggregate",
+    }
+
+    @staticmethod
+    def get_list_param(request, key: str) -> list[str]:
+        """
+        Values of repeated query parameter or comma separated list
+        :param request:
+        :param key:
+        :return:
+        """
+        values = request.query_params.getlist(key)
+        return values if len(values) > 1 else values[-1].split(",") if values else []
+
+    def get_filters(self, request) -> dict:
+        filters = {}
+        for key, values in request.query_params.lists():
+            if key in self.reserved_params:
+                continue
+            if key.partition("__")[2] in LIST_OPERATORS:
+                filters[key] = self.get_list_param(request, key)
+            else:
+                filters[key] = values[-1]
+        return filters
+
+    def filter_queryset(self, request, queryset, view):
+        filters = self.get_filters(request)
+        if not filters:
+            return queryset
+        return queryset.filter(compile_filters(queryset.model, filters))
+
+
+class DynamicTableOrderingFilter(OrderingFilter):
+    """
+    Orders rows by any table field, ?ordering=-price,name
+    Unknown fields are rejected instead of being ignored
+    """
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        if not params:
+            return None
+
+        ordering = [param.strip() for param in params.split(",") if param.strip()]
+        field_names = {field.name for field in queryset.model._meta.concrete_fields}
+        unknown_fields = [
+            order for order in ordering if order.lstrip("-") not in field_names
+        ]
+        if unknown_fields:
+            raise serializers.ValidationError(
+                {self.ordering_param: f"unknown fields {unknown_fields}"}
+            )
+        return ordering
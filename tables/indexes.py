@@ -0,0 +1,220 @@
+import hashlib
+import json
+from contextlib import nullcontext
+from typing import Any, Optional
+
+from django.db import DatabaseError, connection, models, transaction
+from django.db.backends.ddl_references import Statement
+
+from .filters import compile_filters
+from .models import DynamicModel
+
+# PostgreSQL schema editor has a template of concurrent index build,
+# but not of a unique one
+SQL_CREATE_UNIQUE_INDEX_CONCURRENTLY = (
+    "CREATE UNIQUE INDEX CONCURRENTLY %(name)s ON %(table)s%(using)s "
+    "(%(columns)s)%(include)s%(extra)s%(condition)s"
+)
+
+
+def get_index_name(db_table: str, spec: dict) -> str:
+    """
+    Name index after its table and definition, the same spec gets the same name
+    :param db_table:
+    :param spec:
+    :return:
+    """
+    digest = hashlib.sha256(
+        json.dumps(
+            [spec["fields"], spec.get("unique", False), spec.get("condition") or {}],
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()[:8]
+    suffix = "uniq" if spec.get("unique") else "idx"
+    max_length = connection.ops.max_name_length() or 63
+    return f"{db_table[:max_length - 15]}_{digest}_{suffix}"
+
+
+def build_index(model: Any, spec: dict) -> models.Index:
+    condition = (
+        compile_filters(model, spec["condition"]) if spec.get("condition") else None
+    )
+    return models.Index(fields=spec["fields"], name=spec["name"], condition=condition)
+
+
+def build_concurrently(model_object: Optional[DynamicModel] = None) -> bool:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    # nor on partitioned table
+    return (
+        connection.vendor == "postgresql"
+        and not connection.in_atomic_block
+        and not (model_object is not None and model_object.partitioning)
+    )
+
+
+def create_index_sql(
+    model: Any, spec: dict, schema_editor: Any, concurrently: bool
+) -> Statement:
+    """
+    CREATE [UNIQUE] INDEX [CONCURRENTLY] statement for index spec
+    :param model:
+    :param spec:
+    :param schema_editor:
+    :param concurrently:
+    :return:
+    """
+    kwargs = {"concurrently": True} if concurrently else {}
+    if spec.get("unique"):
+        kwargs["sql"] = (
+            SQL_CREATE_UNIQUE_INDEX_CONCURRENTLY
+            if concurrently
+            else schema_editor.sql_create_unique_index
+        )
+    return build_index(model, spec).create_sql(model, schema_editor, **kwargs)
+
+
+def drop_index_sql(
+    model: Any, spec: dict, schema_editor: Any, concurrently: bool
+) -> Statement:
+    kwargs = {"concurrently": True} if concurrently else {}
+    index = models.Index(fields=spec["fields"], name=spec["name"])
+    return index.remove_sql(model, schema_editor, **kwargs)
+
+
+def diff_indexes(
+    old_specs: Optional[list[dict]], new_specs: Optional[list[dict]]
+) -> tuple[list[dict], list[dict]]:
+    """
+    Compare index specs by name
+    :param old_specs:
+    :param new_specs:
+    :return: specs of indexes to drop and to create
+    """
+    old_by_name = {spec["name"]: spec for spec in old_specs or []}
+    new_by_name = {spec["name"]: spec for spec in new_specs or []}
+    dropped = [
+        spec for name, spec in old_by_name.items() if new_by_name.get(name) != spec
+    ]
+    created = [
+        spec for name, spec in new_by_name.items() if old_by_name.get(name) != spec
+    ]
+    return dropped, created
+
+
+def get_table_indexes(model: Any) -> set[str]:
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, model._meta.db_table
+        )
+    return {name for name, constraint in constraints.items() if constraint["index"]}
+
+
+def sync_indexes(
+    model_object: DynamicModel, model: Any, old_specs: Optional[list[dict]] = None
+) -> dict:
+    """
+    Build indexes of dynamic model which are new or changed since old specs
+    and drop the ones which are gone.
+    Runs outside of schema change transaction, so on PostgreSQL indexes are
+    built with CREATE INDEX CONCURRENTLY and don't block writes to the table.
+    Specs of indexes failed to build are removed from dynamic model, the table
+    change before the build is already committed, so failures are reported,
+    not raised
+    :param model_object:
+    :param model: model class with current table fields
+    :param old_specs:
+    :return: errors of indexes failed to build by index name
+    """
+    dropped, created = diff_indexes(old_specs, model_object.indexes)
+    if not dropped and not created:
+        return {}
+
+    concurrently = build_concurrently(model_object)
+    existing = get_table_indexes(model)
+    # invalid leftovers of failed concurrent builds are rebuilt
+    dropped += [spec for spec in created if spec["name"] in existing]
+
+    errors = {}
+    with connection.schema_editor(atomic=False) as schema_editor:
+        for spec in dropped:
+            if spec["name"] in existing:
+                schema_editor.execute(
+                    drop_index_sql(model, spec, schema_editor, concurrently)
+                )
+
+        for spec in created:
+            try:
+                with nullcontext() if concurrently else transaction.atomic():
+                    schema_editor.execute(
+                        create_index_sql(model, spec, schema_editor, concurrently)
+                    )
+            except DatabaseError as exc:
+                errors[spec["name"]] = str(exc)
+                if concurrently:
+                    # failed concurrent build leaves an invalid index behind
+                    schema_editor.execute(
+                        drop_index_sql(model, spec, schema_editor, concurrently)
+                    )
+
+    if errors:
+        model_object.indexes = [
+            spec for spec in model_object.indexes if spec["name"] not in errors
+        ]
+        if model_object.natural_key and not any(
+            spec["unique"]
+            and not spec["condition"]
+            and set(spec["fields"]) == set(model_object.natural_key)
+            for spec in model_object.indexes
+        ):
+            # e.g. table already has duplicate keys
+            model_object.natural_key = None
+        model_object.save(update_fields=["indexes", "natural_key"])
+    return errors
+
+
+def get_index_status(model: Any, specs: Optional[list[dict]]) -> list[dict]:
+    """
+    Index specs with build status, size in bytes and number of scans.
+    Status is one of valid, building, invalid and missing
+    :param model:
+    :param specs:
+    :return:
+    """
+    specs = specs or []
+    names = [spec["name"] for spec in specs]
+    found = {}
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            # indisready is set before the validation scan of a concurrent build,
+            # a build in progress is only known from its progress row
+            cursor.execute(
+                "SELECT c.relname, i.indisvalid, p.pid IS NOT NULL, "
+                "pg_relation_size(c.oid), s.idx_scan "
+                "FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = i.indexrelid "
+                "LEFT JOIN pg_stat_progress_create_index p "
+                "ON p.index_relid = i.indexrelid "
+                "WHERE i.indrelid = %s::regclass AND c.relname = ANY(%s)",
+                [connection.ops.quote_name(model._meta.db_table), names],
+            )
+            for name, valid, building, size, scans in cursor.fetchall():
+                status = "valid" if valid else "building" if building else "invalid"
+                found[name] = {"status": status, "size": size, "scans": scans}
+    else:
+        existing = get_table_indexes(model)
+        found = {
+            name: {"status": "valid", "size": None, "scans": None}
+            for name in names
+            if name in existing
+        }
+
+    return [
+        {
+            **spec,
+            **found.get(
+                spec["name"], {"status": "missing", "size": None, "scans": None}
+            ),
+        }
+        for spec in specs
+    ]
@@ -0,0 +1,435 @@
+import codecs
+import io
+import csv
+import json
+from typing import Any, Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, models, transaction
+from rest_framework import serializers
+
+from .columnar import (
+    ARROW_CONTENT_TYPES,
+    PARQUET_CONTENT_TYPES,
+    clean_batch,
+    read_batches,
+    write_csv,
+)
+from .utils import insert_rows
+
+CSV_CONTENT_TYPES = ("text/csv",)
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl")
+
+# booleans of text files, strings the row serializer accepts in any case
+TEXT_BOOLEANS = {
+    **{
+        value.lower(): False
+        for value in serializers.BooleanField.FALSE_VALUES
+        if isinstance(value, str)
+    },
+    **{
+        value.lower(): True
+        for value in serializers.BooleanField.TRUE_VALUES
+        if isinstance(value, str)
+    },
+}
+
+
+class StreamReader:
+    """
+    File-like object over an iterator of text chunks, read by copy_expert
+    """
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def read_lines(stream: Any) -> Iterator[str]:
+    """
+    Lazily decode request body stream line by line
+    :param stream:
+    :return:
+    """
+    if stream is None:
+        return iter(())
+    return codecs.iterdecode(iter(stream.readline, b""), "utf-8")
+
+
+def parse_csv(lines: Iterator[str]) -> tuple[list[str], Iterator[tuple[int, dict]]]:
+    """
+    Parse CSV lines, the first line is a header with column names
+    :param lines:
+    :return: column names and iterator of (line number, record)
+    """
+    reader = csv.reader(lines)
+    columns = next(reader, [])
+
+    def records():
+        for values in reader:
+            if not values:
+                continue
+            if len(values) != len(columns):
+                yield reader.line_num, ValidationError(
+                    f"expected {len(columns)} values, got {len(values)}"
+                )
+                continue
+            yield reader.line_num, dict(zip(columns, values))
+
+    return columns, records()
+
+
+def parse_ndjson(lines: Iterator[str]) -> tuple[list[str], Iterator[tuple[int, dict]]]:
+    """
+    Parse newline delimited JSON objects,
+    keys of the first object are checked as a header
+    :param lines:
+    :return: column names and iterator of (line number, record)
+    """
+
+    def records():
+        for line_num, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield line_num, ValidationError(str(exc))
+                continue
+            if not isinstance(record, dict):
+                yield line_num, ValidationError("line is not a JSON object")
+                continue
+            yield line_num, record
+
+    records_iterator = records()
+    first_record = next(records_iterator, None)
+    if first_record is None:
+        return [], iter(())
+
+    columns = list(first_record[1]) if isinstance(first_record[1], dict) else []
+
+    def chain():
+        yield first_record
+        yield from records_iterator
+
+    return columns, chain()
+
+
+class RowCleaner:
+    """
+    Cleans input records against dynamic model fields
+    """
+
+    def __init__(self, model: models.Model):
+        self.model = model
+        self.fields = {
+            field.name: field
+            for field in model._meta.concrete_fields
+            if not field.primary_key
+        }
+
+    def check_columns(self, columns: Iterable[str]):
+        unknown_columns = [column for column in columns if column not in self.fields]
+        if unknown_columns:
+            raise serializers.ValidationError(
+                f"field names {unknown_columns} are not valid "
+                f"for model {self.model.__name__}"
+            )
+
+    def clean(self, record: dict, from_text: bool = False) -> tuple:
+        """
+        Convert record into tuple of column values
+        :param record:
+        :param from_text: record values are strings read from text file
+        :return:
+        """
+        unknown_columns = set(record) - set(self.fields)
+        if unknown_columns:
+            raise ValidationError(f"unknown fields {sorted(unknown_columns)}")
+
+        values, errors = [], {}
+        for name, field in self.fields.items():
+            if name in record:
+                value = record[name]
+                if (
+                    from_text
+                    and value == ""
+                    and not isinstance(field, models.CharField)
+                ):
+                    value = None
+                elif from_text and isinstance(field, models.BooleanField):
+                    # model field takes t/f/1/0 and True/False only
+                    value = TEXT_BOOLEANS.get(value.lower(), value)
+            else:
+                value = field.get_default()
+
+            if value is None and field.null:
+                # row serializer accepts null for nullable fields whether blank or not
+                values.append(None)
+                continue
+
+            try:
+                values.append(field.clean(value, None))
+            except ValidationError as exc:
+                errors[name] = exc.messages
+
+        if errors:
+            raise ValidationError(errors)
+        return tuple(values)
+
+    def clean_values(self, record: dict) -> dict:
+        """
+        Clean values of given fields only, e.g. for update of existing rows
+        :param record:
+        :return:
+        """
+        unknown_columns = set(record) - set(self.fields)
+        if unknown_columns:
+            raise ValidationError(f"unknown fields {sorted(unknown_columns)}")
+
+        values, errors = {}, {}
+        for name, value in record.items():
+            field = self.fields[name]
+            if value is None and field.null:
+                values[name] = None
+                continue
+            try:
+                values[name] = field.clean(value, None)
+            except ValidationError as exc:
+                errors[name] = exc.messages
+
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+
+def encode_copy_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"%s"' % str(value).replace('"', '""')
+
+
+def clean_records(
+    cleaner: RowCleaner,
+    records: Iterator[tuple[int, Any]],
+    report: dict,
+    from_text: bool = False,
+    position: str = "line",
+) -> Iterator[tuple]:
+    """
+    Clean records one at a time, invalid ones are counted and reported
+    :param cleaner:
+    :param records: iterator of (position, record or ValidationError)
+    :param report: accepted and rejected counts and errors, updated in place
+    :param from_text:
+    :param position: name of record position in errors, line or row
+    :return: iterator of cleaned values tuples
+    """
+    max_errors = settings.DYNAMIC_TABLES_INGEST_MAX_ERRORS
+    for record_position, record in records:
+        try:
+            if isinstance(record, ValidationError):
+                raise record
+            values = cleaner.clean(record, from_text=from_text)
+        except ValidationError as exc:
+            report["rejected"] += 1
+            if len(report["errors"]) < max_errors:
+                report["errors"].append(
+                    {
+                        position: record_position,
+                        "errors": (
+                            exc.message_dict
+                            if hasattr(exc, "error_dict")
+                            else exc.messages
+                        ),
+                    }
+                )
+            continue
+
+        report["accepted"] += 1
+        yield values
+
+
+def load_rows(
+    model: models.Model, fields: dict[str, models.Field], rows: Iterator[tuple]
+):
+    """
+    Load rows of cleaned values into model table.
+    PostgreSQL uses COPY ... FROM STDIN, other databases batched INSERTs
+    :param model:
+    :param fields: fields by name, ordered as values
+    :param rows:
+    :return:
+    """
+    if connection.vendor == "postgresql":
+        copy_rows(model, fields.values(), rows)
+        return
+
+    batch_size = settings.DYNAMIC_TABLES_ROW_BATCH_SIZE
+    names = list(fields)
+    batch = []
+    with transaction.atomic():
+        for values in rows:
+            batch.append(dict(zip(names, values)))
+            if len(batch) >= batch_size:
+                insert_rows(model, batch, batch_size=batch_size)
+                batch = []
+        insert_rows(model, batch, batch_size=batch_size)
+
+
+def ingest_records(
+    model: models.Model,
+    columns: list[str],
+    records: Iterator[tuple[int, Any]],
+    from_text: bool = False,
+) -> dict:
+    """
+    Load records into dynamic model table.
+    PostgreSQL uses COPY ... FROM STDIN, other databases batched INSERTs.
+    Invalid records are counted and reported, they don't abort the load
+    :param model:
+    :param columns: header columns, checked before anything is loaded
+    :param records: iterator of (line number, record or ValidationError)
+    :param from_text:
+    :return: report with accepted and rejected counts and errors
+    """
+    cleaner = RowCleaner(model)
+    cleaner.check_columns(columns)
+
+    report = {"accepted": 0, "rejected": 0, "errors": []}
+    rows = clean_records(cleaner, records, report, from_text=from_text)
+    try:
+        load_rows(model, cleaner.fields, rows)
+    except DatabaseError as exc:
+        raise serializers.ValidationError(str(exc))
+
+    return report
+
+
+def ingest_batches(
+    model: models.Model, columns: list[str], batches: Iterator[Any]
+) -> dict:
+    """
+    Load Arrow record batches into dynamic model table in one transaction.
+    Batches are cast to field types and checked column by column and
+    copied to PostgreSQL as CSV encoded by Arrow. A batch with invalid values
+    is cleaned row by row instead, so they are reported like in other formats
+    :param model:
+    :param columns: column names, checked before anything is loaded
+    :param batches: iterator of Arrow record batches
+    :return: report with accepted and rejected counts and errors
+    """
+    cleaner = RowCleaner(model)
+    cleaner.check_columns(columns)
+    fields = cleaner.fields
+
+    report = {"accepted": 0, "rejected": 0, "errors": []}
+    start = 0
+    try:
+        with transaction.atomic():
+            for batch in batches:
+                arrays = clean_batch(fields, batch)
+                if arrays is None:
+                    records = enumerate(batch.to_pylist(), start=start)
+                    load_rows(
+                        model,
+                        fields,
+                        clean_records(cleaner, records, report, position="row"),
+                    )
+                elif connection.vendor == "postgresql":
+                    report["accepted"] += batch.num_rows
+                    csv_file = io.BytesIO(write_csv(arrays, list(fields)))
+                    copy_from(model, fields.values(), csv_file)
+                else:
+                    report["accepted"] += batch.num_rows
+                    values = (array.to_pylist() for array in arrays)
+                    load_rows(model, fields, zip(*values))
+                start += batch.num_rows
+    except DatabaseError as exc:
+        raise serializers.ValidationError(str(exc))
+
+    return report
+
+
+def copy_from(model: models.Model, fields: Iterable[models.Field], file: Any):
+    """
+    Load CSV file into model table with COPY ... FROM STDIN
+    :param model:
+    :param fields: fields of CSV columns
+    :param file: file-like object read by copy_expert
+    :return:
+    """
+    quote_name = connection.ops.quote_name
+    sql = "COPY %(table)s (%(columns)s) FROM STDIN WITH (FORMAT csv)" % {
+        "table": quote_name(model._meta.db_table),
+        "columns": ", ".join(quote_name(field.column) for field in fields),
+    }
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.copy_expert(sql, file)
+
+
+def copy_rows(
+    model: models.Model, fields: Iterable[models.Field], rows: Iterator[tuple]
+):
+    """
+    Stream rows into model table with COPY ... FROM STDIN
+    :param model:
+    :param fields:
+    :param rows: tuples of cleaned values, ordered as fields
+    :return:
+    """
+    lines = (",".join(map(encode_copy_value, row)) + "\n" for row in rows)
+    copy_from(model, fields, StreamReader(lines))
+
+
+def ingest_stream(
+    model: models.Model, stream: Any, content_type: Optional[str]
+) -> dict:
+    """
+    Parse CSV, NDJSON, Arrow IPC stream or Parquet request body stream
+    and load it into model table
+    :param model:
+    :param stream:
+    :param content_type:
+    :return:
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    lines = read_lines(stream)
+
+    if media_type in CSV_CONTENT_TYPES:
+        columns, records = parse_csv(lines)
+        return ingest_records(model, columns, records, from_text=True)
+    if media_type in NDJSON_CONTENT_TYPES:
+        columns, records = parse_ndjson(lines)
+        return ingest_records(model, columns, records)
+    if media_type in ARROW_CONTENT_TYPES + PARQUET_CONTENT_TYPES:
+        columns, batches = read_batches(stream, media_type)
+        return ingest_batches(model, columns, batches)
+
+    content_types = (
+        CSV_CONTENT_TYPES
+        + NDJSON_CONTENT_TYPES
+        + ARROW_CONTENT_TYPES
+        + PARQUET_CONTENT_TYPES
+    )
+    raise serializers.ValidationError(
+        f"unsupported content type {media_type}, use one of {content_types}"
+    )
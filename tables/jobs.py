@@ -0,0 +1,330 @@
+"""
+Background jobs of table updates and bulk uploads.
+
+Jobs are rows of the Job table. They are run by a thread pool of the server
+process (DYNAMIC_TABLES_JOB_WORKERS threads) and by worker processes
+of `python manage.py run_jobs`. Workers claim jobs one at a time, a table
+with a running job has its other jobs wait, so two jobs never change
+the same table at once. Running jobs get a heartbeat from their worker,
+a job without one for DYNAMIC_TABLES_JOB_LEASE seconds is left by a stopped
+worker and fails, jobs queued after it get to run
+"""
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Optional
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .ingest import ingest_stream
+from .models import DynamicModel, Job, SchemaChange
+from .online import fail_schema_change, run_schema_change
+from .schema import SchemaPlan
+from .serializers import DynamicModelSerializer
+from .utils import get_model
+
+logger = logging.getLogger(__name__)
+
+# advisory lock serializing job claims of all worker processes
+JOBS_LOCK_ID = 0x6474_6A6F
+# seconds between heartbeats and progress updates of a running job
+HEARTBEAT_INTERVAL = 1.0
+
+_executor = None
+_executor_lock = threading.Lock()
+_claim_lock = threading.Lock()
+
+
+def enqueue_job(model_object: DynamicModel, kind: str, payload: dict) -> Job:
+    """
+    Queue job of table, workers are woken up once the job is committed
+    :param model_object:
+    :param kind: Job.UPDATE_TABLE or Job.UPLOAD_ROWS
+    :param payload:
+    :return:
+    """
+    job = Job.objects.create(model=model_object, kind=kind, payload=payload)
+    transaction.on_commit(wake_workers)
+    return job
+
+
+def spool_upload(stream: Any) -> dict:
+    """
+    Save request body to a file read by upload job
+    :param stream:
+    :return: upload job payload without content type
+    """
+    fd, path = tempfile.mkstemp(
+        prefix="dynamic_tables_upload_",
+        dir=settings.DYNAMIC_TABLES_JOB_SPOOL_DIR or None,
+    )
+    with os.fdopen(fd, "wb") as file:
+        shutil.copyfileobj(stream if stream is not None else io.BytesIO(), file)
+        size = file.tell()
+    return {"path": path, "size": size}
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.DYNAMIC_TABLES_JOB_WORKERS,
+                thread_name_prefix="dynamic_tables_job",
+            )
+            # jobs left pending by the previous server process
+            _executor.submit(run_jobs_thread)
+    return _executor
+
+
+def start_workers(**kwargs):
+    """
+    request_started receiver creating worker threads with the first request
+    of the server process, so jobs queued before a restart run without
+    waiting for a new one
+    :param kwargs:
+    :return:
+    """
+    request_started.disconnect(start_workers)
+    if settings.DYNAMIC_TABLES_JOB_WORKERS:
+        get_executor()
+
+
+def wake_workers():
+    # without worker threads jobs are left to run_jobs worker processes
+    if settings.DYNAMIC_TABLES_JOB_WORKERS:
+        get_executor().submit(run_jobs_thread)
+
+
+def run_jobs_thread():
+    try:
+        run_jobs()
+    finally:
+        connection.close()
+
+
+def run_jobs() -> int:
+    """
+    Run jobs until no job can be claimed
+    :return: number of jobs run
+    """
+    count = 0
+    while (job := claim_job()) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+def claim_job() -> Optional[Job]:
+    """
+    Mark the oldest pending job of a table without running jobs as running.
+    Claims are serialized, so every claim sees jobs claimed before it.
+    Expired jobs are failed first
+    :return: None if there is no job to run
+    """
+    with _claim_lock, transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [JOBS_LOCK_ID])
+        expire_jobs()
+        job = (
+            Job.objects.filter(status=Job.PENDING)
+            .exclude(model__jobs__status=Job.RUNNING)
+            .order_by("id")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=["status", "started_at", "heartbeat_at"])
+    return job
+
+
+def expire_jobs():
+    """
+    Fail running jobs without heartbeat for the lease, their worker is gone.
+    A job is not run again, it may have been stopped halfway
+    :return:
+    """
+    expired = timezone.now() - timedelta(seconds=settings.DYNAMIC_TABLES_JOB_LEASE)
+    for job in Job.objects.filter(
+        Q(heartbeat_at__lt=expired)
+        | Q(heartbeat_at__isnull=True, started_at__lt=expired),
+        status=Job.RUNNING,
+    ):
+        logger.warning("job %s expired", job.id)
+        Job.objects.filter(id=job.id).update(
+            status=Job.FAILED,
+            error={"detail": "worker stopped before the job was finished"},
+            finished_at=timezone.now(),
+        )
+        cleanup = JOB_CLEANUPS.get(job.kind)
+        if cleanup is None:
+            continue
+        try:
+            cleanup(job)
+        except Exception:
+            # runs in a savepoint, the job is failed anyway
+            logger.exception("cleanup of job %s failed", job.id)
+
+
+def run_job(job: Job):
+    """
+    Run claimed job and save its result or error
+    :param job:
+    :return:
+    """
+    status, result, error = Job.DONE, None, None
+    done = threading.Event()
+    threading.Thread(target=keep_alive, args=(job, done), daemon=True).start()
+    try:
+        result = JOB_RUNNERS[job.kind](job)
+    except serializers.ValidationError as exc:
+        status, error = Job.FAILED, exc.detail
+    except Exception as exc:
+        logger.exception("job %s failed", job.id)
+        status, error = Job.FAILED, {"detail": str(exc)}
+    finally:
+        done.set()
+
+    finished = {"status": status, "result": result, "error": error}
+    if status == Job.DONE:
+        finished["progress"] = 1.0
+    # table may be gone with its jobs, nothing is left to update then
+    Job.objects.filter(id=job.id, status=Job.RUNNING).update(
+        finished_at=timezone.now(), **finished
+    )
+
+
+def keep_alive(job: Job, done: threading.Event):
+    """
+    Save heartbeat and progress of running job every HEARTBEAT_INTERVAL seconds
+    until done. Runs in its own thread and connection, the job connection
+    may be busy with a long statement, e.g. COPY of upload
+    :param job:
+    :param done:
+    :return:
+    """
+    try:
+        while not done.wait(HEARTBEAT_INTERVAL):
+            try:
+                Job.objects.filter(id=job.id).update(
+                    heartbeat_at=timezone.now(), progress=job.progress
+                )
+            except DatabaseError:
+                # missed heartbeats are fine, the lease is longer than the interval
+                logger.exception("heartbeat of job %s failed", job.id)
+    finally:
+        connection.close()
+
+
+def run_update_table(job: Job) -> dict:
+    """
+    Update table to the queued definition, validated again against
+    the table as left by earlier jobs
+    :param job:
+    :return: applied schema plan
+    """
+    instance = DynamicModel.objects.get(id=job.model_id)
+    serializer = DynamicModelSerializer(instance, data=job.payload["data"])
+    serializer.is_valid(raise_exception=True)
+    plan = SchemaPlan(instance, serializer.validated_data)
+    result = plan.as_dict()
+    try:
+        index_errors = plan.apply(job)
+    except DatabaseError as exc:
+        raise serializers.ValidationError(str(exc))
+    if index_errors:
+        result["index_errors"] = index_errors
+    return result
+
+
+class ProgressReader:
+    """
+    Spooled upload file read by ingest, keeps the share of it read so far
+    as job progress
+    """
+
+    def __init__(self, file: Any, size: int, job: Job):
+        self._file = file
+        self._size = size
+        self._job = job
+
+    def _track(self, data: bytes) -> bytes:
+        if self._size:
+            self._job.progress = min(1.0, self._file.tell() / self._size)
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        return self._track(self._file.read(size))
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._track(self._file.readline(size))
+
+
+def run_upload_rows(job: Job) -> dict:
+    """
+    Load spooled upload into table, the file is removed afterwards
+    :param job:
+    :return: upload report
+    """
+    path = job.payload["path"]
+    try:
+        model, model_object = get_model(job.model_id)
+        with open(path, "rb") as file:
+            reader = ProgressReader(file, job.payload["size"], job)
+            try:
+                return ingest_stream(model, reader, job.payload["content_type"])
+            finally:
+                DynamicModel.objects.bump_write_version(model_object.id)
+    finally:
+        os.remove(path)
+
+
+def cleanup_upload_rows(job: Job):
+    # spool file of another host is removed by nobody
+    if os.path.exists(job.payload["path"]):
+        os.remove(job.payload["path"])
+
+
+def run_online_change(job: Job) -> dict:
+    """
+    Backfill and swap of online schema change started by a request,
+    the change keeps its own status and progress
+    :param job:
+    :return:
+    """
+    change = run_schema_change(job.payload["change_id"])
+    return {"change_id": change.id, "status": change.status}
+
+
+def cleanup_online_change(job: Job):
+    change = SchemaChange.objects.select_related("model").get(
+        id=job.payload["change_id"]
+    )
+    if change.status in SchemaChange.RUNNING:
+        fail_schema_change(change, "worker stopped before the change was finished")
+
+
+JOB_RUNNERS = {
+    Job.UPDATE_TABLE: run_update_table,
+    Job.UPLOAD_ROWS: run_upload_rows,
+    Job.SCHEMA_CHANGE: run_online_change,
+}
+
+# run for jobs expired while running
+JOB_CLEANUPS = {
+    Job.UPLOAD_ROWS: cleanup_upload_rows,
+    Job.SCHEMA_CHANGE: cleanup_online_change,
+}
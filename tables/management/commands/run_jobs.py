@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tables.jobs import run_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued table update and upload jobs, polling for new ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="seconds between polls when no job is pending",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="exit when no job is left to run"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_jobs()
+            if count:
+                self.stdout.write(f"ran {count} jobs")
+            if options["once"]:
+                return
+            if not count:
+                time.sleep(options["interval"])
@@ -0,0 +1,311 @@
+"""
+Per-request phase timings and query counts of dynamic table endpoints,
+exported as Prometheus histograms and logged for slow requests.
+
+Views and helpers mark their phases with
+
+    with phase("get_model"):
+        ...
+
+which is a no-op when the request is not measured, MetricsMiddleware
+is dropped altogether unless DYNAMIC_TABLES_METRICS or
+DYNAMIC_TABLES_SLOW_REQUEST_MS is set
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseNotFound
+
+logger = logging.getLogger(__name__)
+
+# request being measured, copied into threads of sync_to_async
+_current: ContextVar[Optional["RequestMetrics"]] = ContextVar(
+    "dynamic_tables_request_metrics", default=None
+)
+
+SECONDS_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+# reusable, phases of requests which are not measured cost one lookup
+_not_measured = nullcontext()
+
+
+class Histogram:
+    """
+    Prometheus histogram with a fixed set of labels, kept in process memory
+    """
+
+    def __init__(self, name: str, documentation: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # label values to (per bucket counts, sum, count)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                    0,
+                ]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [
+                (label_values, list(counts), total, count)
+                for label_values, (counts, total, count) in self._series.items()
+            ]
+
+        for label_values, counts, total, count in sorted(series):
+            labels = ",".join(
+                f'{name}="{escape_label(value)}"'
+                for name, value in zip(self.labels, label_values)
+            )
+            cumulative = 0
+            for bound, bucket_count in zip(
+                (*self.buckets, "+Inf"), counts, strict=True
+            ):
+                cumulative += bucket_count
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+phase_seconds = Histogram(
+    "dynamic_tables_phase_seconds",
+    "Time spent in a phase of a request, phase total is the whole request",
+    ("endpoint", "table", "phase"),
+    SECONDS_BUCKETS,
+)
+phase_queries = Histogram(
+    "dynamic_tables_phase_queries",
+    "Number of SQL queries run in a phase of a request",
+    ("endpoint", "table", "phase"),
+    QUERIES_BUCKETS,
+)
+
+
+class RequestMetrics:
+    """
+    Phases of one request. Nested phases are measured on their own
+    and as part of the enclosing phase, sql phase is the time of all
+    queries of the request
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        # phase name to [seconds, queries]
+        self.phases = {}
+        self.active = set()
+
+    @contextmanager
+    def phase(self, name: str):
+        if name in self.active:
+            # e.g. aget_model falling back to get_model, measured once
+            yield
+            return
+
+        self.active.add(name)
+        start, queries = time.perf_counter(), self.queries
+        try:
+            yield
+        finally:
+            self.active.discard(name)
+            totals = self.phases.setdefault(name, [0.0, 0])
+            totals[0] += time.perf_counter() - start
+            totals[1] += self.queries - queries
+
+    def finish(self) -> dict:
+        return {
+            **self.phases,
+            "sql": [self.sql_seconds, self.queries],
+            "total": [time.perf_counter() - self.start, self.queries],
+        }
+
+
+def phase(name: str):
+    """
+    Context manager measuring a phase of the current request
+    :param name:
+    :return:
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return _not_measured
+    return metrics.phase(name)
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding query time to the current request
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_seconds += time.perf_counter() - start
+        metrics.queries += 1
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # connection_created receiver, the wrapper stays for reconnects
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def is_enabled() -> bool:
+    return bool(
+        settings.DYNAMIC_TABLES_METRICS or settings.DYNAMIC_TABLES_SLOW_REQUEST_MS
+    )
+
+
+def record(request: Any, response: Any, metrics: RequestMetrics):
+    """
+    Add request phases to histograms, log them if the request was slow
+    :param request:
+    :param response:
+    :param metrics:
+    :return:
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None or match.url_name == "metrics":
+        return
+    phases = metrics.finish()
+
+    if settings.DYNAMIC_TABLES_METRICS:
+        table = match.kwargs.get("id", "")
+        for name, (seconds, queries) in phases.items():
+            labels = (match.url_name, str(table), name)
+            phase_seconds.observe(labels, seconds)
+            phase_queries.observe(labels, queries)
+
+    total_ms = phases["total"][0] * 1000
+    slow_ms = settings.DYNAMIC_TABLES_SLOW_REQUEST_MS
+    if slow_ms and total_ms >= slow_ms:
+        logger.warning(
+            "slow request %s %s %s %.1fms %s",
+            request.method,
+            request.get_full_path(),
+            getattr(response, "status_code", None),
+            total_ms,
+            json.dumps(
+                {
+                    name: {"ms": round(seconds * 1000, 3), "queries": queries}
+                    for name, (seconds, queries) in phases.items()
+                }
+            ),
+        )
+
+
+class MetricsMiddleware:
+    """
+    Measures phases of every request, response rendering is the render phase
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        # rendered here, so JSON encoding is measured; Django skips
+        # rendering of already rendered responses
+        with phase("render"):
+            response.render()
+        return response
+
+
+def metrics_view(request):
+    """
+    Histograms in Prometheus text format. Every server process keeps its own
+    :param request:
+    :return:
+    """
+    if not settings.DYNAMIC_TABLES_METRICS:
+        return HttpResponseNotFound()
+    lines = phase_seconds.render() + phase_queries.render()
+    return HttpResponse(
+        "\n".join(lines) + "\n", content_type="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tables", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dynamicmodel",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,53 @@
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def field_signature(name, type, options):
+    options = {
+        key: value
+        for key, value in (options or {}).items()
+        if key not in ("name", "db_column")
+    }
+    definition = json.dumps(
+        [name, type, options], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(definition.encode()).hexdigest()
+
+
+def fill_signatures(apps, schema_editor):
+    """
+    Compute signatures and merge duplicate field definitions
+    """
+    DynamicModelField = apps.get_model("tables", "DynamicModelField")
+    Through = apps.get_model("tables", "DynamicModel").fields.through
+
+    kept = {}
+    for field in DynamicModelField.objects.order_by("id"):
+        signature = field_signature(field.name, field.type, field.options)
+        if signature in kept:
+            Through.objects.filter(dynamicmodelfield_id=field.id).update(
+                dynamicmodelfield_id=kept[signature]
+            )
+            field.delete()
+            continue
+
+        kept[signature] = field.id
+        field.signature = signature
+        field.save(update_fields=["signature"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tables", "0002_dynamicmodel_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dynamicmodelfield",
+            name="signature",
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_signatures, migrations.RunPython.noop),
+    ]
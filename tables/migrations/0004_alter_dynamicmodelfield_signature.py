@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tables", "0003_dynamicmodelfield_signature"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="dynamicmodelfield",
+            name="signature",
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+    ]
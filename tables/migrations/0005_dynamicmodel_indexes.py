@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tables", "0004_alter_dynamicmodelfield_signature"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dynamicmodel",
+            name="indexes",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
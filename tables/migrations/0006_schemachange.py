@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tables", "0005_dynamicmodel_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SchemaChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fields", models.JSONField()),
+                ("columns", models.JSONField()),
+                ("indexes", models.JSONField(default=dict)),
+                ("status", models.CharField(default="pending", max_length=16)),
+                ("min_id", models.BigIntegerField(null=True)),
+                ("max_id", models.BigIntegerField(null=True)),
+                ("last_id", models.BigIntegerField(null=True)),
+                ("rows_copied", models.BigIntegerField(default=0)),
+                ("error", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "model",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="schema_changes",
+                        to="tables.dynamicmodel",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tables", "0006_schemachange"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dynamicmodel",
+            name="natural_key",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
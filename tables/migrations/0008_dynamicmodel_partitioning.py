@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tables", "0007_dynamicmodel_natural_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dynamicmodel",
+            name="partitioning",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tables", "0010_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Summary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=32)),
+                ("group_by", models.JSONField(default=list)),
+                ("aggregates", models.JSONField(default=list)),
+                ("stale", models.BooleanField(default=False)),
+                ("built_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "model",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="summaries",
+                        to="tables.dynamicmodel",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="summary",
+            constraint=models.UniqueConstraint(
+                fields=("model", "name"), name="unique_summary"
+            ),
+        ),
+    ]
@@ -1,20 +1,271 @@
+import hashlib
+import json
+from typing import Optional
+
 from django.db import models
+from django.utils import timezone
+
+
+def normalize_field_options(options: Optional[dict]) -> dict:
+    """
+    Drop options that are derived from field name
+    :param options:
+    :return:
+    """
+    return {
+        key: value
+        for key, value in (options or {}).items()
+        if key not in ("name", "db_column")
+    }
+
+
+def field_signature(name: str, type: str, options: Optional[dict]) -> str:
+    """
+    Canonical hash of field definition
+    :param name:
+    :param type:
+    :param options:
+    :return:
+    """
+    definition = json.dumps(
+        [name, type, normalize_field_options(options)],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(definition.encode()).hexdigest()
+
+
+class DynamicModelFieldManager(models.Manager):
+    def resolve(self, fields: list[dict]) -> list["DynamicModelField"]:
+        """
+        Get or create field objects for the whole list of field definitions,
+        takes one query when all fields exist and three otherwise
+        :param fields: list of dicts with name, type and options
+        :return: field objects in the order of definitions
+        """
+        definitions = {}
+        for field in fields:
+            options = normalize_field_options(field.get("options"))
+            signature = field_signature(field.get("name"), field.get("type"), options)
+            definitions[signature] = (field.get("name"), field.get("type"), options)
+
+        resolved = {
+            field.signature: field for field in self.filter(signature__in=definitions)
+        }
+        missing = [
+            self.model(name=name, type=type, options=options, signature=signature)
+            for signature, (name, type, options) in definitions.items()
+            if signature not in resolved
+        ]
+        if missing:
+            # fields created concurrently by another request are skipped here
+            self.bulk_create(missing, ignore_conflicts=True)
+            resolved.update(
+                (field.signature, field)
+                for field in self.filter(
+                    signature__in=[field.signature for field in missing]
+                )
+            )
+
+        return [
+            resolved[
+                field_signature(
+                    field.get("name"), field.get("type"), field.get("options")
+                )
+            ]
+            for field in fields
+        ]
 
 
 class DynamicModelField(models.Model):
     name = models.CharField(max_length=256)
     type = models.CharField(max_length=128)
     options = models.JSONField(blank=True, null=True)
+    # hash of name, type and options, makes every field definition stored once
+    signature = models.CharField(max_length=64, unique=True, editable=False)
+
+    objects = DynamicModelFieldManager()
+
+    def save(self, *args, **kwargs):
+        self.signature = field_signature(self.name, self.type, self.options)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} - {self.type}"
 
 
+class DynamicModelManager(models.Manager):
+    def bump_write_version(self, model_id: int) -> int:
+        """
+        Mark rows of dynamic model table changed, cached pages and ETags
+        of the previous write version are no longer valid
+        :param model_id:
+        :return: number of updated dynamic models
+        """
+        return self.filter(id=model_id).update(
+            write_version=models.F("write_version") + 1, modified_at=timezone.now()
+        )
+
+    async def abump_write_version(self, model_id: int) -> int:
+        return await self.filter(id=model_id).aupdate(
+            write_version=models.F("write_version") + 1, modified_at=timezone.now()
+        )
+
+
 class DynamicModel(models.Model):
     name = models.CharField(max_length=256, unique=True)
     fields = models.ManyToManyField(DynamicModelField, related_name="models")
     options = models.JSONField(blank=True, null=True)
     admin_opts = models.JSONField(blank=True, null=True)
+    # bumped on every schema change, used to invalidate cached model classes
+    version = models.PositiveIntegerField(default=1)
+    # secondary indexes, list of {"name", "fields", "unique", "condition"}
+    indexes = models.JSONField(blank=True, null=True)
+    # field names identifying a row, backed by a unique index, used by upsert
+    natural_key = models.JSONField(blank=True, null=True)
+    # PostgreSQL partition scheme, {"type": "range" | "list" | "hash", "field"},
+    # "detached" lists partition tables detached from the table and kept
+    partitioning = models.JSONField(blank=True, null=True)
+    # bumped on every write of rows and schema change, ETag of table rows
+    write_version = models.PositiveBigIntegerField(default=1)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    objects = DynamicModelManager()
+
+    def mark_modified(self):
+        """
+        Bump write version on the next save. F() expression keeps versions
+        bumped by concurrent writes, refresh_from_db() reads the new one
+        :return:
+        """
+        self.write_version = models.F("write_version") + 1
+        self.modified_at = timezone.now()
 
     def __str__(self):
         return self.name
+
+
+class SchemaChange(models.Model):
+    """
+    Online change of dynamic model column types, applied in background
+    with shadow columns filled in batches
+    """
+
+    PENDING = "pending"
+    BACKFILLING = "backfilling"
+    SWAPPING = "swapping"
+    DONE = "done"
+    FAILED = "failed"
+    RUNNING = (PENDING, BACKFILLING, SWAPPING)
+
+    model = models.ForeignKey(
+        DynamicModel, on_delete=models.CASCADE, related_name="schema_changes"
+    )
+    # requested field definitions, saved to dynamic model when columns are swapped
+    fields = models.JSONField()
+    # list of {"field", "column", "shadow", "type"} of changed columns
+    columns = models.JSONField()
+    # shadow indexes renamed to index names on swap, {"<shadow name>": "<name>"}
+    indexes = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, default=PENDING)
+    # id range of rows existing when the change started, newer rows are
+    # filled by trigger
+    min_id = models.BigIntegerField(null=True)
+    max_id = models.BigIntegerField(null=True)
+    last_id = models.BigIntegerField(null=True)
+    rows_copied = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def progress(self) -> float:
+        if self.status == self.DONE:
+            return 1.0
+        if self.min_id is None or self.last_id is None:
+            return 0.0
+        return min(
+            1.0, (self.last_id - self.min_id + 1) / (self.max_id - self.min_id + 1)
+        )
+
+    def __str__(self):
+        return f"{self.model} - {self.status}"
+
+
+class Summary(models.Model):
+    """
+    Rows of dynamic model grouped by fields with aggregates, kept in a table
+    of their own and updated by every inserted batch of rows
+    """
+
+    model = models.ForeignKey(
+        DynamicModel, on_delete=models.CASCADE, related_name="summaries"
+    )
+    name = models.CharField(max_length=32)
+    # field names
+    group_by = models.JSONField(default=list)
+    # "<function>[:<field>]" items, like aggregate parameter of /rows/aggregate
+    aggregates = models.JSONField(default=list)
+    # set when rows are updated, deleted or truncated, summary is rebuilt on read
+    stale = models.BooleanField(default=False)
+    built_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["model", "name"], name="unique_summary")
+        ]
+
+    @property
+    def fields(self) -> set[str]:
+        return set(self.group_by) | {
+            aggregate.partition(":")[2]
+            for aggregate in self.aggregates
+            if ":" in aggregate
+        }
+
+    def __str__(self):
+        return f"{self.model} - {self.name}"
+
+
+class Job(models.Model):
+    """
+    Table update, bulk upload or online schema change run in background
+    by a worker, jobs of one table run one at a time in the order they were queued
+    """
+
+    UPDATE_TABLE = "update_table"
+    UPLOAD_ROWS = "upload_rows"
+    SCHEMA_CHANGE = "schema_change"
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    model = models.ForeignKey(
+        DynamicModel, on_delete=models.CASCADE, related_name="jobs"
+    )
+    kind = models.CharField(max_length=32)
+    status = models.CharField(max_length=16, default=PENDING)
+    # job input, table definition of update or spooled file of upload
+    payload = models.JSONField(default=dict)
+    # share of work done, uploads report the share of file read
+    progress = models.FloatField(default=0.0)
+    # schema plan of update, report of upload
+    result = models.JSONField(blank=True, null=True)
+    # error details in the format of a 400 response
+    error = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # saved by the worker while the job runs, jobs of stopped workers expire
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+    def __str__(self):
+        return f"{self.model} - {self.kind} - {self.status}"
@@ -0,0 +1,359 @@
+import time
+from typing import Any
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.backends.utils import truncate_name
+from rest_framework import serializers
+
+from .indexes import build_concurrently, create_index_sql
+from .models import DynamicModelField, SchemaChange
+from .registry import model_registry
+from .schema import SchemaPlan, cast_sql, get_db_table, table_model
+
+
+def set_lock_timeout(cursor: Any):
+    # DDL waiting for a lock would block every query queued behind it
+    cursor.execute(
+        "SELECT set_config('lock_timeout', %s, true)",
+        [f"{settings.DYNAMIC_TABLES_ALTER_LOCK_TIMEOUT_MS}ms"],
+    )
+
+
+def get_trigger_name(change: SchemaChange) -> str:
+    return f"dt_online_alter_{change.id}"
+
+
+def get_check_name(change: SchemaChange, column: dict) -> str:
+    return truncate_name(
+        f"dt_online_alter_{change.id}_{column['column']}",
+        connection.ops.max_name_length(),
+    )
+
+
+def get_change_table(change: SchemaChange) -> str:
+    return get_db_table(change.model.name, change.model.options)
+
+
+def check_online_plan(plan: SchemaPlan) -> list[tuple[models.Field, models.Field]]:
+    """
+    Check that the plan only changes column types, which can be applied online
+    :param plan:
+    :return: old and new fields of the columns to change
+    """
+    if connection.vendor != "postgresql":
+        raise serializers.ValidationError(
+            {"online": "online schema changes are supported on PostgreSQL only"}
+        )
+    if plan.model_object.partitioning:
+        raise serializers.ValidationError(
+            {"online": "online schema changes are not supported on partitioned tables"}
+        )
+    if (
+        plan.model_object.name != plan.new_model.get("name")
+        or plan.options_changed
+        or plan.renamed
+        or plan.added
+        or plan.removed
+        or plan.dropped_indexes
+        or plan.created_indexes
+        or plan.model_object.natural_key != plan.new_natural_key
+    ):
+        raise serializers.ValidationError(
+            {
+                "online": "only field types can be changed online, "
+                "apply other changes with a regular update"
+            }
+        )
+
+    plan.check_summaries()
+    alters = plan.physical_alters()
+    if not alters:
+        raise serializers.ValidationError(
+            {"online": "there are no column type changes to apply"}
+        )
+    for old_field, new_field in alters:
+        if (old_field.null, old_field.unique, old_field.db_index) != (
+            new_field.null,
+            new_field.unique,
+            new_field.db_index,
+        ):
+            raise serializers.ValidationError(
+                {"online": f"only type of field {new_field.name} can be changed online"}
+            )
+
+    if plan.model_object.schema_changes.filter(
+        status__in=SchemaChange.RUNNING
+    ).exists():
+        raise serializers.ValidationError(
+            {"online": "table has an online schema change in progress"}
+        )
+    return alters
+
+
+def start_schema_change(plan: SchemaPlan) -> SchemaChange:
+    """
+    Start online change of column types.
+    Shadow columns of new types are added and kept in sync by a trigger
+    in one short transaction, the rest is left to run_schema_change
+    run by a job of the table
+    :param plan:
+    :return:
+    """
+    alters = check_online_plan(plan)
+    change = SchemaChange.objects.create(
+        model=plan.model_object,
+        fields=plan.new_model.get("fields"),
+        columns=[
+            {
+                "field": new_field.name,
+                "column": new_field.column,
+                "shadow": truncate_name(
+                    f"{new_field.column}__online", connection.ops.max_name_length()
+                ),
+                "type": new_field.db_parameters(connection)["type"],
+                "null": new_field.null,
+            }
+            for _, new_field in alters
+        ],
+    )
+
+    try:
+        prepare_change(change)
+    except Exception as exc:
+        change.status = SchemaChange.FAILED
+        change.error = str(exc)
+        change.save()
+        raise serializers.ValidationError({"online": str(exc)})
+    return change
+
+
+def prepare_change(change: SchemaChange):
+    quote_name = connection.ops.quote_name
+    table = quote_name(get_change_table(change))
+    trigger = get_trigger_name(change)
+
+    actions, assignments = [], []
+    for column in change.columns:
+        shadow = quote_name(column["shadow"])
+        actions.append(f"ADD COLUMN {shadow} {column['type']} NULL")
+        if not column["null"]:
+            # validated later without blocking writes, lets SET NOT NULL skip
+            # the table scan on swap
+            actions.append(
+                f"ADD CONSTRAINT {quote_name(get_check_name(change, column))} "
+                f"CHECK ({shadow} IS NOT NULL) NOT VALID"
+            )
+        value = cast_sql(f"NEW.{quote_name(column['column'])}", column["type"])
+        assignments.append(f"NEW.{shadow} := {value};")
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        set_lock_timeout(cursor)
+        cursor.execute(f"ALTER TABLE {table} {', '.join(actions)}")
+        cursor.execute(
+            f"CREATE FUNCTION {trigger}() RETURNS trigger AS $$ "
+            f"BEGIN {' '.join(assignments)} RETURN NEW; END "
+            f"$$ LANGUAGE plpgsql"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {trigger} BEFORE INSERT OR UPDATE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION {trigger}()"
+        )
+        # rows added from now on are filled by trigger
+        cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table}")
+        change.min_id, change.max_id = cursor.fetchone()
+        if change.min_id is not None:
+            change.last_id = change.min_id - 1
+        change.save()
+
+
+def run_schema_change(change_id: int) -> SchemaChange:
+    """
+    Backfill shadow columns, build their indexes and swap them with
+    the old columns. Failed change is rolled back, the table stays as it was
+    :param change_id:
+    :return:
+    """
+    change = SchemaChange.objects.select_related("model").get(id=change_id)
+    try:
+        backfill(change)
+        build_shadow_indexes(change)
+        swap_columns(change)
+    except Exception as exc:
+        fail_schema_change(change, str(exc))
+    return change
+
+
+def fail_schema_change(change: SchemaChange, error: str):
+    """
+    Mark change failed and roll it back, also for changes left
+    by a stopped worker. Swap is a single transaction, it either saved
+    the change done or left no trace
+    :param change:
+    :param error:
+    :return:
+    """
+    change.status = SchemaChange.FAILED
+    change.error = error
+    change.save()
+    cleanup(change)
+
+
+def backfill(change: SchemaChange):
+    """
+    Copy existing rows to shadow columns in id ranges,
+    every range is a short transaction followed by a pause
+    :param change:
+    :return:
+    """
+    change.status = SchemaChange.BACKFILLING
+    change.save()
+    if change.max_id is None:
+        return
+
+    quote_name = connection.ops.quote_name
+    assignments = ", ".join(
+        f"{quote_name(column['shadow'])} = "
+        f"{cast_sql(quote_name(column['column']), column['type'])}"
+        for column in change.columns
+    )
+    sql = (
+        f"UPDATE {quote_name(get_change_table(change))} SET {assignments} "
+        f"WHERE id > %s AND id <= %s"
+    )
+    batch_size = settings.DYNAMIC_TABLES_ALTER_BATCH_SIZE
+    delay = settings.DYNAMIC_TABLES_ALTER_BATCH_DELAY_MS / 1000
+
+    while change.last_id < change.max_id:
+        upper = min(change.last_id + batch_size, change.max_id)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [change.last_id, upper])
+            change.rows_copied += cursor.rowcount
+            change.last_id = upper
+            change.save()
+        if delay:
+            time.sleep(delay)
+
+
+def build_shadow_indexes(change: SchemaChange):
+    """
+    Validate NOT NULL checks and build indexes of changed fields on shadow columns,
+    neither blocks writes to the table
+    :param change:
+    :return:
+    """
+    quote_name = connection.ops.quote_name
+    db_table = get_change_table(change)
+    with connection.cursor() as cursor:
+        for column in change.columns:
+            if not column["null"]:
+                cursor.execute(
+                    f"ALTER TABLE {quote_name(db_table)} VALIDATE CONSTRAINT "
+                    f"{quote_name(get_check_name(change, column))}"
+                )
+
+    names = {column["field"] for column in change.columns}
+    specs = [
+        spec
+        for spec in change.model.indexes or []
+        if names & set(spec["fields"])
+        or names & {key.partition("__")[0] for key in spec.get("condition") or {}}
+    ]
+    if not specs:
+        return
+
+    model = table_model(
+        db_table,
+        {
+            field["name"]: (field["type"], field.get("options"))
+            for field in change.fields
+        },
+        columns={column["field"]: column["shadow"] for column in change.columns},
+    )
+    concurrently = build_concurrently()
+    with connection.schema_editor(atomic=False) as schema_editor:
+        for spec in specs:
+            shadow_spec = {
+                **spec,
+                "name": truncate_name(
+                    f"{spec['name']}_online", connection.ops.max_name_length()
+                ),
+            }
+            # saved first, so the index is dropped if its build fails
+            change.indexes[shadow_spec["name"]] = spec["name"]
+            change.save()
+            schema_editor.execute(
+                create_index_sql(model, shadow_spec, schema_editor, concurrently)
+            )
+
+
+def swap_columns(change: SchemaChange):
+    """
+    Replace old columns with shadow ones and save new fields to dynamic model
+    in one short transaction
+    :param change:
+    :return:
+    """
+    change.status = SchemaChange.SWAPPING
+    change.save()
+
+    quote_name = connection.ops.quote_name
+    table = quote_name(get_change_table(change))
+    trigger = get_trigger_name(change)
+    with transaction.atomic(), connection.cursor() as cursor:
+        set_lock_timeout(cursor)
+        cursor.execute(f"DROP TRIGGER {trigger} ON {table}")
+        cursor.execute(f"DROP FUNCTION {trigger}()")
+        for column in change.columns:
+            name = quote_name(column["column"])
+            cursor.execute(f"ALTER TABLE {table} DROP COLUMN {name} CASCADE")
+            cursor.execute(
+                f"ALTER TABLE {table} RENAME COLUMN "
+                f"{quote_name(column['shadow'])} TO {name}"
+            )
+            if not column["null"]:
+                # validated check constraint proves there are no NULLs
+                check = quote_name(get_check_name(change, column))
+                cursor.execute(
+                    f"ALTER TABLE {table} ALTER COLUMN {name} SET NOT NULL, "
+                    f"DROP CONSTRAINT {check}"
+                )
+        for shadow_name, name in change.indexes.items():
+            cursor.execute(
+                f"ALTER INDEX {quote_name(shadow_name)} RENAME TO {quote_name(name)}"
+            )
+
+        model_object = change.model
+        model_object.fields.set(DynamicModelField.objects.resolve(change.fields))
+        model_object.version += 1
+        model_object.mark_modified()
+        model_object.save()
+
+        change.status = SchemaChange.DONE
+        change.save()
+
+    model_registry.invalidate(model_object.id)
+
+
+def cleanup(change: SchemaChange):
+    """
+    Drop trigger, shadow columns and indexes of failed change
+    :param change:
+    :return:
+    """
+    quote_name = connection.ops.quote_name
+    table = quote_name(get_change_table(change))
+    trigger = get_trigger_name(change)
+    with transaction.atomic(), connection.cursor() as cursor:
+        set_lock_timeout(cursor)
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+        cursor.execute(f"DROP FUNCTION IF EXISTS {trigger}()")
+        for shadow_name in change.indexes:
+            cursor.execute(f"DROP INDEX IF EXISTS {quote_name(shadow_name)}")
+        cursor.execute(
+            f"ALTER TABLE {table} "
+            + ", ".join(
+                f"DROP COLUMN IF EXISTS {quote_name(column['shadow'])}"
+                for column in change.columns
+            )
+        )
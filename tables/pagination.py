@@ -0,0 +1,279 @@
+import json
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from .stats import count_rows
+
+
+def is_nullable(model, name: str) -> bool:
+    return name != "pk" and model._meta.get_field(name).null
+
+
+def reverse_ordering(ordering: tuple) -> tuple:
+    return tuple(
+        order[1:] if order.startswith("-") else f"-{order}" for order in ordering
+    )
+
+
+class DynamicTableCursorPagination(CursorPagination):
+    """
+    Keyset pagination over dynamic table rows.
+    Rows are ordered by the declared sort columns with primary key as tie-breaker,
+    the cursor holds values of the whole ordering of the last row,
+    so every page is a single indexed range scan regardless of its depth
+    """
+
+    page_size = settings.DYNAMIC_TABLES_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.DYNAMIC_TABLES_MAX_PAGE_SIZE
+    ordering = ()
+    # ?count=estimate or ?count=exact adds number of matching rows to the page
+    count_query_param = "count"
+    count_modes = ("estimate", "exact")
+
+    def get_ordering(self, request, queryset, view):
+        ordering = ()
+        for filter_cls in getattr(view, "filter_backends", []):
+            if hasattr(filter_cls, "get_ordering"):
+                # ordering requested by client
+                ordering = filter_cls().get_ordering(request, queryset, view) or ()
+                break
+
+        # fall back to sort columns declared in model options
+        ordering = tuple(ordering) or tuple(
+            order for order in queryset.model._meta.ordering if isinstance(order, str)
+        )
+
+        # primary key makes every position unique
+        pk_name = queryset.model._meta.pk.name
+        if not any(order.lstrip("-") in (pk_name, "pk") for order in ordering):
+            ordering += (pk_name,)
+        return ordering
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Prepare query of the requested page, nothing is fetched here
+        :param queryset:
+        :param request:
+        :param view:
+        :return: queryset of page rows with one extra row, None if not paginated
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        # column names of rows fetched with values_list()
+        self.columns = queryset.query.values_select
+
+        self.count, self.count_exact = None, None
+        self.count_mode = request.query_params.get(self.count_query_param)
+        if self.count_mode and self.count_mode not in self.count_modes:
+            raise serializers.ValidationError(
+                {self.count_query_param: f"use one of {list(self.count_modes)}"}
+            )
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (self.reverse, self.current_position) = (False, None)
+        else:
+            # positions are unique, so offset of the cursor is always 0
+            (_, self.reverse, self.current_position) = self.cursor
+
+        ordering = reverse_ordering(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*self.get_order_by(ordering))
+
+        if self.current_position is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(
+                    queryset.model,
+                    ordering,
+                    self.decode_position(self.current_position),
+                )
+            )
+
+        # fetch an extra row to find out if there is a page following this one
+        return queryset[: self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+
+        if self.count_mode:
+            self.count, self.count_exact = count_rows(
+                queryset, exact=self.count_mode == "exact"
+            )
+        return self.set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views, page rows are fetched with async ORM
+        """
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+
+        if self.count_mode:
+            self.count, self.count_exact = await sync_to_async(count_rows)(
+                queryset, exact=self.count_mode == "exact"
+            )
+        return self.set_page([row async for row in page_queryset])
+
+    def set_page(self, results: list) -> list:
+        """
+        Keep page rows and positions of previous and next pages
+        :param results: page rows with one extra row
+        :return:
+        """
+        reverse, current_position = self.reverse, self.current_position
+        self.page = list(results[: self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_paginated_data(self, data) -> OrderedDict:
+        response = OrderedDict()
+        if self.count is not None:
+            response["count"] = self.count
+            response["count_exact"] = self.count_exact
+        response["next"] = self.get_next_link()
+        response["previous"] = self.get_previous_link()
+        response["results"] = data
+        return response
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    @staticmethod
+    def get_order_by(ordering: tuple) -> list:
+        # explicit NULLS placement keeps keyset filter the same on every backend
+        return [
+            F(order[1:]).desc(nulls_first=True)
+            if order.startswith("-")
+            else F(order).asc(nulls_last=True)
+            for order in ordering
+        ]
+
+    @staticmethod
+    def get_leading_bound(name: str, descending: bool, value, null: bool) -> Q:
+        """
+        Range of the first sort column holding every row following the position,
+        it bounds the index scan, the expanded filter alone can't
+        :param name:
+        :param descending:
+        :param value: first column value of the position
+        :param null: column is nullable
+        :return:
+        """
+        if descending:
+            # NULLs go first in descending order, rows after NULL are not bounded
+            return Q() if value is None else Q(**{f"{name}__lte": value})
+        if value is None:
+            return Q(**{f"{name}__isnull": True})
+        bound = Q(**{f"{name}__gte": value})
+        return bound | Q(**{f"{name}__isnull": True}) if null else bound
+
+    @classmethod
+    def get_keyset_filter(cls, model, ordering: tuple, position: list) -> Q:
+        """
+        Build filter for rows following the position in given ordering,
+        (a, b) > (x, y) is expanded to a >= x AND (a > x OR (a = x AND b > y)).
+        NULL branches are left out for NOT NULL columns
+        :param model:
+        :param ordering:
+        :param position:
+        :return:
+        """
+        keyset_filter = Q(pk__in=[])
+        equal_filter = Q()
+        for order, value in zip(ordering, position):
+            name = order.lstrip("-")
+            null = is_nullable(model, name)
+            if order.startswith("-"):
+                # NULLs go first in descending order
+                after = (
+                    Q(**{f"{name}__isnull": False})
+                    if value is None
+                    else Q(**{f"{name}__lt": value})
+                )
+            else:
+                # NULLs go last in ascending order
+                after = Q(pk__in=[]) if value is None else Q(**{f"{name}__gt": value})
+                if null and value is not None:
+                    after |= Q(**{f"{name}__isnull": True})
+
+            keyset_filter |= equal_filter & after
+            equal_filter &= (
+                Q(**{f"{name}__isnull": True}) if value is None else Q(**{name: value})
+            )
+
+        name = ordering[0].lstrip("-")
+        return (
+            cls.get_leading_bound(
+                name,
+                ordering[0].startswith("-"),
+                position[0],
+                is_nullable(model, name),
+            )
+            & keyset_filter
+        )
+
+    def decode_position(self, position: str) -> list:
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, tuple):
+            instance = dict(zip(self.columns, instance))
+
+        values = []
+        for order in ordering:
+            name = order.lstrip("-")
+            if isinstance(instance, dict):
+                values.append(instance[name])
+            else:
+                values.append(getattr(instance, name))
+        return json.dumps(values)
@@ -0,0 +1,253 @@
+from typing import Any
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.db.backends.utils import truncate_name
+from rest_framework import serializers
+
+from .models import DynamicModel
+from .online import set_lock_timeout
+
+
+def check_partitioned(model_object: DynamicModel):
+    if not model_object.partitioning:
+        raise serializers.ValidationError(
+            f"table {model_object.name} is not partitioned"
+        )
+
+
+def get_partition_table(model: Any, name: str) -> str:
+    return truncate_name(
+        f"{model._meta.db_table}_{name}", connection.ops.max_name_length()
+    )
+
+
+def get_bounds_sql(model: Any, partitioning: dict, bounds: dict) -> str:
+    """
+    FOR VALUES clause of partition, values are cleaned by partition field
+    and quoted as literals
+    :param model:
+    :param partitioning:
+    :param bounds: validated PartitionBoundsSerializer data
+    :return:
+    """
+    field = model._meta.get_field(partitioning["field"])
+    partition_type = partitioning["type"]
+    quote_value = connection.schema_editor().quote_value
+
+    def literal(value: Any) -> str:
+        if value is None:
+            return "NULL"
+        try:
+            return str(quote_value(field.clean(value, None)))
+        except ValidationError as exc:
+            raise serializers.ValidationError({field.name: exc.messages})
+
+    if bounds["default"]:
+        if partition_type == "hash":
+            raise serializers.ValidationError(
+                "hash partitioned table can't have a default partition"
+            )
+        return "DEFAULT"
+
+    if partition_type == "range":
+        if "start" not in bounds and "end" not in bounds:
+            raise serializers.ValidationError(
+                "range partition needs start or end value"
+            )
+        start = bounds.get("start")
+        end = bounds.get("end")
+        return "FOR VALUES FROM (%s) TO (%s)" % (
+            "MINVALUE" if start is None else literal(start),
+            "MAXVALUE" if end is None else literal(end),
+        )
+
+    if partition_type == "list":
+        if not bounds.get("values"):
+            raise serializers.ValidationError("list partition needs values")
+        return "FOR VALUES IN (%s)" % ", ".join(map(literal, bounds["values"]))
+
+    if "modulus" not in bounds or "remainder" not in bounds:
+        raise serializers.ValidationError("hash partition needs modulus and remainder")
+    if bounds["remainder"] >= bounds["modulus"]:
+        raise serializers.ValidationError("remainder must be less than modulus")
+    return "FOR VALUES WITH (MODULUS %d, REMAINDER %d)" % (
+        bounds["modulus"],
+        bounds["remainder"],
+    )
+
+
+def get_partitions(model: Any, model_object: DynamicModel) -> list[dict]:
+    """
+    Partitions of table with their bounds, estimated number of rows and size,
+    followed by detached partitions
+    :param model:
+    :param model_object:
+    :return:
+    """
+    check_partitioned(model_object)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples, "
+            "pg_total_relation_size(c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass ORDER BY c.relname",
+            [connection.ops.quote_name(model._meta.db_table)],
+        )
+        partitions = [
+            {
+                "name": name,
+                "bounds": bounds,
+                # reltuples is -1 until the partition is vacuumed or analyzed
+                "rows": int(rows) if rows >= 0 else None,
+                "size": size,
+                "attached": True,
+            }
+            for name, bounds, rows, size in cursor.fetchall()
+        ]
+
+    partitions += [
+        {"name": name, "bounds": None, "rows": None, "size": None, "attached": False}
+        for name in model_object.partitioning.get("detached", [])
+    ]
+    return partitions
+
+
+def get_attached_partitions(cursor: Any, model: Any) -> set[str]:
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass",
+        [connection.ops.quote_name(model._meta.db_table)],
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def change_partitions(model: Any, model_object: DynamicModel, name: str, change):
+    """
+    Run partition DDL and update detached partitions of dynamic model
+    in one transaction, with dynamic model row locked
+    :param model:
+    :param model_object:
+    :param name: partition table name
+    :param change: function of (cursor, quoted table, quoted partition,
+        set of attached and list of detached partitions) running the DDL
+    :return:
+    """
+    check_partitioned(model_object)
+    quote_name = connection.ops.quote_name
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            model_object = DynamicModel.objects.select_for_update().get(
+                id=model_object.id
+            )
+            detached = list(model_object.partitioning.get("detached", []))
+            attached = get_attached_partitions(cursor, model)
+            # DDL on partition locks the whole table, it must not wait for long
+            set_lock_timeout(cursor)
+            change(
+                cursor,
+                quote_name(model._meta.db_table),
+                quote_name(name),
+                attached,
+                detached,
+            )
+            model_object.partitioning = {
+                **model_object.partitioning,
+                "detached": detached,
+            }
+            model_object.mark_modified()
+            # partition DDL doesn't fire summary triggers
+            model_object.summaries.update(stale=True)
+            model_object.save(
+                update_fields=["partitioning", "write_version", "modified_at"]
+            )
+    except DatabaseError as exc:
+        raise serializers.ValidationError(str(exc))
+
+
+def create_partition(model: Any, model_object: DynamicModel, data: dict) -> dict:
+    """
+    Create partition of table, it gets the table columns and indexes
+    :param model:
+    :param model_object:
+    :param data: validated PartitionSerializer data
+    :return:
+    """
+    check_partitioned(model_object)
+    name = get_partition_table(model, data["name"])
+    bounds_sql = get_bounds_sql(model, model_object.partitioning, data)
+
+    def create(cursor, table, partition, attached, detached):
+        if name in detached:
+            raise serializers.ValidationError(
+                f"partition {name} is detached, attach it back or drop it"
+            )
+        cursor.execute(f"CREATE TABLE {partition} PARTITION OF {table} {bounds_sql}")
+
+    change_partitions(model, model_object, name, create)
+    return {"name": name, "bounds": bounds_sql, "attached": True}
+
+
+def attach_partition(
+    model: Any, model_object: DynamicModel, name: str, bounds: dict
+) -> dict:
+    """
+    Attach detached partition back with given bounds.
+    Its rows are scanned to check that they are within the bounds
+    :param model:
+    :param model_object:
+    :param name:
+    :param bounds: validated PartitionBoundsSerializer data
+    :return:
+    """
+    check_partitioned(model_object)
+    bounds_sql = get_bounds_sql(model, model_object.partitioning, bounds)
+
+    def attach(cursor, table, partition, attached, detached):
+        if name not in detached:
+            raise serializers.ValidationError(f"unknown detached partition {name}")
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {partition} {bounds_sql}")
+        detached.remove(name)
+
+    change_partitions(model, model_object, name, attach)
+    return {"name": name, "bounds": bounds_sql, "attached": True}
+
+
+def detach_partition(model: Any, model_object: DynamicModel, name: str) -> dict:
+    """
+    Detach partition from table, its rows are no longer in the table
+    but stay in partition table, which can be attached back or dropped.
+    Schema changes of the table are not applied to detached partitions
+    :param model:
+    :param model_object:
+    :param name:
+    :return:
+    """
+
+    def detach(cursor, table, partition, attached, detached):
+        if name not in attached:
+            raise serializers.ValidationError(f"unknown partition {name}")
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition}")
+        detached.append(name)
+
+    change_partitions(model, model_object, name, detach)
+    return {"name": name, "bounds": None, "attached": False}
+
+
+def drop_partition(model: Any, model_object: DynamicModel, name: str):
+    """
+    Drop partition with all its rows, attached or detached
+    :param model:
+    :param model_object:
+    :param name:
+    :return:
+    """
+
+    def drop(cursor, table, partition, attached, detached):
+        if name not in attached and name not in detached:
+            raise serializers.ValidationError(f"unknown partition {name}")
+        cursor.execute(f"DROP TABLE {partition}")
+        if name in detached:
+            detached.remove(name)
+
+    change_partitions(model, model_object, name, drop)
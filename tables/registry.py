@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.db import models
+
+
+def unregister_model(model: models.Model):
+    """
+    Remove dynamic model class from Django app registry and admin site
+    :param model:
+    :return:
+    """
+    app_models = apps.all_models[model._meta.app_label]
+    # a newer class with the same name may already have replaced this one
+    if app_models.get(model._meta.model_name) is model:
+        del app_models[model._meta.model_name]
+        apps.clear_cache()
+
+    if admin.site.is_registered(model):
+        admin.site.unregister(model)
+
+
+def get_model_cache(model: models.Model) -> dict:
+    """
+    Cache of objects built for dynamic model class, e.g. its row serializers.
+    Kept on the class, so cached objects go away together with the class
+    when it is evicted. A cache keyed by the class would keep it alive,
+    the objects refer to their class
+    :param model:
+    :return:
+    """
+    # own attribute of the class, not the one of a parent class
+    cache = model.__dict__.get("_dynamic_tables_cache")
+    if cache is None:
+        cache = model._dynamic_tables_cache = {}
+    return cache
+
+
+class ModelRegistry:
+    """
+    In-process LRU cache of built dynamic model classes.
+    Every table keeps only the class of its current schema version,
+    stale and least recently used classes are unregistered from Django.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self._max_size = max_size
+        self._models = OrderedDict()
+        # db_table to schema version of cached classes
+        self._tables = {}
+        self._lock = RLock()
+
+    @property
+    def max_size(self) -> int:
+        if self._max_size is not None:
+            return self._max_size
+        return settings.DYNAMIC_TABLES_MODEL_CACHE_SIZE
+
+    def get(self, model_id: int, version: int) -> Any:
+        """
+        Get cached model class for given table and schema version
+        :param model_id:
+        :param version:
+        :return: model class or None
+        """
+        with self._lock:
+            entry = self._models.get(model_id)
+            if entry is None or entry[0] != version:
+                return None
+
+            self._models.move_to_end(model_id)
+            return entry[1]
+
+    def add(self, model_id: int, version: int, model: models.Model):
+        """
+        Cache model class, replaces class of previous schema version
+        :param model_id:
+        :param version:
+        :param model:
+        :return:
+        """
+        with self._lock:
+            entry = self._models.pop(model_id, None)
+            if entry is not None:
+                self._tables.pop(entry[1]._meta.db_table, None)
+                if entry[1] is not model:
+                    unregister_model(entry[1])
+
+            self._models[model_id] = (version, model)
+            self._tables[model._meta.db_table] = version
+
+            while len(self._models) > self.max_size:
+                _, (_, evicted_model) = self._models.popitem(last=False)
+                self._tables.pop(evicted_model._meta.db_table, None)
+                unregister_model(evicted_model)
+
+    def get_or_build(
+        self, model_id: int, version: int, build: Callable[[], models.Model]
+    ) -> Any:
+        """
+        Get cached model class or build and cache it.
+        Concurrent requests for the same table get the same class,
+        it is never built twice
+        :param model_id:
+        :param version:
+        :param build:
+        :return:
+        """
+        with self._lock:
+            model = self.get(model_id, version)
+            if model is None:
+                # unregister class of the stale schema version before building new one
+                self.invalidate(model_id)
+                model = build()
+                self.add(model_id, version, model)
+            return model
+
+    def get_table_version(self, db_table: str) -> Optional[int]:
+        """
+        Schema version of cached model class of the table
+        :param db_table:
+        :return: version or None if the table is not a cached dynamic table
+        """
+        return self._tables.get(db_table)
+
+    def invalidate(self, model_id: int):
+        """
+        Drop cached model class of the table
+        :param model_id:
+        :return:
+        """
+        with self._lock:
+            entry = self._models.pop(model_id, None)
+            if entry is not None:
+                self._tables.pop(entry[1]._meta.db_table, None)
+                unregister_model(entry[1])
+
+    def clear(self):
+        with self._lock:
+            for model_id in list(self._models):
+                self.invalidate(model_id)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, model_id: int):
+        return model_id in self._models
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,478 @@
+from typing import Any, Optional
+
+from django.apps.registry import Apps
+from django.db import connection, models
+from django.db.backends.utils import truncate_name
+from rest_framework import serializers
+
+from .indexes import (
+    build_concurrently,
+    create_index_sql,
+    diff_indexes,
+    drop_index_sql,
+    sync_indexes,
+)
+from .models import (
+    DynamicModel,
+    DynamicModelField,
+    Job,
+    SchemaChange,
+    normalize_field_options,
+)
+from .registry import model_registry
+from .utils import build_field
+
+
+def get_db_table(name: str, options: Optional[dict] = None) -> str:
+    """
+    Get table name of dynamic model, the same way Django names model tables
+    :param name:
+    :param options:
+    :return:
+    """
+    if options and options.get("db_table"):
+        return options["db_table"]
+    return truncate_name(f"tables_{name.lower()}", connection.ops.max_name_length())
+
+
+def table_model(
+    db_table: str, fields: Optional[dict] = None, columns: Optional[dict] = None
+) -> Any:
+    """
+    Create model class for table, not registered in the app registry.
+    Schema editor needs it to find table name and,
+    on backends that rebuild tables, the rest of table columns
+    :param db_table:
+    :param fields: mapping of field name to (type, options)
+    :param columns: mapping of field name to column when it is not named after field
+    :return:
+    """
+
+    class Meta:
+        app_label = "tables"
+        apps = Apps()
+
+    Meta.db_table = db_table
+    attrs = {"__module__": __name__, "Meta": Meta}
+    for name, (field_type, options) in (fields or {}).items():
+        attrs[name] = build_field(name, field_type, options)
+        if columns and name in columns:
+            attrs[name].db_column = columns[name]
+            attrs[name].set_attributes_from_name(name)
+
+    return type("DynamicTable", (models.Model,), attrs)
+
+
+def is_physical_change(old_field: models.Field, new_field: models.Field) -> bool:
+    """
+    Check if field change needs table DDL, otherwise only metadata changes
+    :param old_field:
+    :param new_field:
+    :return:
+    """
+    return (
+        old_field.db_parameters(connection)["type"]
+        != new_field.db_parameters(connection)["type"]
+        or old_field.null != new_field.null
+        or old_field.unique != new_field.unique
+        or old_field.db_index != new_field.db_index
+    )
+
+
+def cast_sql(column: str, db_type: str) -> str:
+    """
+    Expression converting column to another type. Explicit cast to varchar(n)
+    cuts longer values, so strings are cast to text and assigned to the column,
+    which raises for values that don't fit
+    :param column: quoted column
+    :param db_type:
+    :return:
+    """
+    if db_type.startswith("varchar"):
+        db_type = "text"
+    return f"{column}::{db_type}"
+
+
+class SchemaPlan:
+    """
+    Difference between current dynamic model schema and the requested one.
+    Old and new field lists are compared once and changes are split into
+    metadata-only and physical ones. Physical changes are applied
+    with the smallest set of ALTER TABLE statements in a single transaction
+    """
+
+    def __init__(self, model_object: DynamicModel, new_model: dict):
+        self.model_object = model_object
+        self.new_model = new_model
+
+        self.old_table = get_db_table(model_object.name, model_object.options)
+        self.new_table = get_db_table(new_model.get("name"), new_model.get("options"))
+        self.options_changed = (model_object.options or None) != (
+            new_model.get("options") or None
+        )
+
+        # list of (old field, new field dict)
+        self.renamed = []
+        self.altered = []
+        # list of new field dicts
+        self.added = []
+        # list of old fields
+        self.removed = []
+
+        self.old_fields = list(model_object.fields.all())
+        self.diff(self.old_fields, new_model.get("fields"))
+
+        # indexes are built after the schema change, outside of its transaction
+        self.old_indexes = model_object.indexes
+        self.new_indexes = new_model.get("indexes", model_object.indexes)
+        self.dropped_indexes, self.created_indexes = diff_indexes(
+            self.old_indexes, self.new_indexes
+        )
+        self.new_natural_key = new_model.get("natural_key", model_object.natural_key)
+
+    def diff(self, old_fields: list[DynamicModelField], new_fields: list[dict]):
+        old_by_name = {field.name: field for field in old_fields}
+        old_by_id = {field.id: field for field in old_fields}
+        new_names = {field.get("name") for field in new_fields}
+        matched = set()
+
+        for new_field in new_fields:
+            old_field = old_by_name.get(new_field.get("name"))
+            if old_field is None:
+                # field with known id and unused old name is renamed
+                old_field = old_by_id.get(new_field.get("id"))
+                if old_field is not None and (
+                    old_field.name in new_names or old_field.id in matched
+                ):
+                    old_field = None
+
+            if old_field is None or old_field.id in matched:
+                self.added.append(new_field)
+                continue
+
+            matched.add(old_field.id)
+            if old_field.name != new_field.get("name"):
+                self.renamed.append((old_field, new_field))
+
+            if (old_field.type, normalize_field_options(old_field.options)) != (
+                new_field.get("type"),
+                normalize_field_options(new_field.get("options")),
+            ):
+                self.altered.append((old_field, new_field))
+
+        self.removed = [field for field in old_fields if field.id not in matched]
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(
+            self.model_object.name != self.new_model.get("name")
+            or self.options_changed
+            or self.renamed
+            or self.altered
+            or self.added
+            or self.removed
+            or self.dropped_indexes
+            or self.created_indexes
+            or self.model_object.natural_key != self.new_natural_key
+        )
+
+    @staticmethod
+    def old_model_field(field: DynamicModelField, name: str = None) -> models.Field:
+        return build_field(name or field.name, field.type, field.options)
+
+    @staticmethod
+    def new_model_field(field: dict) -> models.Field:
+        return build_field(field.get("name"), field.get("type"), field.get("options"))
+
+    def check_summaries(self):
+        """
+        Summaries are built from table columns by a trigger, fields they use
+        can't be removed, renamed or get another type
+        :return:
+        """
+        changed = {field.name for field in self.removed}
+        changed |= {old_field.name for old_field, _ in self.renamed}
+        changed |= {
+            old_field.name
+            for old_field, new_field in self.altered
+            if old_field.type != new_field.get("type")
+        }
+        if not changed:
+            return
+        for summary in self.model_object.summaries.all():
+            used = sorted(summary.fields & changed)
+            if used:
+                raise serializers.ValidationError(
+                    f"fields {used} are used by summary {summary.name}, drop it first"
+                )
+
+    def physical_alters(self) -> list[tuple[models.Field, models.Field]]:
+        fields = []
+        for old_field, new_field in self.altered:
+            # old field is renamed first, so it already has the new column name
+            old_model_field = self.old_model_field(old_field, new_field.get("name"))
+            new_model_field = self.new_model_field(new_field)
+            if is_physical_change(old_model_field, new_model_field):
+                fields.append((old_model_field, new_model_field))
+        return fields
+
+    def operations(self) -> list[dict]:
+        operations = []
+        if self.old_table != self.new_table:
+            operations.append(
+                {
+                    "operation": "rename_table",
+                    "from": self.old_table,
+                    "to": self.new_table,
+                }
+            )
+        operations += [
+            {"operation": "rename_field", "from": old.name, "to": new.get("name")}
+            for old, new in self.renamed
+        ]
+        operations += [
+            {"operation": "remove_field", "field": field.name} for field in self.removed
+        ]
+        operations += [
+            {"operation": "add_field", "field": field.get("name")}
+            for field in self.added
+        ]
+        physical = {new.name for _, new in self.physical_alters()}
+        operations += [
+            {
+                "operation": "alter_field",
+                "field": new.get("name"),
+                "physical": new.get("name") in physical,
+            }
+            for _, new in self.altered
+        ]
+        operations += [
+            {"operation": "drop_index", "index": spec["name"]}
+            for spec in self.dropped_indexes
+        ]
+        operations += [
+            {"operation": "create_index", "index": spec["name"]}
+            for spec in self.created_indexes
+        ]
+        return operations
+
+    def new_table_model(self) -> Any:
+        return table_model(
+            self.new_table,
+            {
+                field.get("name"): (field.get("type"), field.get("options"))
+                for field in self.new_model.get("fields")
+            },
+        )
+
+    def execute(self, schema_editor: Any):
+        """
+        Run DDL of the plan with schema editor
+        :param schema_editor:
+        :return:
+        """
+        quote_name = schema_editor.quote_name
+
+        if self.old_table != self.new_table:
+            schema_editor.alter_db_table(
+                table_model(self.old_table), self.old_table, self.new_table
+            )
+        model = table_model(self.new_table)
+
+        # renames can't be combined with other ALTER TABLE actions
+        for old_field, new_field in self.renamed:
+            schema_editor.execute(
+                schema_editor.sql_rename_column
+                % {
+                    "table": quote_name(self.new_table),
+                    "old_column": quote_name(old_field.name),
+                    "new_column": quote_name(new_field.get("name")),
+                }
+            )
+
+        removed = [self.old_model_field(field) for field in self.removed]
+        added = [self.new_model_field(field) for field in self.added]
+        altered = self.physical_alters()
+
+        if connection.vendor != "postgresql":
+            # one operation at a time, backend may rebuild the whole table for each
+            self.execute_per_field(schema_editor, removed, added, altered)
+            return
+
+        changes, params, drop_defaults = [], [], []
+        for field in removed:
+            changes.append(f"DROP COLUMN {quote_name(field.column)} CASCADE")
+
+        for field in added:
+            if field.db_index and not field.unique:
+                # index has to be created by schema editor
+                schema_editor.add_field(model, field)
+                continue
+
+            definition, definition_params = schema_editor.column_sql(
+                model, field, include_default=True
+            )
+            changes.append(f"ADD COLUMN {quote_name(field.column)} {definition}")
+            params += definition_params
+            if schema_editor.effective_default(field) is not None:
+                # Django does not keep defaults in database
+                drop_defaults.append(
+                    schema_editor.sql_alter_column_no_default
+                    % {"column": quote_name(field.column)}
+                )
+
+        for old_field, new_field in altered:
+            if (
+                old_field.unique != new_field.unique
+                or old_field.db_index != new_field.db_index
+                or (old_field.null and not new_field.null and new_field.has_default())
+            ):
+                # constraints, indexes and null backfill are left to schema editor
+                schema_editor.alter_field(model, old_field, new_field)
+                continue
+
+            old_type = old_field.db_parameters(connection)["type"]
+            new_type = new_field.db_parameters(connection)["type"]
+            column = quote_name(new_field.column)
+            if old_type != new_type:
+                # like schema editor, USING only for another data type, the same
+                # one with other length is assigned and checked by PostgreSQL
+                using = ""
+                if old_field.get_internal_type() != new_field.get_internal_type():
+                    using = f" USING {cast_sql(column, new_type)}"
+                changes.append(f"ALTER COLUMN {column} TYPE {new_type}{using}")
+            if old_field.null != new_field.null:
+                changes.append(
+                    (
+                        schema_editor.sql_alter_column_null
+                        if new_field.null
+                        else schema_editor.sql_alter_column_not_null
+                    )
+                    % {"column": column}
+                )
+
+        for actions, actions_params in ((changes, params), (drop_defaults, [])):
+            if actions:
+                schema_editor.execute(
+                    schema_editor.sql_alter_column
+                    % {
+                        "table": quote_name(self.new_table),
+                        "changes": ", ".join(actions),
+                    },
+                    actions_params,
+                )
+
+    def execute_per_field(
+        self,
+        schema_editor: Any,
+        removed: list[models.Field],
+        added: list[models.Field],
+        altered: list[tuple[models.Field, models.Field]],
+    ):
+        new_names = {old.name: new.get("name") for old, new in self.renamed}
+        specs = {field.get("name"): field for field in self.new_model.get("fields")}
+        fields = {
+            new_names.get(field.name, field.name): (field.type, field.options)
+            for field in self.old_fields
+        }
+
+        for field in removed:
+            schema_editor.remove_field(table_model(self.new_table, fields), field)
+            fields.pop(field.name)
+        for field in added:
+            schema_editor.add_field(table_model(self.new_table, fields), field)
+            fields[field.name] = (
+                specs[field.name]["type"],
+                specs[field.name]["options"],
+            )
+        for old_field, new_field in altered:
+            schema_editor.alter_field(
+                table_model(self.new_table, fields), old_field, new_field
+            )
+            fields[new_field.name] = (
+                specs[new_field.name].get("type"),
+                specs[new_field.name].get("options"),
+            )
+
+    def as_dict(self) -> dict:
+        """
+        Plan description with SQL it would run, nothing is changed in DB
+        :return:
+        """
+        with connection.schema_editor(collect_sql=True, atomic=False) as schema_editor:
+            self.execute(schema_editor)
+
+            model = self.new_table_model()
+            concurrently = build_concurrently(self.model_object)
+            for spec in self.dropped_indexes:
+                schema_editor.execute(
+                    drop_index_sql(model, spec, schema_editor, concurrently)
+                )
+            for spec in self.created_indexes:
+                schema_editor.execute(
+                    create_index_sql(model, spec, schema_editor, concurrently)
+                )
+
+        return {
+            "operations": self.operations(),
+            "sql": schema_editor.collected_sql,
+        }
+
+    def apply(self, job: Optional[Job] = None) -> dict:
+        """
+        Apply DDL and update dynamic model metadata in one transaction
+        :param job: job applying the plan, None for updates of requests
+        :return: errors of indexes failed to build after the change by index name
+        """
+        if not self.has_changes:
+            return {}
+        if self.model_object.schema_changes.filter(
+            status__in=SchemaChange.RUNNING
+        ).exists():
+            raise serializers.ValidationError(
+                "table has an online schema change in progress"
+            )
+        # queued updates are applied in order by jobs, one at a time
+        if (
+            job is None
+            and self.model_object.jobs.filter(
+                kind=Job.UPDATE_TABLE, status__in=(Job.PENDING, Job.RUNNING)
+            ).exists()
+        ):
+            raise serializers.ValidationError(
+                "table has queued updates, queue this one with background=true"
+            )
+        self.check_summaries()
+
+        # schema editor runs DDL and metadata updates in one transaction
+        with connection.schema_editor() as schema_editor:
+            self.execute(schema_editor)
+
+            if self.renamed or self.altered or self.added or self.removed:
+                self.model_object.fields.set(
+                    DynamicModelField.objects.resolve(self.new_model.get("fields"))
+                )
+
+            self.model_object.name = self.new_model.get("name")
+            self.model_object.options = self.new_model.get("options")
+            self.model_object.indexes = self.new_indexes
+            self.model_object.natural_key = self.new_natural_key
+            self.model_object.version += 1
+            self.model_object.mark_modified()
+            self.model_object.save()
+            self.model_object.refresh_from_db(fields=["write_version"])
+
+        model_registry.invalidate(self.model_object.id)
+        return sync_indexes(self.model_object, self.new_table_model(), self.old_indexes)
+
+
+def update_model(old_model: DynamicModel, new_model: dict) -> dict:
+    """
+    Performs dynamic model update in DB
+    Rename table, Update model options, Update model fields
+
+    :param old_model:
+    :param new_model:
+    :return: errors of indexes failed to build by index name
+    """
+    return SchemaPlan(old_model, new_model).apply()
@@ -1,8 +1,21 @@
-from django.db import DatabaseError, models
+import math
+from typing import Any, Callable, Iterable, Optional
+
+from django.core import validators
+from django.db import DatabaseError, connection, models
 from rest_framework import serializers
 
-from .models import DynamicModel, DynamicModelField
-from .utils import create_model, create_model_db, prepare_fields, update_model
+from .filters import compile_condition
+from .indexes import get_index_name, sync_indexes
+from .models import DynamicModel, DynamicModelField, Job, SchemaChange, Summary
+from .registry import get_model_cache, model_registry
+from .schema import get_db_table, update_model
+from .utils import (
+    PARTITION_FIELD_TYPES,
+    create_model,
+    create_model_db,
+    prepare_fields,
+)
 
 
 class ModelFieldSerializer(serializers.ModelSerializer):
@@ -49,12 +62,338 @@ class ModelFieldSerializer(serializers.ModelSerializer):
         return data
 
 
+class AddRowsOptionsSerializer(serializers.Serializer):
+    """
+    Insert options passed next to rows
+    """
+
+    batch_size = serializers.IntegerField(min_value=1, required=False)
+    atomic = serializers.BooleanField(default=True)
+    # update rows with the same natural key instead of inserting duplicates
+    upsert = serializers.BooleanField(default=False)
+
+
+class SelectRowsSerializer(serializers.Serializer):
+    """
+    Rows selected by id list or by filter, e.g. {"filter": {"price__gte": 10}}
+    """
+
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    filter = serializers.DictField(required=False, allow_empty=False)
+
+    def validate(self, data):
+        if ("ids" in data) == ("filter" in data):
+            raise serializers.ValidationError("either ids or filter is required")
+        return data
+
+
+class UpdateRowsSerializer(SelectRowsSerializer):
+    """
+    Field values set on selected rows
+    """
+
+    values = serializers.DictField(allow_empty=False)
+
+
+class UpdateModelOptionsSerializer(serializers.Serializer):
+    """
+    Table update options passed as query parameters
+    """
+
+    dry_run = serializers.BooleanField(default=False)
+    # change column types in background without locking the table
+    online = serializers.BooleanField(default=False)
+    # queue the update as a job, applied by a background worker
+    background = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs["online"] and attrs["background"]:
+            raise serializers.ValidationError("online and background can't be combined")
+        return attrs
+
+
+class UploadRowsOptionsSerializer(serializers.Serializer):
+    """
+    Bulk upload options passed as query parameters
+    """
+
+    # spool the body and load it by a background worker
+    background = serializers.BooleanField(default=False)
+
+
+class TableStatsOptionsSerializer(serializers.Serializer):
+    """
+    Table statistics options passed as query parameters
+    """
+
+    exact = serializers.BooleanField(default=False)
+
+
+class IndexSerializer(serializers.Serializer):
+    """
+    Secondary index of dynamic table, condition makes it partial
+    and uses the same syntax as rows filters, e.g. {"price__gte": 10}
+    """
+
+    name = serializers.CharField(max_length=63, required=False)
+    fields = serializers.ListField(child=serializers.CharField(), min_length=1)
+    unique = serializers.BooleanField(default=False)
+    condition = serializers.DictField(required=False)
+
+
+class PartitioningSerializer(serializers.Serializer):
+    """
+    Partition scheme of dynamic table, e.g. {"type": "range", "field": "price"}
+    """
+
+    type = serializers.ChoiceField(choices=tuple(PARTITION_FIELD_TYPES))
+    field = serializers.CharField()
+
+
+class PartitionBoundsSerializer(serializers.Serializer):
+    """
+    Values of partition key kept in partition: start and end (exclusive)
+    of range partition, null is unbounded, values of list partition,
+    modulus and remainder of hash partition or default partition for the rest
+    """
+
+    start = serializers.JSONField(required=False)
+    end = serializers.JSONField(required=False)
+    values = serializers.ListField(
+        child=serializers.JSONField(), required=False, min_length=1
+    )
+    modulus = serializers.IntegerField(min_value=1, required=False)
+    remainder = serializers.IntegerField(min_value=0, required=False)
+    default = serializers.BooleanField(default=False)
+
+
+class PartitionSerializer(PartitionBoundsSerializer):
+    """
+    New partition, its table is named after the table and partition name
+    """
+
+    name = serializers.RegexField(r"^[a-z0-9_]+$", max_length=32)
+
+
+class SchemaChangeSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = SchemaChange
+        exclude = ("model", "fields", "indexes")
+
+
+class SummarySerializer(serializers.ModelSerializer):
+    name = serializers.RegexField(r"^[a-z0-9_]+$", max_length=32)
+    group_by = serializers.ListField(child=serializers.CharField(), default=list)
+    aggregates = serializers.ListField(child=serializers.CharField(), default=list)
+
+    class Meta:
+        model = Summary
+        exclude = ("model",)
+        read_only_fields = ("stale", "built_at")
+
+
+class JobSerializer(serializers.ModelSerializer):
+    duration = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Job
+        exclude = ("model", "payload")
+
+
 class DynamicModelSerializer(serializers.ModelSerializer):
     fields = ModelFieldSerializer(many=True)
+    indexes = IndexSerializer(many=True, required=False, allow_null=True)
+    natural_key = serializers.ListField(
+        child=serializers.CharField(), required=False, allow_null=True
+    )
+    partitioning = PartitioningSerializer(required=False, allow_null=True)
 
     class Meta:
         model = DynamicModel
         fields = "__all__"
+        read_only_fields = ("version", "write_version", "modified_at")
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # indexes failed to build by this create or update, the table is changed
+        # and their specs are not kept
+        if getattr(instance, "index_errors", None):
+            data["index_errors"] = instance.index_errors
+        return data
+
+    @staticmethod
+    def add_natural_key_index(
+        fields: list[dict], natural_key: list[str], indexes: Optional[list[dict]]
+    ) -> list[dict]:
+        """
+        Check natural key fields and add unique index over them,
+        INSERT ... ON CONFLICT needs it to find conflicting rows
+        :param fields:
+        :param natural_key:
+        :param indexes:
+        :return: indexes with natural key index
+        """
+        field_options = {field["name"]: field.get("options") or {} for field in fields}
+        unknown_fields = [name for name in natural_key if name not in field_options]
+        if unknown_fields:
+            raise serializers.ValidationError(
+                {"natural_key": f"unknown fields {unknown_fields}"}
+            )
+        if len(set(natural_key)) != len(natural_key):
+            raise serializers.ValidationError(
+                {"natural_key": "fields are listed more than once"}
+            )
+        # NULLs never conflict, rows with null key would be inserted every time
+        nullable_fields = [
+            name for name in natural_key if field_options[name].get("null")
+        ]
+        if nullable_fields:
+            raise serializers.ValidationError(
+                {"natural_key": f"fields {nullable_fields} can be null"}
+            )
+
+        indexes = list(indexes or [])
+        if not any(
+            index.get("unique")
+            and not index.get("condition")
+            and set(index["fields"]) == set(natural_key)
+            for index in indexes
+        ):
+            indexes.append({"fields": list(natural_key), "unique": True})
+        return indexes
+
+    @staticmethod
+    def check_partitioning(
+        fields: list[dict],
+        partitioning: dict,
+        indexes: Optional[list[dict]],
+        old_partitioning: Optional[dict],
+    ):
+        """
+        Check partition field and that unique fields and indexes include it,
+        PostgreSQL can only enforce uniqueness within a partition.
+        Partitioning of existing table can't be changed
+        :param fields:
+        :param partitioning:
+        :param indexes:
+        :param old_partitioning: partitioning of updated table
+        :return:
+        """
+        if old_partitioning is not None and (
+            old_partitioning["type"],
+            old_partitioning["field"],
+        ) != (partitioning["type"], partitioning["field"]):
+            raise serializers.ValidationError(
+                {"partitioning": "partitioning of existing table can't be changed"}
+            )
+        if connection.vendor != "postgresql":
+            raise serializers.ValidationError(
+                {"partitioning": "partitioned tables are supported on PostgreSQL only"}
+            )
+
+        key = partitioning["field"]
+        field_types = {field["name"]: field["type"] for field in fields}
+        field_types["id"] = "int"
+        if key not in field_types:
+            raise serializers.ValidationError(
+                {"partitioning": f"unknown partition field {key}"}
+            )
+        allowed_types = PARTITION_FIELD_TYPES[partitioning["type"]]
+        if field_types[key] not in allowed_types:
+            raise serializers.ValidationError(
+                {
+                    "partitioning": f"{partitioning['type']} partitioning needs "
+                    f"a field of type {' or '.join(allowed_types)}"
+                }
+            )
+
+        unique_fields = [
+            field["name"]
+            for field in fields
+            if (field.get("options") or {}).get("unique") and field["name"] != key
+        ]
+        if unique_fields:
+            raise serializers.ValidationError(
+                {
+                    "partitioning": f"unique fields {unique_fields} "
+                    f"can't be unique across partitions"
+                }
+            )
+        if any(
+            index.get("unique") and key not in index["fields"]
+            for index in indexes or []
+        ):
+            raise serializers.ValidationError(
+                {
+                    "partitioning": "unique indexes and natural key "
+                    f"must include partition field {key}"
+                }
+            )
+
+    def validate(self, data):
+        # indexes and natural key are kept as they are
+        # when update does not mention them
+        indexes = data.get(
+            "indexes", self.instance.indexes if self.instance is not None else None
+        )
+        natural_key = data.get(
+            "natural_key",
+            self.instance.natural_key if self.instance is not None else None,
+        )
+        if natural_key:
+            indexes = self.add_natural_key_index(data["fields"], natural_key, indexes)
+
+        old_partitioning = self.instance.partitioning if self.instance else None
+        partitioning = data.get("partitioning", old_partitioning)
+        if partitioning:
+            self.check_partitioning(
+                data["fields"], partitioning, indexes, old_partitioning
+            )
+            # detached partitions of existing table are kept
+            data["partitioning"] = old_partitioning or dict(partitioning)
+        elif old_partitioning:
+            raise serializers.ValidationError(
+                {"partitioning": "partitioning of existing table can't be changed"}
+            )
+
+        if not indexes:
+            return data
+
+        field_types = {field["name"]: field["type"] for field in data["fields"]}
+        field_types["id"] = "int"
+        db_table = get_db_table(data["name"], data.get("options"))
+
+        specs, errors = {}, []
+        for index in indexes:
+            unknown_fields = [
+                name for name in index["fields"] if name not in field_types
+            ]
+            if unknown_fields:
+                errors.append(f"unknown fields {unknown_fields}")
+                continue
+            try:
+                for key, value in (index.get("condition") or {}).items():
+                    compile_condition(field_types, key, value)
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+                continue
+
+            spec = {
+                "fields": list(index["fields"]),
+                "unique": index.get("unique", False),
+                "condition": dict(index.get("condition") or {}),
+            }
+            spec["name"] = index.get("name") or get_index_name(db_table, spec)
+            if spec["name"] in specs:
+                errors.append(f"duplicate index name {spec['name']}")
+            specs[spec["name"]] = spec
+
+        if errors:
+            raise serializers.ValidationError({"indexes": errors})
+        data["indexes"] = list(specs.values())
+        return data
 
     def create(self, validated_data):
         fields = prepare_fields(validated_data["fields"], remove_extra_options=True)
@@ -67,30 +406,387 @@ class DynamicModelSerializer(serializers.ModelSerializer):
         )
 
         try:
-            create_model_db(new_model)
+            create_model_db(new_model, validated_data.get("partitioning"))
         except DatabaseError as exc:
             raise serializers.ValidationError(str(exc))
 
-        fields_list = []
-        for field in validated_data["fields"]:
-            new_field, _ = DynamicModelField.objects.get_or_create(
-                name=field.get("name"),
-                type=field.get("type"),
-                options=field.get("options"),
-            )
-            fields_list.append(new_field)
+        fields_list = DynamicModelField.objects.resolve(validated_data["fields"])
 
         model = DynamicModel.objects.create(
             name=validated_data["name"],
             options=validated_data.get("options"),
             admin_opts=validated_data.get("admin_opts"),
+            indexes=validated_data.get("indexes"),
+            natural_key=validated_data.get("natural_key"),
+            partitioning=validated_data.get("partitioning"),
         )
         model.fields.set(fields_list)
+        model_registry.add(model.id, model.version, new_model)
+
+        # indexes are built after the table is created, outside of its transaction
+        model.index_errors = sync_indexes(model, new_model)
         return model
 
     def update(self, instance, validated_data):
         try:
-            update_model(instance, validated_data)
+            instance.index_errors = update_model(instance, validated_data)
         except DatabaseError as exc:
             raise serializers.ValidationError(str(exc))
         return instance
+
+
+# Row serializers are built once per dynamic model class, i.e. per schema version,
+# and kept in the model cache, they go away together with the class when it is
+# evicted from the model registry
+
+
+def get_row_serializer_class(model: models.Model) -> type:
+    """
+    Get ModelSerializer class for dynamic model rows
+    :param model:
+    :return:
+    """
+    cache = get_model_cache(model)
+    serializer_class = cache.get("row_serializer_class")
+    if serializer_class is None:
+
+        class DynamicTableSerializer(serializers.ModelSerializer):
+            class Meta:
+                fields = "__all__"
+
+        DynamicTableSerializer.Meta.model = model
+        serializer_class = cache["row_serializer_class"] = DynamicTableSerializer
+
+    return serializer_class
+
+
+class RowValuesSerializer:
+    """
+    Fast read serializer for rows fetched with values_list(*columns).
+    Uses precomputed column encoders instead of model instances and DRF fields
+    """
+
+    # same conversions as to_representation of matching DRF fields
+    encoders = {
+        models.CharField: str,
+        models.IntegerField: int,
+        models.FloatField: float,
+        models.BooleanField: bool,
+    }
+
+    def __init__(self, model: models.Model):
+        fields = model._meta.concrete_fields
+        self.columns = tuple(field.name for field in fields)
+        self.column_encoders = tuple(
+            (column, self.encoders.get(type(field)))
+            for column, field in zip(self.columns, fields)
+        )
+
+    def encode(self, row: Iterable[Any]) -> dict:
+        return {
+            column: value if value is None or encoder is None else encoder(value)
+            for (column, encoder), value in zip(self.column_encoders, row)
+        }
+
+    def to_representation(self, rows: Iterable[Iterable[Any]]) -> list[dict]:
+        encode = self.encode
+        return [encode(row) for row in rows]
+
+
+def get_row_values_serializer(model: models.Model) -> RowValuesSerializer:
+    """
+    Get fast values_list() serializer for dynamic model rows
+    :param model:
+    :return:
+    """
+    cache = get_model_cache(model)
+    serializer = cache.get("row_values_serializer")
+    if serializer is None:
+        serializer = cache["row_values_serializer"] = RowValuesSerializer(model)
+
+    return serializer
+
+
+class InvalidValue(Exception):
+    pass
+
+
+class RowsValidationError(serializers.ValidationError):
+    """
+    Errors of input rows, row positions are kept as numbers
+    instead of being turned into strings like other error details
+    """
+
+    def __init__(self, errors: list[dict]):
+        self.detail = {"rows": errors}
+
+
+def get_field_limits(field: models.Field) -> tuple[Any, Any]:
+    # same limits as ModelSerializer takes from model field validators
+    min_value = max_value = None
+    for validator in field.validators:
+        if isinstance(validator, validators.MinValueValidator):
+            min_value = validator.limit_value
+        elif isinstance(validator, validators.MaxValueValidator):
+            max_value = validator.limit_value
+    return min_value, max_value
+
+
+def null_value(field: models.Field) -> None:
+    # value of None, checked on the slow path of column checks
+    if not field.null:
+        raise InvalidValue(str(serializers.Field.default_error_messages["null"]))
+    return None
+
+
+def compile_string(field: models.CharField) -> Callable[[Any], Any]:
+    messages = serializers.CharField.default_error_messages
+    invalid = str(messages["invalid"])
+    blank = str(messages["blank"])
+    too_long = str(messages["max_length"]).format(max_length=field.max_length)
+    null_characters = str(validators.ProhibitNullCharactersValidator.message)
+    max_length = field.max_length if field.max_length is not None else math.inf
+
+    def check(value):
+        if type(value) is str:
+            value = value.strip()
+            if value and len(value) <= max_length and "\x00" not in value:
+                return value
+        elif value is None:
+            return null_value(field)
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise InvalidValue(invalid)
+        else:
+            value = str(value).strip()
+
+        if not value:
+            if not field.blank:
+                raise InvalidValue(blank)
+            return value
+        if len(value) > max_length:
+            raise InvalidValue(too_long)
+        if "\x00" in value:
+            raise InvalidValue(null_characters)
+        return value
+
+    return check
+
+
+def compile_int(field: models.IntegerField) -> Callable[[Any], Any]:
+    messages = serializers.IntegerField.default_error_messages
+    invalid = str(messages["invalid"])
+    too_large = str(messages["max_string_length"])
+    min_value, max_value = get_field_limits(field)
+    too_small = str(messages["min_value"]).format(min_value=min_value)
+    too_big = str(messages["max_value"]).format(max_value=max_value)
+    min_value = min_value if min_value is not None else -math.inf
+    max_value = max_value if max_value is not None else math.inf
+    decimal_re = serializers.IntegerField.re_decimal
+
+    def check(value):
+        if type(value) is not int:
+            if value is None:
+                return null_value(field)
+            if isinstance(value, str) and len(value) > 1000:
+                raise InvalidValue(too_large)
+            try:
+                value = int(decimal_re.sub("", str(value)))
+            except (TypeError, ValueError):
+                raise InvalidValue(invalid)
+        if value < min_value:
+            raise InvalidValue(too_small)
+        if value > max_value:
+            raise InvalidValue(too_big)
+        return value
+
+    return check
+
+
+def compile_float(field: models.FloatField) -> Callable[[Any], Any]:
+    messages = serializers.FloatField.default_error_messages
+    invalid = str(messages["invalid"])
+    too_large = str(messages["max_string_length"])
+
+    def check(value):
+        if type(value) is float:
+            return value
+        if value is None:
+            return null_value(field)
+        if isinstance(value, str) and len(value) > 1000:
+            raise InvalidValue(too_large)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise InvalidValue(invalid)
+
+    return check
+
+
+def compile_bool(field: models.BooleanField) -> Callable[[Any], Any]:
+    invalid = str(serializers.BooleanField.default_error_messages["invalid"])
+    true_values = serializers.BooleanField.TRUE_VALUES
+    false_values = serializers.BooleanField.FALSE_VALUES
+    null_values = serializers.BooleanField.NULL_VALUES if field.null else ()
+
+    def check(value):
+        if type(value) is bool:
+            return value
+        if value is None:
+            return null_value(field)
+        try:
+            if value in true_values:
+                return True
+            if value in false_values:
+                return False
+            if value in null_values:
+                return None
+        except TypeError:
+            pass
+        raise InvalidValue(invalid)
+
+    return check
+
+
+def compile_serializer_field(field: serializers.Field) -> Callable[[Any], Any]:
+    # fields with options not compiled above are checked by their DRF field
+    def check(value):
+        try:
+            return field.run_validation(value)
+        except serializers.ValidationError as exc:
+            raise InvalidValue(*exc.detail)
+
+    return check
+
+
+class RowValidator:
+    """
+    Validates input rows against dynamic model fields with the rules
+    of the model row ModelSerializer. Checks are compiled once per schema
+    version into a function per column, a batch is validated in one pass
+    without DRF fields built for every row
+    """
+
+    compilers = {
+        models.CharField: compile_string,
+        models.IntegerField: compile_int,
+        models.FloatField: compile_float,
+        models.BooleanField: compile_bool,
+    }
+
+    def __init__(self, model: models.Model):
+        fields = [
+            field for field in model._meta.concrete_fields if not field.primary_key
+        ]
+        self.checks = {}
+        for field in fields:
+            compiler = self.compilers.get(type(field))
+            if field.choices or compiler is None:
+                serializer_field = get_row_serializer_class(model)().fields[field.name]
+                self.checks[field.name] = compile_serializer_field(serializer_field)
+            else:
+                self.checks[field.name] = compiler(field)
+        # fields without value nor default, ModelSerializer requires them
+        self.required = frozenset(
+            field.name
+            for field in fields
+            if not (field.has_default() or field.blank or field.null)
+        )
+        self.messages = {
+            "required": str(serializers.Field.default_error_messages["required"]),
+            "unknown": f"unknown field for model {model.__name__}",
+            "not_a_dict": "row is not a JSON object",
+        }
+
+    def validate(
+        self, rows: Any, max_errors: Optional[int] = None
+    ) -> tuple[list[dict], list[dict]]:
+        """
+        Validate and convert values of a batch of rows, rows are updated in place.
+        Values are checked column by column, errors of a failed batch are
+        collected row by row until there are max_errors of them
+        :param rows:
+        :param max_errors:
+        :return: cleaned rows and errors with their row index and column
+        """
+        if not isinstance(rows, list):
+            raise serializers.ValidationError({"rows": "expected a list of rows"})
+
+        required = self.required
+        missing = object()
+        found = 0
+        try:
+            for column, check in self.checks.items():
+                is_required = column in required
+                for row in rows:
+                    value = row.get(column, missing)
+                    if value is missing:
+                        if is_required:
+                            raise InvalidValue()
+                        continue
+                    found += 1
+                    cleaned = check(value)
+                    if cleaned is not value:
+                        row[column] = cleaned
+            # keys which are not columns were never looked up
+            valid = found == sum(map(len, rows))
+        except (AttributeError, TypeError, InvalidValue):
+            # e.g. a row which is not a dict
+            valid = False
+        if valid:
+            return rows, []
+
+        errors = []
+        for index, row in enumerate(rows):
+            errors.extend(self.get_row_errors(index, row))
+            if max_errors is not None and len(errors) >= max_errors:
+                break
+        return [], errors
+
+    def get_row_errors(self, index: int, row: Any) -> list[dict]:
+        if type(row) is not dict:
+            return [
+                {"row": index, "column": None, "errors": [self.messages["not_a_dict"]]}
+            ]
+
+        errors = []
+        for column, value in row.items():
+            check = self.checks.get(column)
+            try:
+                if check is None:
+                    raise InvalidValue(self.messages["unknown"])
+                check(value)
+            except InvalidValue as exc:
+                errors.append(
+                    {"row": index, "column": column, "errors": list(exc.args)}
+                )
+        errors.extend(
+            {"row": index, "column": column, "errors": [self.messages["required"]]}
+            for column in sorted(self.required - row.keys())
+        )
+        return errors
+
+    def clean(self, rows: Any, max_errors: Optional[int] = None) -> list[dict]:
+        """
+        Validate rows, raise ValidationError listing errors of invalid rows
+        :param rows:
+        :param max_errors:
+        :return: cleaned rows
+        """
+        cleaned, errors = self.validate(rows, max_errors)
+        if errors:
+            raise RowsValidationError(errors)
+        return cleaned
+
+
+def get_row_validator(model: models.Model) -> RowValidator:
+    """
+    Get compiled input rows validator for dynamic model
+    :param model:
+    :return:
+    """
+    cache = get_model_cache(model)
+    validator = cache.get("row_validator")
+    if validator is None:
+        validator = cache["row_validator"] = RowValidator(model)
+
+    return validator
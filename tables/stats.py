@@ -0,0 +1,135 @@
+import json
+from typing import Any
+
+from django.db import connection, models
+from django.db.models.query import QuerySet
+
+from .utils import get_field_type
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """
+    Number of rows planner expects queryset to return.
+    Planner scales pg_class.reltuples by the current table size and applies
+    column statistics to filters, so nothing is scanned
+    :param queryset:
+    :return:
+    """
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_rows(queryset: QuerySet, exact: bool = False) -> tuple[int, bool]:
+    """
+    Count queryset rows, estimated on PostgreSQL unless exact count is requested
+    :param queryset:
+    :param exact:
+    :return: count and whether it is exact
+    """
+    if exact or connection.vendor != "postgresql":
+        return queryset.order_by().count(), True
+    return estimate_count(queryset), False
+
+
+def get_column_estimates(model: Any, rows: int) -> dict:
+    """
+    Per column statistics gathered by ANALYZE, min and max are taken from
+    histogram bounds and most common values, so they are approximate
+    :param model:
+    :param rows: estimated number of table rows
+    :return:
+    """
+    fields = {
+        field.column: field
+        for field in model._meta.concrete_fields
+        if not field.primary_key
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT attname, null_frac, n_distinct, "
+            "most_common_vals::text::text[], histogram_bounds::text::text[] "
+            "FROM pg_stats WHERE schemaname = current_schema() AND tablename = %s",
+            [model._meta.db_table],
+        )
+        analyzed = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    columns = {}
+    for column, field in fields.items():
+        if column not in analyzed:
+            columns[field.name] = None
+            continue
+
+        null_frac, n_distinct, common_values, bounds = analyzed[column]
+        values = [
+            field.to_python(value)
+            for value in (common_values or []) + (bounds or [])
+            if value is not None
+        ]
+        comparable = values and get_field_type(field) != "bool"
+        columns[field.name] = {
+            "null_count": round(null_frac * rows),
+            # negative n_distinct is a fraction of the number of rows
+            "distinct": round(-n_distinct * rows if n_distinct < 0 else n_distinct),
+            "min": min(values) if comparable else None,
+            "max": max(values) if comparable else None,
+        }
+    return columns
+
+
+def get_column_counts(model: Any) -> dict:
+    """
+    Exact per column statistics, computed with a single scan of the table
+    :param model:
+    :return:
+    """
+    aggregates = {}
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    for field in fields:
+        aggregates[f"{field.name}__null_count"] = models.Count(
+            "pk", filter=models.Q(**{f"{field.name}__isnull": True})
+        )
+        aggregates[f"{field.name}__distinct"] = models.Count(field.name, distinct=True)
+        if get_field_type(field) != "bool":
+            aggregates[f"{field.name}__min"] = models.Min(field.name)
+            aggregates[f"{field.name}__max"] = models.Max(field.name)
+
+    result = model.objects.aggregate(**aggregates) if aggregates else {}
+    return {
+        field.name: {
+            key: result.get(f"{field.name}__{key}")
+            for key in ("null_count", "distinct", "min", "max")
+        }
+        for field in fields
+    }
+
+
+def get_table_stats(model: Any, exact: bool = False) -> dict:
+    """
+    Table row count, size and per column statistics.
+    On PostgreSQL they come from planner statistics without scanning the table,
+    exact statistics scan it once
+    :param model:
+    :param exact:
+    :return:
+    """
+    rows, is_exact = count_rows(model.objects.all(), exact=exact)
+    stats = {"rows": rows, "exact": is_exact, "size": None, "analyzed_at": None}
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            # size of partitioned table is the size of its partitions
+            cursor.execute(
+                "SELECT (SELECT sum(pg_total_relation_size(relid))::bigint "
+                "FROM pg_partition_tree(s.relid)), "
+                "greatest(last_analyze, last_autoanalyze) "
+                "FROM pg_stat_user_tables s WHERE relid = %s::regclass",
+                [connection.ops.quote_name(model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        if row:
+            stats["size"], stats["analyzed_at"] = row
+
+    stats["columns"] = (
+        get_column_counts(model) if is_exact else get_column_estimates(model, rows)
+    )
+    return stats
@@ -0,0 +1,360 @@
+"""
+Summary tables: rows of a dynamic table grouped by fields with aggregates,
+kept in a table of their own and read by group lookups instead of scans.
+
+A statement trigger gets every inserted batch as a transition table and adds
+its aggregates to summary rows with INSERT ... ON CONFLICT DO UPDATE, so rows
+inserted by any endpoint (multi-row INSERT, COPY, upsert) update the summary
+without scanning the table. Updates, deletes and truncates can't be followed
+for min and max, they mark the summary stale and the next read rebuilds it.
+PostgreSQL 15 or newer only, summary rows with NULL groups need
+NULLS NOT DISTINCT unique index
+"""
+from typing import Any
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.backends.utils import truncate_name
+from django.utils import timezone
+from rest_framework import serializers
+
+from .aggregates import compile_aggregate
+from .filters import COERCERS, coerce_bool, get_model_field_types
+from .models import DynamicModel, Summary
+from .online import set_lock_timeout
+
+# column types of summary table by DynamicModelField type, strings are
+# unbounded, so max_length changes of the table don't affect summaries
+SUMMARY_TYPES = {
+    "string": "text",
+    "int": "bigint",
+    "float": "double precision",
+    "bool": "boolean",
+}
+
+# summary column of an inserted batch added to the stored one
+MERGES = {
+    "add": "{table}.{column} + EXCLUDED.{column}",
+    "sum": "COALESCE({table}.{column} + EXCLUDED.{column}, "
+    "{table}.{column}, EXCLUDED.{column})",
+    "min": "LEAST({table}.{column}, EXCLUDED.{column})",
+    "max": "GREATEST({table}.{column}, EXCLUDED.{column})",
+}
+
+# filter operators of summary reads, group lookups
+SUMMARY_OPERATORS = ("eq", "in", "isnull")
+
+# transition table of inserted rows in the trigger
+NEW_ROWS = "dt_new_rows"
+
+
+def check_postgresql():
+    if connection.vendor != "postgresql" or connection.pg_version < 150000:
+        raise serializers.ValidationError(
+            "summaries are supported on PostgreSQL 15 or newer only"
+        )
+
+
+def get_summary_table(summary: Summary) -> str:
+    return f"dynamic_tables_summary_{summary.id}"
+
+
+def get_trigger_name(summary: Summary) -> str:
+    return f"dt_summary_{summary.id}"
+
+
+def quote_column(name: str) -> str:
+    return connection.ops.quote_name(
+        truncate_name(name, connection.ops.max_name_length())
+    )
+
+
+class SummaryPlan:
+    """
+    Summary definition checked against table field types and compiled
+    to summary table columns. Every summary keeps row count in "count"
+    column, avg is kept as sum and count of values
+    """
+
+    def __init__(self, model: Any, group_by: list[str], aggregates: list[str]):
+        self.model = model
+        self.field_types = get_model_field_types(model)
+
+        unknown_fields = [name for name in group_by if name not in self.field_types]
+        if unknown_fields:
+            raise serializers.ValidationError(
+                {"group_by": f"unknown fields {unknown_fields}"}
+            )
+        if len(set(group_by)) != len(group_by):
+            raise serializers.ValidationError({"group_by": "duplicate fields"})
+        self.group_by = group_by
+
+        # column name to (type, aggregate of rows, merge)
+        self.columns = {"count": ("bigint", "COUNT(*)", "add")}
+        # result name to expression over summary columns
+        self.results = {}
+        for aggregate in aggregates:
+            name, _ = compile_aggregate(self.field_types, aggregate)
+            self.add_aggregate(name, aggregate)
+
+        clashes = (set(self.columns) | set(self.results)) & set(group_by)
+        if clashes:
+            raise serializers.ValidationError(
+                {"aggregates": f"names {sorted(clashes)} clash with group_by fields"}
+            )
+
+    def add_aggregate(self, name: str, aggregate: str):
+        function, _, field_name = aggregate.partition(":")
+        if not field_name:
+            self.results[name] = quote_column("count")
+            return
+
+        column = connection.ops.quote_name(
+            self.model._meta.get_field(field_name).column
+        )
+        field_type = self.field_types[field_name]
+        count, total = f"count_{field_name}", f"sum_{field_name}"
+        if function in ("count", "avg"):
+            self.columns[count] = ("bigint", f"COUNT({column})", "add")
+        if function in ("sum", "avg"):
+            self.columns[total] = (SUMMARY_TYPES[field_type], f"SUM({column})", "sum")
+        if function in ("min", "max"):
+            self.columns[name] = (
+                SUMMARY_TYPES[field_type],
+                f"{function.upper()}({column})",
+                function,
+            )
+
+        if function == "avg":
+            self.results[name] = (
+                f"{quote_column(total)}::double precision "
+                f"/ NULLIF({quote_column(count)}, 0)"
+            )
+        else:
+            self.results[name] = quote_column(name)
+
+    def create_table_sql(self, table: str) -> list[str]:
+        columns = [
+            f"{quote_column(name)} {SUMMARY_TYPES[self.field_types[name]]}"
+            for name in self.group_by
+        ] + [
+            f"{quote_column(name)} {column_type} NOT NULL"
+            if name == "count"
+            else f"{quote_column(name)} {column_type}"
+            for name, (column_type, _, _) in self.columns.items()
+        ]
+        # summary without groups is a single row
+        key = ", ".join(map(quote_column, self.group_by)) or "(true)"
+        return [
+            f"CREATE TABLE {connection.ops.quote_name(table)} ({', '.join(columns)})",
+            f"CREATE UNIQUE INDEX {connection.ops.quote_name(f'{table}_key')} "
+            f"ON {connection.ops.quote_name(table)} ({key}) NULLS NOT DISTINCT",
+        ]
+
+    def add_rows_sql(self, table: str, source: str) -> str:
+        """
+        Statement adding aggregates of source rows to summary rows
+        :param table: summary table
+        :param source: quoted table or transition table name
+        :return:
+        """
+        quote_name = connection.ops.quote_name
+        groups = [
+            quote_name(self.model._meta.get_field(name).column)
+            for name in self.group_by
+        ]
+        names = [*map(quote_column, self.group_by), *map(quote_column, self.columns)]
+        values = groups + [delta for _, delta, _ in self.columns.values()]
+        merges = ", ".join(
+            f"{quote_column(name)} = "
+            + MERGES[merge].format(table=quote_name(table), column=quote_column(name))
+            for name, (_, _, merge) in self.columns.items()
+        )
+        sql = (
+            f"INSERT INTO {quote_name(table)} ({', '.join(names)}) "
+            f"SELECT {', '.join(values)} FROM {source}"
+        )
+        if groups:
+            sql += f" GROUP BY {', '.join(groups)}"
+        target = ", ".join(map(quote_column, self.group_by)) or "(true)"
+        return f"{sql} ON CONFLICT ({target}) DO UPDATE SET {merges}"
+
+    def select_sql(self, table: str) -> str:
+        columns = [quote_column(name) for name in self.group_by] + [
+            f"{expression} AS {quote_column(name)}"
+            for name, expression in self.results.items()
+        ]
+        return f"SELECT {', '.join(columns)} FROM {connection.ops.quote_name(table)}"
+
+
+def get_summary_plan(model: Any, summary: Summary) -> SummaryPlan:
+    return SummaryPlan(model, summary.group_by, summary.aggregates or ["count"])
+
+
+def create_summary(model: Any, model_object: DynamicModel, data: dict) -> Summary:
+    """
+    Create summary table filled from table rows and the trigger keeping it
+    up to date, in one transaction. Writes to the table wait for it
+    :param model:
+    :param model_object:
+    :param data: validated SummarySerializer data
+    :return:
+    """
+    check_postgresql()
+    plan = SummaryPlan(model, data["group_by"], data["aggregates"] or ["count"])
+    if model_object.summaries.filter(name=data["name"]).exists():
+        raise serializers.ValidationError(
+            {"name": f"summary {data['name']} already exists"}
+        )
+
+    quote_name = connection.ops.quote_name
+    source = quote_name(model._meta.db_table)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            summary = Summary.objects.create(
+                model=model_object,
+                name=data["name"],
+                group_by=data["group_by"],
+                aggregates=data["aggregates"],
+                built_at=timezone.now(),
+            )
+            table = get_summary_table(summary)
+            trigger = get_trigger_name(summary)
+            for sql in plan.create_table_sql(table):
+                cursor.execute(sql)
+
+            cursor.execute(
+                f"CREATE FUNCTION {trigger}() RETURNS trigger AS $$ BEGIN "
+                f"IF TG_OP = 'INSERT' THEN {plan.add_rows_sql(table, NEW_ROWS)}; "
+                f"ELSE UPDATE {quote_name(Summary._meta.db_table)} SET stale = true "
+                f"WHERE id = {summary.id} AND NOT stale; "
+                f"END IF; RETURN NULL; END $$ LANGUAGE plpgsql"
+            )
+            # trigger takes a lock blocking writes, rows inserted after it
+            # are added by the trigger, the ones before by the first build
+            set_lock_timeout(cursor)
+            cursor.execute(
+                f"CREATE TRIGGER {trigger}_insert AFTER INSERT ON {source} "
+                f"REFERENCING NEW TABLE AS {NEW_ROWS} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION {trigger}()"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER {trigger}_change "
+                f"AFTER UPDATE OR DELETE OR TRUNCATE ON {source} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION {trigger}()"
+            )
+            cursor.execute(plan.add_rows_sql(table, source))
+    except DatabaseError as exc:
+        raise serializers.ValidationError(str(exc))
+    return summary
+
+
+def rebuild_summary(model: Any, summary: Summary):
+    """
+    Fill stale summary again from table rows
+    :param model:
+    :param summary:
+    :return:
+    """
+    plan = get_summary_plan(model, summary)
+    table = get_summary_table(summary)
+    with transaction.atomic(), connection.cursor() as cursor:
+        # writes marking the summary stale wait, rows inserted meanwhile
+        # are added after the rebuild by the trigger
+        summary = Summary.objects.select_for_update().get(id=summary.id)
+        if not summary.stale:
+            return
+        cursor.execute(f"TRUNCATE {connection.ops.quote_name(table)}")
+        cursor.execute(
+            plan.add_rows_sql(table, connection.ops.quote_name(model._meta.db_table))
+        )
+        summary.stale = False
+        summary.built_at = timezone.now()
+        summary.save(update_fields=["stale", "built_at"])
+
+
+def compile_summary_filters(
+    plan: SummaryPlan, filters: dict
+) -> tuple[list[str], list[Any]]:
+    """
+    Compile "<field>[__eq|__in|__isnull]" conditions on group_by fields to SQL
+    :param plan:
+    :param filters: as returned by DynamicTableFilter.get_filters()
+    :return: conditions and their parameters
+    """
+    conditions, params = [], []
+    for key, value in filters.items():
+        name, _, operator = key.partition("__")
+        operator = operator or "eq"
+        if name not in plan.group_by:
+            raise serializers.ValidationError({key: f"{name} is not a group_by field"})
+        if operator not in SUMMARY_OPERATORS:
+            raise serializers.ValidationError(
+                {key: f"operator {operator} is not supported, use {SUMMARY_OPERATORS}"}
+            )
+
+        column = quote_column(name)
+        coerce = COERCERS[plan.field_types[name]]
+        try:
+            if operator == "isnull":
+                null = coerce_bool(value)
+                conditions.append(f"{column} IS {'' if null else 'NOT '}NULL")
+            elif operator == "in":
+                conditions.append(f"{column} = ANY(%s)")
+                params.append([coerce(item) for item in value])
+            else:
+                conditions.append(f"{column} = %s")
+                params.append(coerce(value))
+        except (TypeError, ValueError):
+            raise serializers.ValidationError(
+                {key: f"invalid value {value!r} for {operator} on {name}"}
+            )
+    return conditions, params
+
+
+def read_summary(model: Any, summary: Summary, filters: dict) -> list[dict]:
+    """
+    Summary rows matching filters, a stale summary is rebuilt first
+    :param model:
+    :param summary:
+    :param filters: conditions on group_by fields
+    :return: one dict per group with group_by fields and aggregate results
+    """
+    plan = get_summary_plan(model, summary)
+    conditions, params = compile_summary_filters(plan, filters)
+    if summary.stale:
+        rebuild_summary(model, summary)
+
+    max_groups = settings.DYNAMIC_TABLES_AGGREGATE_MAX_GROUPS
+    sql = plan.select_sql(get_summary_table(summary))
+    if conditions:
+        sql += f" WHERE {' AND '.join(conditions)}"
+    if plan.group_by:
+        sql += f" ORDER BY {', '.join(map(quote_column, plan.group_by))}"
+    sql += f" LIMIT {max_groups + 1}"
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        names = [column.name for column in cursor.description]
+        groups = [dict(zip(names, row)) for row in cursor.fetchall()]
+    if len(groups) > max_groups:
+        raise serializers.ValidationError(
+            {"group_by": f"more than {max_groups} groups, narrow them with filters"}
+        )
+    return groups
+
+
+def drop_summary(summary: Summary):
+    """
+    Drop summary table and its trigger
+    :param summary:
+    :return:
+    """
+    quote_name = connection.ops.quote_name
+    trigger = get_trigger_name(summary)
+    with transaction.atomic(), connection.cursor() as cursor:
+        set_lock_timeout(cursor)
+        # triggers are dropped with the function
+        cursor.execute(f"DROP FUNCTION IF EXISTS {trigger}() CASCADE")
+        cursor.execute(f"DROP TABLE IF EXISTS {quote_name(get_summary_table(summary))}")
+        summary.delete()
@@ -1,5 +1,26 @@
+import base64
+import csv
+import json
+import threading
+import time
+from datetime import timedelta
+
 import pytest
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.core.signals import request_started
 from django.urls import reverse
+from django.utils import timezone
+
+from tables import jobs
+from tables.jobs import claim_job, run_job, run_jobs
+from tables.metrics import phase_queries, phase_seconds
+from tables.models import Job
+from tables.pagination import DynamicTableCursorPagination
+from tables.utils import get_model
 
 
 @pytest.fixture
@@ -64,10 +85,1455 @@ def test_add_get_rows(api_client, dummy_fields):
     url = reverse("table_retrieve_rows", kwargs={"id": table_id})
     response = api_client.get(url)
     assert response.status_code == 200
-    result = response.json()
+    result = response.json()["results"]
     assert len(result) == 2
 
     for row in result:
         assert row["id"] > 0
         assert row["dummy_field_1"] in ("ABC", "DEF")
         assert row["dummy_field_2"] in (123, 456)
+
+
+@pytest.mark.django_db
+def test_get_model_cached_per_version(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_2", "fields": dummy_fields[:2]}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    model, _ = get_model(table_id)
+    assert get_model(table_id)[0] is model
+
+    url = reverse("table_update", kwargs={"id": table_id})
+    data["fields"] = dummy_fields[:3]
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 200
+
+    new_model, model_object = get_model(table_id)
+    assert new_model is not model and model_object.version > 1
+    assert "dummy_field_3" in [field.name for field in new_model._meta.fields]
+    assert apps.get_model("tables", "new_dummy_table_2") is new_model
+
+
+@pytest.mark.django_db
+def test_add_rows_in_batches(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_3", "fields": dummy_fields[:2]}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": f"row {idx}", "dummy_field_2": idx} for idx in range(5)]
+    for atomic in (True, False):
+        data = {"rows": rows, "batch_size": 2, "atomic": atomic}
+        response = api_client.post(url, data, content_type="application/json")
+        assert response.status_code == 201
+        row_ids = response.json()
+        assert len(row_ids) == 5 and row_ids == sorted(row_ids)
+
+    data = {"rows": rows, "batch_size": 0}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_upload_rows(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_4", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_upload_rows", kwargs={"id": table_id})
+    body = (
+        'dummy_field_1,dummy_field_2,dummy_field_3\n"A, ""quoted""",1,\nB,x,2.5\nC,3,\n'
+    )
+    response = api_client.post(url, body, content_type="text/csv")
+    assert response.status_code == 201
+    result = response.json()
+    assert result["accepted"] == 2 and result["rejected"] == 1
+    assert result["errors"][0]["line"] == 3
+    assert "dummy_field_2" in result["errors"][0]["errors"]
+
+    body = '{"dummy_field_1": "D", "dummy_field_2": 4}\n{"unknown": 1}\nnot json\n'
+    response = api_client.post(url, body, content_type="application/x-ndjson")
+    assert response.status_code == 201
+    result = response.json()
+    assert result["accepted"] == 1 and result["rejected"] == 2
+
+    model, _ = get_model(table_id)
+    rows = list(model.objects.order_by("id").values_list("dummy_field_1", flat=True))
+    assert rows == ['A, "quoted"', "C", "D"]
+    assert all(model.objects.values_list("dummy_field_4", flat=True))
+
+    # text booleans are read like the ones of JSON rows, in any case
+    body = "dummy_field_1,dummy_field_2,dummy_field_4\nE,5,true\nF,6,FALSE\nG,7,x\n"
+    response = api_client.post(url, body, content_type="text/csv")
+    assert response.status_code == 201
+    result = response.json()
+    assert result["accepted"] == 2 and result["rejected"] == 1
+    assert "dummy_field_4" in result["errors"][0]["errors"]
+    assert dict(
+        model.objects.filter(dummy_field_1__in=["E", "F"]).values_list(
+            "dummy_field_1", "dummy_field_4"
+        )
+    ) == {"E": True, "F": False}
+
+    body = "dummy_field_1,unknown\nA,1\n"
+    response = api_client.post(url, body, content_type="text/csv")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_get_rows_pages(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {
+        "name": "new_dummy_table_5",
+        "fields": dummy_fields[:3],
+        "options": {"ordering": ["-dummy_field_3"]},
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {"dummy_field_1": str(idx), "dummy_field_2": idx, "dummy_field_3": idx % 3}
+        for idx in range(10)
+    ]
+    rows[0]["dummy_field_3"] = None
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    response = api_client.get(url, {"page_size": 3})
+    assert response.status_code == 200
+    pages = [response.json()]
+    while pages[-1]["next"]:
+        pages.append(api_client.get(pages[-1]["next"]).json())
+
+    assert [len(page["results"]) for page in pages] == [3, 3, 3, 1]
+    result = [row for page in pages for row in page["results"]]
+    assert [row["dummy_field_3"] for row in result] == [None, 2, 2, 2, 1, 1, 1, 0, 0, 0]
+    assert len({row["id"] for row in result}) == 10
+
+    previous_page = api_client.get(pages[2]["previous"]).json()
+    assert previous_page["results"] == pages[1]["results"]
+
+
+@pytest.mark.django_db
+def test_keyset_page_index_bound(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {
+        "name": "new_dummy_table_22",
+        "fields": dummy_fields[:2],
+        "indexes": [{"fields": ["dummy_field_2"]}],
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    model, _ = get_model(response.json()["id"])
+    model.objects.bulk_create(
+        model(dummy_field_1=str(idx), dummy_field_2=idx) for idx in range(2000)
+    )
+    position = model.objects.get(dummy_field_2=1500)
+
+    paginator = DynamicTableCursorPagination
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+    for ordering, bound in (
+        (("dummy_field_2", "id"), "dummy_field_2 >= 1500"),
+        (("-dummy_field_2", "-id"), "dummy_field_2 <= 1500"),
+    ):
+        queryset = model.objects.order_by(*paginator.get_order_by(ordering)).filter(
+            paginator.get_keyset_filter(model, ordering, [1500, position.pk])
+        )
+        plan = queryset[:10].explain(analyze=True)
+        # deep page is an index range scan, not a scan of the preceding rows
+        assert f"Index Cond: ({bound})" in plan
+        assert "IS NULL" not in plan
+        # only the row at the position itself is read and filtered out
+        assert "Rows Removed by Filter: 1\n" in plan
+        assert [row.dummy_field_2 for row in queryset[:3]] == (
+            [1501, 1502, 1503] if ordering[0] == "dummy_field_2" else [1499, 1498, 1497]
+        )
+
+
+@pytest.mark.django_db
+def test_export_rows(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_6", "fields": dummy_fields[:2]}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": f'"{idx}"', "dummy_field_2": idx} for idx in range(3)]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    response = api_client.get(url, {"export": "ndjson"})
+    assert response.status_code == 200 and response.streaming
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert [json.loads(line)["dummy_field_1"] for line in lines] == [
+        row["dummy_field_1"] for row in rows
+    ]
+
+    response = api_client.get(url, {"export": "csv"})
+    assert response["Content-Type"] == "text/csv"
+    lines = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+    assert lines[0] == ["id", "dummy_field_1", "dummy_field_2"]
+    assert [line[1:] for line in lines[1:]] == [
+        ['"0"', "0"],
+        ['"1"', "1"],
+        ['"2"', "2"],
+    ]
+
+    response = api_client.get(url, {"export": "xml"})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_update_table_plan(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_7", "fields": dummy_fields[:3]}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+    field_ids = {field["name"]: field["id"] for field in response.json()["fields"]}
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": "ABC", "dummy_field_2": 1, "dummy_field_3": 1.5}]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    # rename dummy_field_1, change dummy_field_2 type, drop dummy_field_3, add new one
+    data["fields"] = [
+        {
+            "id": field_ids["dummy_field_1"],
+            "name": "renamed_field",
+            "type": "string",
+            "options": {"max_length": 128, "help_text": "renamed"},
+        },
+        {"name": "dummy_field_2", "type": "float"},
+        dummy_fields[3],
+    ]
+    url = reverse("table_update", kwargs={"id": table_id})
+    response = api_client.put(
+        f"{url}?dry_run=true", data, content_type="application/json"
+    )
+    assert response.status_code == 200
+    plan = response.json()
+    assert plan["operations"] == [
+        {"operation": "rename_field", "from": "dummy_field_1", "to": "renamed_field"},
+        {"operation": "remove_field", "field": "dummy_field_3"},
+        {"operation": "add_field", "field": "dummy_field_4"},
+        {"operation": "alter_field", "field": "renamed_field", "physical": False},
+        {"operation": "alter_field", "field": "dummy_field_2", "physical": True},
+    ]
+    # drop, add and type change are combined into one ALTER TABLE
+    assert len(plan["sql"]) == 3
+    assert get_model(table_id)[1].version == 1
+
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 200
+
+    model, model_object = get_model(table_id)
+    assert model_object.version == 2
+    assert sorted(model_object.fields.values_list("name", flat=True)) == [
+        "dummy_field_2",
+        "dummy_field_4",
+        "renamed_field",
+    ]
+    assert list(
+        model.objects.values("renamed_field", "dummy_field_2", "dummy_field_4")
+    ) == [{"renamed_field": "ABC", "dummy_field_2": 1.0, "dummy_field_4": True}]
+
+    # shorter max_length than stored values is rejected, not cut
+    data["fields"][0]["options"]["max_length"] = 2
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 400
+    model, model_object = get_model(table_id)
+    assert model_object.version == 2
+    assert model.objects.get().renamed_field == "ABC"
+
+    # values of another type are checked against the new length too
+    data["fields"][0]["options"]["max_length"] = 128
+    data["fields"][1] = {"name": "dummy_field_2", "type": "string", "options": {}}
+    data["fields"][1]["options"]["max_length"] = 2
+    model.objects.update(dummy_field_2=123.5)
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 400
+    assert get_model(table_id)[0].objects.get().dummy_field_2 == 123.5
+
+
+@pytest.mark.django_db
+def test_filter_rows(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_8", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {
+            "dummy_field_1": f"name {idx}",
+            "dummy_field_2": idx,
+            "dummy_field_3": None if idx == 0 else idx / 2,
+            "dummy_field_4": idx % 2 == 0,
+        }
+        for idx in range(6)
+    ]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    def get_values(params):
+        response = api_client.get(url, params)
+        assert response.status_code == 200
+        return [row["dummy_field_2"] for row in response.json()["results"]]
+
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    assert get_values({"dummy_field_2__gte": 2, "dummy_field_4": "true"}) == [2, 4]
+    assert get_values({"dummy_field_2__range": "1,3", "ordering": "-id"}) == [3, 2, 1]
+    assert get_values({"dummy_field_2__in": "0,5"}) == [0, 5]
+    assert get_values({"dummy_field_1__prefix": "name 3"}) == [3]
+    assert get_values({"dummy_field_3__isnull": "true"}) == [0]
+    assert get_values({"ordering": "-dummy_field_4,-dummy_field_2"}) == [
+        4,
+        2,
+        0,
+        5,
+        3,
+        1,
+    ]
+
+    for params in (
+        {"unknown": 1},
+        {"dummy_field_2": "abc"},
+        {"dummy_field_2__prefix": "1"},
+        {"dummy_field_2__range": "1"},
+        {"ordering": "unknown"},
+    ):
+        response = api_client.get(url, params)
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_table_indexes(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {
+        "name": "new_dummy_table_9",
+        "fields": dummy_fields,
+        "indexes": [
+            {"fields": ["dummy_field_1", "dummy_field_2"]},
+            {"fields": ["dummy_field_2"], "condition": {"dummy_field_4": True}},
+        ],
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+    index_names = [index["name"] for index in response.json()["indexes"]]
+    assert len(index_names) == 2
+
+    url = reverse("table_indexes", kwargs={"id": table_id})
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert [(index["name"], index["status"]) for index in response.json()] == [
+        (name, "valid") for name in index_names
+    ]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": "ABC", "dummy_field_2": 1}] * 2
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    # unique index can't be built over duplicates, its spec is not kept
+    # and the error is reported with the applied update
+    url = reverse("table_update", kwargs={"id": table_id})
+    data["indexes"] = [
+        data["indexes"][1],
+        {"fields": ["dummy_field_1"], "unique": True},
+    ]
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 200
+    result = response.json()
+    assert [index["name"] for index in result["indexes"]] == index_names[1:]
+    assert len(result["index_errors"]) == 1
+    assert "could not create unique index" in list(result["index_errors"].values())[0]
+
+    model, model_object = get_model(table_id)
+    assert model_object.version == 2
+    assert [index["name"] for index in model_object.indexes] == index_names[1:]
+    url = reverse("table_indexes", kwargs={"id": table_id})
+    assert [index["name"] for index in api_client.get(url).json()] == index_names[1:]
+
+    # indexes must reference table fields
+    url = reverse("table_update", kwargs={"id": table_id})
+    data["indexes"] = [{"fields": ["unknown"]}]
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 400
+
+
+def get_index_validity(model) -> dict:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass AND NOT i.indisprimary",
+            [model._meta.db_table],
+        )
+        return dict(cursor.fetchall())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_table_indexes_concurrently(api_client, dummy_fields):
+    # outside of test transaction indexes are built with CREATE INDEX CONCURRENTLY
+    url = reverse("table_create")
+    data = {
+        "name": "new_dummy_table_23",
+        "fields": dummy_fields,
+        "indexes": [{"fields": ["dummy_field_2"]}],
+    }
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+    model, _ = get_model(table_id)
+    try:
+        index_names = [index["name"] for index in response.json()["indexes"]]
+        assert any(
+            query["sql"].startswith("CREATE INDEX CONCURRENTLY") for query in queries
+        )
+        assert get_index_validity(model) == {index_names[0]: True}
+
+        url = reverse("table_create_rows", kwargs={"id": table_id})
+        rows = [{"dummy_field_1": "ABC", "dummy_field_2": 1}] * 2
+        response = api_client.post(url, {"rows": rows}, content_type="application/json")
+        assert response.status_code == 201
+
+        # failed unique build over duplicates leaves no invalid index behind
+        url = reverse("table_update", kwargs={"id": table_id})
+        data["indexes"] = [
+            {"fields": ["dummy_field_1", "dummy_field_2"]},
+            {"fields": ["dummy_field_1"], "unique": True},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.put(url, data, content_type="application/json")
+        assert response.status_code == 200
+        result = response.json()
+        assert len(result["index_errors"]) == 1
+        assert "could not create unique index" in str(result["index_errors"])
+        assert any(
+            query["sql"].startswith("CREATE UNIQUE INDEX CONCURRENTLY")
+            for query in queries
+        )
+        index_names = [index["name"] for index in result["indexes"]]
+        assert len(index_names) == 1
+        model, _ = get_model(table_id)
+        assert get_index_validity(model) == {index_names[0]: True}
+
+        url = reverse("table_indexes", kwargs={"id": table_id})
+        response = api_client.get(url)
+        assert [index["status"] for index in response.json()] == ["valid"]
+    finally:
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(model)
+
+
+@pytest.mark.django_db
+def test_aggregate_rows(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_10", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {
+            "dummy_field_1": "even" if idx % 2 == 0 else "odd",
+            "dummy_field_2": idx,
+            "dummy_field_3": None if idx == 0 else float(idx),
+            "dummy_field_4": idx < 3,
+        }
+        for idx in range(6)
+    ]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    url = reverse("table_aggregate_rows", kwargs={"id": table_id})
+    response = api_client.get(
+        url,
+        {
+            "group_by": "dummy_field_1",
+            "aggregate": "count,sum:dummy_field_2,avg:dummy_field_3,max:dummy_field_2",
+        },
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "dummy_field_1": "even",
+            "count": 3,
+            "sum_dummy_field_2": 6,
+            "avg_dummy_field_3": 3.0,
+            "max_dummy_field_2": 4,
+        },
+        {
+            "dummy_field_1": "odd",
+            "count": 3,
+            "sum_dummy_field_2": 9,
+            "avg_dummy_field_3": 3.0,
+            "max_dummy_field_2": 5,
+        },
+    ]
+
+    # filters apply before grouping, without group_by the whole table is one group
+    response = api_client.get(url, {"dummy_field_4": "true", "aggregate": "count"})
+    assert response.json() == [{"count": 3}]
+
+    for params in (
+        {"aggregate": "sum:dummy_field_1"},
+        {"aggregate": "median:dummy_field_2"},
+        {"aggregate": "sum"},
+        {"group_by": "unknown"},
+    ):
+        response = api_client.get(url, params)
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_table_stats_and_counts(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_11", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {
+            "dummy_field_1": f"name {idx % 3}",
+            "dummy_field_2": idx,
+            "dummy_field_3": None if idx < 2 else float(idx),
+        }
+        for idx in range(10)
+    ]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    url = reverse("table_stats", kwargs={"id": table_id})
+    response = api_client.get(url, {"exact": "true"})
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["rows"] == 10 and stats["exact"]
+    assert stats["columns"]["dummy_field_1"]["distinct"] == 3
+    assert stats["columns"]["dummy_field_2"]["min"] == 0
+    assert stats["columns"]["dummy_field_2"]["max"] == 9
+    assert stats["columns"]["dummy_field_3"]["null_count"] == 2
+    assert stats["columns"]["dummy_field_4"]["min"] is None
+
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert set(response.json()["columns"]) == set(stats["columns"])
+
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    response = api_client.get(url, {"count": "exact", "dummy_field_2__gte": 4})
+    assert response.status_code == 200
+    assert response.json()["count"] == 6 and response.json()["count_exact"]
+
+    response = api_client.get(url, {"count": "estimate", "page_size": 2})
+    assert response.status_code == 200
+    assert response.json()["count"] >= 0 and len(response.json()["results"]) == 2
+
+    assert api_client.get(url, {"count": "all"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_async_add_get_rows(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_12", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows_async", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": f"name {idx}", "dummy_field_2": idx} for idx in range(5)]
+    response = api_client.post(
+        url, {"rows": rows, "batch_size": 2}, content_type="application/json"
+    )
+    assert response.status_code == 201
+    assert len(response.json()) == 5
+
+    response = api_client.post(
+        url,
+        {"rows": [{"dummy_field_2": "abc"}, {"unknown": 1}]},
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+    assert [(error["row"], error["column"]) for error in response.json()["rows"]] == [
+        (0, "dummy_field_2"),
+        (0, "dummy_field_1"),
+        (1, "unknown"),
+        (1, "dummy_field_1"),
+        (1, "dummy_field_2"),
+    ]
+
+    url = reverse("table_retrieve_rows_async", kwargs={"id": table_id})
+    response = api_client.get(
+        url, {"dummy_field_2__gte": 1, "ordering": "-dummy_field_2", "page_size": 3}
+    )
+    assert response.status_code == 200
+    page = response.json()
+    assert [row["dummy_field_2"] for row in page["results"]] == [4, 3, 2]
+    assert page["results"][0]["dummy_field_4"] is True
+
+    response = api_client.get(page["next"])
+    assert [row["dummy_field_2"] for row in response.json()["results"]] == [1]
+
+    response = api_client.get(url, {"export": "ndjson"})
+    assert response.status_code == 200
+
+    async def read_content(content):
+        return b"".join([chunk async for chunk in content])
+
+    lines = async_to_sync(read_content)(response.streaming_content).decode()
+    assert [json.loads(line)["dummy_field_2"] for line in lines.splitlines()] == list(
+        range(5)
+    )
+
+    api_client.logout()
+    assert api_client.get(url).status_code == 403
+
+    # authentication classes of DRF settings are used, not only the session
+    credentials = base64.b64encode(b"test_user:test_password").decode()
+    response = api_client.get(url, HTTP_AUTHORIZATION=f"Basic {credentials}")
+    assert response.status_code == 200 and len(response.json()["results"]) == 5
+    response = api_client.get(url, HTTP_AUTHORIZATION="Basic eDp5")
+    assert response.status_code == 403
+    assert response.json() == {"detail": "Invalid username/password."}
+
+
+@pytest.mark.django_db
+def test_database_stats(api_client):
+    response = api_client.get(reverse("database_stats"))
+    assert response.status_code == 200
+
+    result = response.json()
+    if result["pooled"]:
+        assert result["pools"][0]["acquired"] > 0
+        assert "hit_rate" in result["statements"]
+    else:
+        assert result == {"pooled": False}
+
+
+@pytest.mark.django_db
+def test_online_schema_change(
+    api_client, dummy_fields, mocker, settings, django_capture_on_commit_callbacks
+):
+    settings.DYNAMIC_TABLES_ALTER_BATCH_SIZE = 2
+    settings.DYNAMIC_TABLES_ALTER_BATCH_DELAY_MS = 0
+    # background part of the change runs in the test transaction
+    mocker.patch("tables.jobs.wake_workers", side_effect=run_jobs)
+
+    url = reverse("table_create")
+    data = {
+        "name": "new_dummy_table_13",
+        "fields": dummy_fields,
+        "indexes": [{"fields": ["dummy_field_2"]}],
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {"dummy_field_1": f"name {idx}", "dummy_field_2": idx, "dummy_field_3": None}
+        for idx in range(5)
+    ]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    url = reverse("table_update", kwargs={"id": table_id})
+    fields = [dict(field) for field in dummy_fields]
+    fields[1]["type"] = "float"
+    data = {"name": "new_dummy_table_13", "fields": fields}
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.put(
+            f"{url}?online=true", data, content_type="application/json"
+        )
+    assert response.status_code == 202
+    change_url = reverse(
+        "table_change", kwargs={"id": table_id, "change_id": response.json()["id"]}
+    )
+    change = api_client.get(change_url).json()
+    assert change["status"] == "done" and change["error"] == ""
+    assert change["rows_copied"] == 5 and change["progress"] == 1.0
+
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    results = api_client.get(url).json()["results"]
+    assert [row["dummy_field_2"] for row in results] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert all(isinstance(row["dummy_field_2"], float) for row in results)
+    # index of the changed field is rebuilt under its own name
+    url = reverse("table_indexes", kwargs={"id": table_id})
+    assert api_client.get(url).json()[0]["status"] == "valid"
+
+    # failed cast leaves the table as it was
+    url = reverse("table_update", kwargs={"id": table_id})
+    fields[0]["type"] = "int"
+    data = {"name": "new_dummy_table_13", "fields": fields}
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.put(
+            f"{url}?online=true", data, content_type="application/json"
+        )
+    assert response.status_code == 202
+    url = reverse("table_changes", kwargs={"id": table_id})
+    changes = api_client.get(url).json()
+    assert [change["status"] for change in changes] == ["failed", "done"]
+    model, _ = get_model(table_id)
+    assert model.objects.get(dummy_field_2=1).dummy_field_1 == "name 1"
+    with connection.cursor() as cursor:
+        columns = connection.introspection.get_table_description(
+            cursor, model._meta.db_table
+        )
+    assert [column.name for column in columns if "online" in column.name] == []
+
+    # values longer than the new max_length fail the change, they are not cut
+    url = reverse("table_update", kwargs={"id": table_id})
+    fields[0] = {**dummy_fields[0], "options": {"max_length": 4}}
+    data = {"name": "new_dummy_table_13", "fields": fields}
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.put(
+            f"{url}?online=true", data, content_type="application/json"
+        )
+    assert response.status_code == 202
+    change = api_client.get(
+        reverse(
+            "table_change", kwargs={"id": table_id, "change_id": response.json()["id"]}
+        )
+    ).json()
+    assert change["status"] == "failed" and "too long" in change["error"]
+    assert model.objects.get(dummy_field_2=1).dummy_field_1 == "name 1"
+
+    # change of a stopped worker fails once its job lease is over
+    fields[0] = dict(dummy_fields[0])
+    fields[2]["type"] = "int"
+    data = {"name": "new_dummy_table_13", "fields": fields}
+    response = api_client.put(
+        f"{url}?online=true", data, content_type="application/json"
+    )
+    assert response.status_code == 202
+    job = claim_job()
+    Job.objects.filter(id=job.id).update(
+        heartbeat_at=timezone.now()
+        - timedelta(seconds=settings.DYNAMIC_TABLES_JOB_LEASE)
+    )
+    assert claim_job() is None
+    change = api_client.get(
+        reverse(
+            "table_change", kwargs={"id": table_id, "change_id": response.json()["id"]}
+        )
+    ).json()
+    assert change["status"] == "failed" and "worker stopped" in change["error"]
+    with connection.cursor() as cursor:
+        columns = connection.introspection.get_table_description(
+            cursor, model._meta.db_table
+        )
+    assert [column.name for column in columns if "online" in column.name] == []
+    model.objects.create(dummy_field_1="name 5", dummy_field_2=5)
+
+    # other changes are not applied online
+    url = reverse("table_update", kwargs={"id": table_id})
+    data = {"name": "new_dummy_table_13_renamed", "fields": fields}
+    response = api_client.put(
+        f"{url}?online=true", data, content_type="application/json"
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_bulk_update_delete_rows(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_14", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {"dummy_field_1": f"name {idx}", "dummy_field_2": idx, "dummy_field_3": None}
+        for idx in range(10)
+    ]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    data = {"filter": {"dummy_field_2__gte": 5}, "values": {"dummy_field_3": "1.5"}}
+    response = api_client.patch(url, data, content_type="application/json")
+    assert response.status_code == 200 and response.json() == {"updated": 5}
+
+    model, _ = get_model(table_id)
+    ids = list(model.objects.order_by("id").values_list("id", flat=True))
+    data = {
+        "ids": ids[:3],
+        "values": {"dummy_field_1": "fixed", "dummy_field_4": False},
+    }
+    response = api_client.patch(url, data, content_type="application/json")
+    assert response.status_code == 200 and response.json() == {"updated": 3}
+    assert model.objects.filter(dummy_field_3=1.5).count() == 5
+    assert (
+        list(
+            model.objects.filter(
+                dummy_field_1="fixed", dummy_field_4=False
+            ).values_list("id", flat=True)
+        )
+        == ids[:3]
+    )
+
+    # values are checked against the schema
+    data = {"ids": ids, "values": {"dummy_field_2": "abc", "unknown": 1}}
+    response = api_client.patch(url, data, content_type="application/json")
+    assert response.status_code == 400
+    data = {"ids": ids, "filter": {"dummy_field_2": 1}, "values": {"dummy_field_2": 1}}
+    response = api_client.patch(url, data, content_type="application/json")
+    assert response.status_code == 400
+
+    # values breaking the natural key are rejected, nothing is updated
+    url = reverse("table_update", kwargs={"id": table_id})
+    data = {"name": "new_dummy_table_14", "fields": dummy_fields}
+    data["natural_key"] = ["dummy_field_2"]
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 200
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    data = {"ids": ids[3:5], "values": {"dummy_field_2": 100}}
+    response = api_client.patch(url, data, content_type="application/json")
+    assert response.status_code == 400 and "values" in response.json()
+    assert not model.objects.filter(dummy_field_2=100).exists()
+
+    response = api_client.delete(url, {"ids": ids[:2]}, content_type="application/json")
+    assert response.status_code == 200 and response.json() == {"deleted": 2}
+    response = api_client.delete(
+        url,
+        {"filter": {"dummy_field_3__isnull": True}},
+        content_type="application/json",
+    )
+    assert response.status_code == 200 and response.json() == {"deleted": 3}
+    assert model.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_upsert_rows(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {
+        "name": "new_dummy_table_15",
+        "fields": dummy_fields,
+        "natural_key": ["dummy_field_3"],
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    # nullable fields can't be a natural key
+    assert response.status_code == 400
+
+    data["natural_key"] = ["dummy_field_1"]
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+    assert response.json()["natural_key"] == ["dummy_field_1"]
+    url = reverse("table_indexes", kwargs={"id": table_id})
+    index = api_client.get(url).json()[0]
+    assert index["unique"] and index["fields"] == ["dummy_field_1"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": f"name {idx}", "dummy_field_2": idx} for idx in range(5)]
+    data = {"rows": rows, "upsert": True, "batch_size": 2}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 200 and response.json() == {"upserted": 5}
+
+    # overlapping records update existing rows, the last one of a key wins
+    rows = [
+        {"dummy_field_1": f"name {idx}", "dummy_field_2": idx * 10}
+        for idx in range(3, 8)
+    ] + [{"dummy_field_1": "name 7", "dummy_field_2": 700}]
+    data = {"rows": rows, "upsert": True}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 200 and response.json() == {"upserted": 5}
+
+    url = reverse("table_create_rows_async", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": "name 0", "dummy_field_2": -1}]
+    response = api_client.post(
+        url, {"rows": rows, "upsert": True}, content_type="application/json"
+    )
+    assert response.status_code == 200 and response.json() == {"upserted": 1}
+
+    model, _ = get_model(table_id)
+    assert dict(model.objects.values_list("dummy_field_1", "dummy_field_2")) == {
+        "name 0": -1,
+        "name 1": 1,
+        "name 2": 2,
+        "name 3": 30,
+        "name 4": 40,
+        "name 5": 50,
+        "name 6": 60,
+        "name 7": 700,
+    }
+
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_15_no_key", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    url = reverse("table_create_rows", kwargs={"id": response.json()["id"]})
+    data = {"rows": rows, "upsert": True}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_request_metrics(api_client, dummy_fields, settings, caplog):
+    settings.DYNAMIC_TABLES_METRICS = True
+    settings.DYNAMIC_TABLES_SLOW_REQUEST_MS = 1
+    phase_seconds.clear()
+    phase_queries.clear()
+
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_16", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    table_id = response.json()["id"]
+
+    url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": f"name {i}", "dummy_field_2": i} for i in range(10)]
+    response = api_client.post(url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    assert api_client.get(url).status_code == 200
+
+    lines = api_client.get(reverse("metrics")).content.decode().splitlines()
+    labels = f'endpoint="table_create_rows",table="{table_id}"'
+    for name in ("get_model", "validate", "insert_rows"):
+        assert (
+            f'dynamic_tables_phase_seconds_count{{{labels},phase="{name}"}} 1' in lines
+        )
+    # one multi-row INSERT in a transaction
+    assert (
+        f'dynamic_tables_phase_queries_bucket{{{labels},phase="insert_rows",le="5"}} 1'
+        in lines
+    )
+    labels = f'endpoint="table_retrieve_rows",table="{table_id}"'
+    for name in ("paginate", "serialize", "render", "sql", "total"):
+        assert (
+            f'dynamic_tables_phase_seconds_count{{{labels},phase="{name}"}} 1' in lines
+        )
+
+    slow_requests = [
+        record.getMessage()
+        for record in caplog.records
+        if record.name == "tables.metrics"
+    ]
+    assert len(slow_requests) == 3
+    assert f"GET /api/table/{table_id}/rows 200" in slow_requests[-1]
+    assert '"paginate": {"ms":' in slow_requests[-1]
+
+    settings.DYNAMIC_TABLES_METRICS = False
+    assert api_client.get(reverse("metrics")).status_code == 404
+
+
+@pytest.mark.django_db
+def test_columnar_export_import(api_client, dummy_fields):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_17", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_upload_rows", kwargs={"id": table_id})
+    valid = pa.record_batch(
+        {
+            "dummy_field_1": ["A", "B", "C"],
+            "dummy_field_2": pa.array([1, 2, 3], pa.int32()),
+            "dummy_field_3": [1.5, None, 3.0],
+        }
+    )
+    invalid = pa.record_batch(
+        {
+            "dummy_field_1": ["D", "", "F"],
+            "dummy_field_2": pa.array([4, 5, None], pa.int32()),
+            "dummy_field_3": pa.array([None, None, None], pa.float64()),
+        }
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, valid.schema) as writer:
+        writer.write_batch(valid)
+        writer.write_batch(invalid)
+    response = api_client.post(
+        url,
+        sink.getvalue().to_pybytes(),
+        content_type="application/vnd.apache.arrow.stream",
+    )
+    assert response.status_code == 201
+    result = response.json()
+    assert result["accepted"] == 4 and result["rejected"] == 2
+    assert [error["row"] for error in result["errors"]] == [4, 5]
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(pa.table({"dummy_field_1": ["G"], "dummy_field_2": ["7"]}), sink)
+    response = api_client.post(
+        url, sink.getvalue().to_pybytes(), content_type="application/vnd.apache.parquet"
+    )
+    assert response.status_code == 201
+    assert response.json()["accepted"] == 1
+
+    url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    response = api_client.get(url, {"export": "arrow", "ordering": "id"})
+    assert response["Content-Type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(b"".join(response.streaming_content)).read_all()
+    assert table.schema.types == [
+        pa.int64(),
+        pa.string(),
+        pa.int64(),
+        pa.float64(),
+        pa.bool_(),
+    ]
+    assert table.column("dummy_field_1").to_pylist() == ["A", "B", "C", "D", "G"]
+    assert table.column("dummy_field_3").to_pylist() == [1.5, None, 3.0, None, None]
+    assert all(table.column("dummy_field_4").to_pylist())
+
+    response = api_client.get(url, {"export": "parquet"})
+    assert response.status_code == 200
+    parquet_table = pq.read_table(pa.BufferReader(b"".join(response.streaming_content)))
+    assert parquet_table.equals(table)
+
+    async def read_content(content):
+        return b"".join([chunk async for chunk in content])
+
+    url = reverse("table_retrieve_rows_async", kwargs={"id": table_id})
+    response = api_client.get(url, {"export": "arrow", "ordering": "id"})
+    assert response.status_code == 200
+    content = async_to_sync(read_content)(response.streaming_content)
+    assert pa.ipc.open_stream(content).read_all().equals(table)
+
+
+@pytest.mark.django_db
+def test_partitioned_table(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {
+        "name": "new_dummy_table_18",
+        "fields": dummy_fields,
+        "partitioning": {"type": "range", "field": "dummy_field_2"},
+        "indexes": [{"fields": ["dummy_field_1"], "unique": True}],
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 400
+    assert "partitioning" in response.json()
+
+    data["indexes"] = [{"fields": ["dummy_field_1", "dummy_field_2"], "unique": True}]
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    assert response.json()["partitioning"] == data["partitioning"]
+    table_id = response.json()["id"]
+
+    url = reverse("table_partitions", kwargs={"id": table_id})
+    for partition in (
+        {"name": "p0", "start": 0, "end": 100},
+        {"name": "p1", "start": 100, "end": 200},
+        {"name": "rest", "default": True},
+    ):
+        response = api_client.post(url, partition, content_type="application/json")
+        assert response.status_code == 201
+    response = api_client.post(
+        url, {"name": "p2", "values": ["a"]}, content_type="application/json"
+    )
+    assert response.status_code == 400
+
+    rows_url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {"dummy_field_1": str(value), "dummy_field_2": value}
+        for value in (1, 50, 150, 500)
+    ]
+    response = api_client.post(
+        rows_url, {"rows": rows}, content_type="application/json"
+    )
+    assert response.status_code == 201, response.json()
+
+    partitions = {
+        partition["name"]: partition for partition in api_client.get(url).json()
+    }
+    p0 = "tables_new_dummy_table_18_p0"
+    assert partitions[p0]["bounds"] == "FOR VALUES FROM (0) TO (100)"
+    assert partitions["tables_new_dummy_table_18_rest"]["bounds"] == "DEFAULT"
+
+    # schema changes of the table apply to its partitions
+    update_url = reverse("table_update", kwargs={"id": table_id})
+    data["fields"] = dummy_fields + [
+        {"name": "dummy_field_5", "type": "int", "options": {"null": True}}
+    ]
+    response = api_client.put(update_url, data, content_type="application/json")
+    assert response.status_code == 200
+    data["partitioning"] = {"type": "hash", "field": "dummy_field_2"}
+    response = api_client.put(update_url, data, content_type="application/json")
+    assert response.status_code == 400
+
+    model, _ = get_model(table_id)
+    plan = model.objects.filter(dummy_field_2__gte=100, dummy_field_2__lt=200).explain()
+    assert "_p1" in plan and "_p0" not in plan
+
+    list_url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+
+    def listed_values():
+        response = api_client.get(list_url, {"ordering": "dummy_field_2"})
+        return [row["dummy_field_2"] for row in response.json()["results"]]
+
+    assert listed_values() == [1, 50, 150, 500]
+
+    response = api_client.post(
+        reverse("table_partition_detach", kwargs={"id": table_id, "name": p0})
+    )
+    assert response.status_code == 200
+    assert listed_values() == [150, 500]
+    response = api_client.post(
+        reverse("table_partition_attach", kwargs={"id": table_id, "name": p0}),
+        {"start": 0, "end": 100},
+        content_type="application/json",
+    )
+    assert response.status_code == 200
+    assert listed_values() == [1, 50, 150, 500]
+
+    response = api_client.delete(
+        reverse(
+            "table_partition",
+            kwargs={"id": table_id, "name": "tables_new_dummy_table_18_p1"},
+        )
+    )
+    assert response.status_code == 204
+    assert listed_values() == [1, 50, 500]
+    assert [partition["name"] for partition in api_client.get(url).json()] == [
+        p0,
+        "tables_new_dummy_table_18_rest",
+    ]
+
+
+def test_conditional_get_rows(
+    api_client, dummy_fields, settings, django_assert_num_queries
+):
+    settings.DYNAMIC_TABLES_ROWS_CACHE_TIMEOUT = 60
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_19", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    add_url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [{"dummy_field_1": f"name {idx}", "dummy_field_2": idx} for idx in range(3)]
+    response = api_client.post(add_url, {"rows": rows}, content_type="application/json")
+    assert response.status_code == 201
+
+    for name in ("table_retrieve_rows", "table_retrieve_rows_async"):
+        url = reverse(name, kwargs={"id": table_id})
+        response = api_client.get(url, {"page_size": 2})
+        assert response.status_code == 200
+        etag = response["ETag"]
+        assert response["Last-Modified"]
+        page = response.json()
+
+        # session, user and dynamic model lookups, rows are not read
+        with django_assert_num_queries(3):
+            response = api_client.get(url, {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        # cached page
+        with django_assert_num_queries(3):
+            response = api_client.get(url, {"page_size": 2})
+        assert response.status_code == 200
+        assert response.json() == page and response["ETag"] == etag
+
+    response = api_client.post(
+        add_url, {"rows": rows[:1]}, content_type="application/json"
+    )
+    assert response.status_code == 201
+    response = api_client.get(url, {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+    assert response.json()["results"] == page["results"]
+    etag = response["ETag"]
+
+    rows_url = reverse("table_retrieve_rows", kwargs={"id": table_id})
+    response = api_client.delete(
+        rows_url, {"ids": [page["results"][0]["id"]]}, content_type="application/json"
+    )
+    assert response.json() == {"deleted": 1}
+    response = api_client.get(rows_url, {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == 2
+    assert response.json()["results"][0]["id"] != page["results"][0]["id"]
+    etag = response["ETag"]
+
+    url = reverse("table_update", kwargs={"id": table_id})
+    data = {"name": "new_dummy_table_19", "fields": dummy_fields[:3]}
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 200
+    response = api_client.get(rows_url, {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert "dummy_field_4" not in response.json()["results"][0]
+
+
+def test_background_jobs(
+    api_client, dummy_fields, mocker, settings, django_capture_on_commit_callbacks
+):
+    # jobs run in the test transaction instead of worker threads
+    mocker.patch("tables.jobs.wake_workers", side_effect=run_jobs)
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_20", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    url = reverse("table_update", kwargs={"id": table_id})
+    fields = dummy_fields + [{"name": "dummy_field_5", "type": "int"}]
+    data = {"name": "new_dummy_table_20", "fields": fields}
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.put(
+            f"{url}?background=true", data, content_type="application/json"
+        )
+    assert response.status_code == 202
+    assert response.json()["status"] == "pending"
+
+    url = reverse("table_job", kwargs={"id": table_id, "job_id": response.json()["id"]})
+    job = api_client.get(url).json()
+    assert job["status"] == "done" and job["progress"] == 1.0
+    assert job["duration"] >= 0
+    assert job["result"]["operations"] == [
+        {"operation": "add_field", "field": "dummy_field_5"}
+    ]
+
+    url = reverse("table_upload_rows", kwargs={"id": table_id})
+    body = "dummy_field_1,dummy_field_2,dummy_field_5\nA,1,1\nB,2,x\n"
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.post(
+            f"{url}?background=true", body, content_type="text/csv"
+        )
+    assert response.status_code == 202
+    url = reverse("table_job", kwargs={"id": table_id, "job_id": response.json()["id"]})
+    job = api_client.get(url).json()
+    assert job["status"] == "done"
+    assert job["result"]["accepted"] == 1 and job["result"]["rejected"] == 1
+
+    # the second job of the table waits until the first one is finished
+    url = reverse("table_update", kwargs={"id": table_id})
+    data = {"name": "new_dummy_table_20", "fields": dummy_fields + [fields[-1]]}
+    for _ in range(2):
+        response = api_client.put(
+            f"{url}?background=true", data, content_type="application/json"
+        )
+        assert response.status_code == 202
+    first = claim_job()
+    assert claim_job() is None
+    # updates of requests don't overtake queued ones
+    renamed = {**data, "name": "new_dummy_table_20_renamed"}
+    response_sync = api_client.put(url, renamed, content_type="application/json")
+    assert response_sync.status_code == 400
+    run_job(first)
+    second = claim_job()
+    assert second.id == response.json()["id"]
+
+    # job of a stopped worker fails once its lease is over
+    Job.objects.filter(id=second.id).update(
+        heartbeat_at=timezone.now()
+        - timedelta(seconds=settings.DYNAMIC_TABLES_JOB_LEASE)
+    )
+    assert claim_job() is None
+    run_job(second)
+
+    response = api_client.get(reverse("table_jobs", kwargs={"id": table_id}))
+    assert [job["status"] for job in response.json()] == ["failed"] + ["done"] * 3
+    assert response.json()[0]["error"] == {
+        "detail": "worker stopped before the job was finished"
+    }
+    response_sync = api_client.put(url, renamed, content_type="application/json")
+    assert response_sync.status_code == 200
+
+    response = api_client.put(
+        f"{url}?background=true&online=true", data, content_type="application/json"
+    )
+    assert response.status_code == 400
+
+
+def wait_for(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.mark.django_db(transaction=True)
+def test_job_worker_threads(api_client, dummy_fields, mocker, settings):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_24", "fields": dummy_fields[:2]}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+    model, model_object = get_model(table_id)
+
+    # job of a worker stopped before the lease ran out blocks the table
+    stopped_at = timezone.now() - timedelta(
+        seconds=settings.DYNAMIC_TABLES_JOB_LEASE + 1
+    )
+    stalled = Job.objects.create(
+        model=model_object,
+        kind=Job.UPDATE_TABLE,
+        status=Job.RUNNING,
+        started_at=stopped_at,
+        heartbeat_at=stopped_at,
+    )
+
+    # upload waits until the test has seen its heartbeat
+    release = threading.Event()
+    run_upload_rows = jobs.JOB_RUNNERS[Job.UPLOAD_ROWS]
+
+    def run_upload_rows_released(job):
+        release.wait(10)
+        return run_upload_rows(job)
+
+    mocker.patch.dict(jobs.JOB_RUNNERS, {Job.UPLOAD_ROWS: run_upload_rows_released})
+    mocker.patch.object(jobs, "HEARTBEAT_INTERVAL", 0.05)
+    # worker threads of a fresh server process start with its first request
+    mocker.patch.object(jobs, "_executor", None)
+    request_started.connect(jobs.start_workers)
+    settings.DYNAMIC_TABLES_JOB_WORKERS = 2
+    try:
+        url = reverse("table_upload_rows", kwargs={"id": table_id})
+        response = api_client.post(
+            f"{url}?background=true",
+            "dummy_field_1,dummy_field_2\nA,1\n",
+            content_type="text/csv",
+        )
+        assert response.status_code == 202
+        upload = Job.objects.filter(id=response.json()["id"])
+        assert jobs._executor is not None
+
+        # worker thread claimed the upload after failing the stalled job,
+        # keep_alive thread saves heartbeats while it runs
+        assert wait_for(
+            lambda: upload.filter(heartbeat_at__gt=F("started_at")).exists()
+        )
+        stalled.refresh_from_db()
+        assert stalled.status == Job.FAILED
+        assert stalled.error == {"detail": "worker stopped before the job was finished"}
+
+        release.set()
+        assert wait_for(lambda: upload.get().status == Job.DONE)
+        assert upload.get().result["accepted"] == 1
+        assert model.objects.count() == 1
+    finally:
+        release.set()
+        request_started.disconnect(jobs.start_workers)
+        if jobs._executor is not None:
+            jobs._executor.shutdown(wait=True)
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(model)
+
+
+def test_summaries(api_client, dummy_fields):
+    url = reverse("table_create")
+    data = {"name": "new_dummy_table_21", "fields": dummy_fields}
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    table_id = response.json()["id"]
+
+    rows_url = reverse("table_create_rows", kwargs={"id": table_id})
+    rows = [
+        {
+            "dummy_field_1": "even" if idx % 2 == 0 else "odd",
+            "dummy_field_2": idx,
+            "dummy_field_3": None if idx == 0 else float(idx),
+        }
+        for idx in range(6)
+    ]
+    response = api_client.post(
+        rows_url, {"rows": rows}, content_type="application/json"
+    )
+    assert response.status_code == 201
+
+    url = reverse("table_summaries", kwargs={"id": table_id})
+    aggregates = [
+        "count",
+        "sum:dummy_field_2",
+        "avg:dummy_field_3",
+        "max:dummy_field_2",
+    ]
+    data = {
+        "name": "by_parity",
+        "group_by": ["dummy_field_1"],
+        "aggregates": aggregates,
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 201
+    assert response.json()["stale"] is False
+    data = {
+        "name": "bad",
+        "group_by": ["dummy_field_1"],
+        "aggregates": ["sum:dummy_field_1"],
+    }
+    response = api_client.post(url, data, content_type="application/json")
+    assert response.status_code == 400
+
+    summary_url = reverse("table_summary", kwargs={"id": table_id, "name": "by_parity"})
+    aggregate_url = reverse("table_aggregate_rows", kwargs={"id": table_id})
+    params = {"group_by": "dummy_field_1", "aggregate": ",".join(aggregates)}
+
+    def check_summary():
+        expected = api_client.get(aggregate_url, params).json()
+        assert api_client.get(summary_url).json() == expected
+
+    check_summary()
+
+    # inserted batches are added by the trigger
+    more_rows = [
+        {"dummy_field_1": name, "dummy_field_2": 10, "dummy_field_3": 0.5}
+        for name in ("odd", "other")
+    ]
+    response = api_client.post(
+        rows_url, {"rows": more_rows}, content_type="application/json"
+    )
+    assert response.status_code == 201
+    upload_url = reverse("table_upload_rows", kwargs={"id": table_id})
+    body = "dummy_field_1,dummy_field_2\neven,20\n"
+    response = api_client.post(upload_url, body, content_type="text/csv")
+    assert response.status_code == 201
+    response = api_client.get(url)
+    assert [(summary["name"], summary["stale"]) for summary in response.json()] == [
+        ("by_parity", False)
+    ]
+    check_summary()
+
+    response = api_client.get(summary_url, {"dummy_field_1__in": "odd,other"})
+    assert [group["dummy_field_1"] for group in response.json()] == ["odd", "other"]
+    response = api_client.get(summary_url, {"dummy_field_2": 1})
+    assert response.status_code == 400
+
+    # deleted rows make the summary stale, it is rebuilt on read
+    response = api_client.delete(
+        reverse("table_retrieve_rows", kwargs={"id": table_id}),
+        {"filter": {"dummy_field_2__gte": 10}},
+        content_type="application/json",
+    )
+    assert response.json() == {"deleted": 3}
+    assert api_client.get(url).json()[0]["stale"] is True
+    check_summary()
+    assert api_client.get(url).json()[0]["stale"] is False
+
+    url = reverse("table_update", kwargs={"id": table_id})
+    data = {"name": "new_dummy_table_21", "fields": dummy_fields[:1] + dummy_fields[2:]}
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 400
+
+    assert api_client.delete(summary_url).status_code == 204
+    response = api_client.put(url, data, content_type="application/json")
+    assert response.status_code == 200
+    # dropped summary left no trigger behind
+    response = api_client.post(
+        rows_url, {"rows": [{"dummy_field_1": "last"}]}, content_type="application/json"
+    )
+    assert response.status_code == 201
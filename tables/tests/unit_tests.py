@@ -1,7 +1,27 @@
+import gc
+import weakref
+
+import psycopg2
 import pytest
-from django.db import models
+from django.apps import apps
+from django.db import connection, models
 
 from tables import utils
+from tables.benchmarks.lifecycle import Case, compare
+from tables.backends.postgresql_pool.pool import ConnectionPool, PoolTimeout
+from tables.backends.postgresql_pool.statements import (
+    PooledConnection,
+    PreparingCursor,
+    to_positional,
+)
+from tables.filters import select_rows
+from tables.models import DynamicModel, DynamicModelField
+from tables.serializers import (
+    get_row_serializer_class,
+    get_row_validator,
+    get_row_values_serializer,
+)
+from tables.registry import ModelRegistry, model_registry
 
 
 def test_prepare_fields(dummy_fields):
@@ -66,3 +86,283 @@ def test_get_single_input_field(dummy_fields):
     assert dummy_field_1.get("name") == "dummy_field_1"
     assert dummy_field_1.get("type") == "string"
     assert dummy_field_1.get("options") == {"max_length": 128}
+
+
+def test_model_registry_lru_eviction():
+    registry = ModelRegistry(max_size=2)
+    for model_id in range(1, 4):
+        fields = utils.prepare_fields(
+            [{"name": "dummy_field", "type": "int"}], remove_extra_options=True
+        )
+        model = utils.create_model(f"dummy_registry_model_{model_id}", fields)
+        registry.add(model_id, 1, model)
+        assert registry.get(model_id, 1) is model
+        assert registry.get(model_id, 2) is None
+
+    # least recently used class is evicted and unregistered from Django
+    assert len(registry) == 2 and 1 not in registry
+    assert "dummy_registry_model_1" not in apps.all_models["tables"]
+    assert "dummy_registry_model_3" in apps.all_models["tables"]
+
+    registry.clear()
+    assert "dummy_registry_model_3" not in apps.all_models["tables"]
+
+
+def test_row_serializers_cached_per_model(dummy_fields):
+    fields = utils.prepare_fields(dummy_fields, remove_extra_options=True)
+    model = utils.create_model("dummy_serializer_model", fields)
+
+    serializer_class = get_row_serializer_class(model)
+    assert get_row_serializer_class(model) is serializer_class
+    assert serializer_class.Meta.model is model
+
+    row_serializer = get_row_values_serializer(model)
+    assert get_row_values_serializer(model) is row_serializer
+    assert row_serializer.columns == (
+        "id",
+        "dummy_field_1",
+        "dummy_field_2",
+        "dummy_field_3",
+        "dummy_field_4",
+    )
+    assert row_serializer.to_representation([(1, "ABC", 2, None, True)]) == [
+        {
+            "id": 1,
+            "dummy_field_1": "ABC",
+            "dummy_field_2": 2,
+            "dummy_field_3": None,
+            "dummy_field_4": True,
+        }
+    ]
+
+
+def test_row_serializers_freed_with_model(dummy_fields):
+    registry = ModelRegistry(max_size=1)
+    fields = utils.prepare_fields(dummy_fields, remove_extra_options=True)
+    model = utils.create_model("dummy_evicted_model", fields)
+    registry.add(1, 1, model)
+    get_row_serializer_class(model)
+    get_row_values_serializer(model)
+    get_row_validator(model)
+    model_ref = weakref.ref(model)
+
+    registry.add(2, 1, utils.create_model("dummy_kept_model", fields))
+    del model
+    gc.collect()
+    assert model_ref() is None
+    registry.clear()
+
+
+def test_row_validator_matches_row_serializer(dummy_fields):
+    fields = utils.prepare_fields(dummy_fields, remove_extra_options=True)
+    model = utils.create_model("dummy_validator_model", fields)
+    validator = get_row_validator(model)
+    assert get_row_validator(model) is validator
+
+    rows = [
+        {"dummy_field_1": " abc ", "dummy_field_2": "12", "dummy_field_3": "1.5"},
+        {"dummy_field_1": 7, "dummy_field_2": 3.0, "dummy_field_4": "no"},
+        {"dummy_field_1": "x", "dummy_field_2": 1, "dummy_field_3": None},
+        {"dummy_field_1": "", "dummy_field_2": 2.5},
+        {"dummy_field_1": True, "dummy_field_2": 2**40, "dummy_field_4": "maybe"},
+        {"dummy_field_1": "x" * 129, "dummy_field_2": None, "dummy_field_3": "a"},
+        {"dummy_field_2": [1]},
+    ]
+    cleaned, errors = validator.validate(rows)
+
+    serializer = get_row_serializer_class(model)(data=rows, many=True)
+    assert not serializer.is_valid()
+    expected_errors = [
+        {"row": index, "column": column, "errors": [str(error) for error in messages]}
+        for index, row_errors in enumerate(serializer.errors)
+        for column, messages in row_errors.items()
+    ]
+    key = lambda error: (error["row"], error["column"])  # noqa: E731
+    assert sorted(errors, key=key) == sorted(expected_errors, key=key)
+    assert cleaned == []
+
+    assert validator.validate(rows[:3]) == (
+        [
+            {"dummy_field_1": "abc", "dummy_field_2": 12, "dummy_field_3": 1.5},
+            {"dummy_field_1": "7", "dummy_field_2": 3, "dummy_field_4": False},
+            {"dummy_field_1": "x", "dummy_field_2": 1, "dummy_field_3": None},
+        ],
+        [],
+    )
+
+    _, errors = validator.validate([{"unknown": 1}, "row"] * 10, max_errors=4)
+    assert errors == [
+        {
+            "row": 0,
+            "column": "unknown",
+            "errors": ["unknown field for model dummy_validator_model"],
+        },
+        {"row": 0, "column": "dummy_field_1", "errors": ["This field is required."]},
+        {"row": 0, "column": "dummy_field_2", "errors": ["This field is required."]},
+        {"row": 1, "column": None, "errors": ["row is not a JSON object"]},
+    ]
+
+
+@pytest.mark.django_db
+def test_resolve_fields(dummy_fields, django_assert_num_queries):
+    with django_assert_num_queries(3):
+        fields = DynamicModelField.objects.resolve(dummy_fields)
+    assert [field.name for field in fields] == [field["name"] for field in dummy_fields]
+
+    # options derived from name and missing options don't make new definitions
+    same_fields = [
+        {"name": "dummy_field_2", "type": "int", "options": {}},
+        {"name": "dummy_field_1", "type": "string", "options": {"max_length": 128}},
+    ]
+    with django_assert_num_queries(1):
+        resolved = DynamicModelField.objects.resolve(same_fields)
+    assert resolved == [fields[1], fields[0]]
+    assert DynamicModelField.objects.count() == len(dummy_fields)
+
+
+class FakeConnection:
+    closed = 0
+    autocommit = True
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def test_connection_pool():
+    pool = ConnectionPool(FakeConnection, max_size=2, timeout=0.05, max_lifetime=60)
+    first, second = pool.acquire(), pool.acquire()
+    # pool is bounded
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    # released connection is reused, broken and expired ones are replaced
+    pool.release(first)
+    assert pool.acquire() is first
+    first.close()
+    pool.release(first)
+    second.created_at -= 120
+    pool.release(second)
+    assert pool.acquire() not in (first, second)
+
+    stats = pool.stats()
+    assert stats["acquired"] == 4 and stats["created"] == 3
+    assert stats["timeouts"] == 1 and stats["closed_expired"] == 1
+    assert stats["wait_time_max_ms"] >= 50
+
+
+def test_select_rows_by_ids():
+    queryset = select_rows(DynamicModel.objects.all(), ids=[1, 2, 3])
+    sql, params = queryset.query.sql_with_params()
+    # one array parameter for any number of ids
+    assert sql.endswith('WHERE "tables_dynamicmodel"."id" = ANY(%s)')
+    assert params == ([1, 2, 3],)
+    # the lookup is not registered on fields of the whole project
+    assert "any" not in models.Field.get_lookups()
+
+
+def test_to_positional():
+    assert to_positional(
+        'SELECT "t"."a" FROM "t" WHERE "t"."a" LIKE \'x%%\' AND "t"."b" IN (%s, %s)'
+    ) == (
+        'SELECT "t"."a" FROM "t" WHERE "t"."a" LIKE \'x%\' AND "t"."b" IN ($1, $2)',
+        2,
+    )
+
+
+@pytest.mark.django_db
+def test_prepared_statements(mocker):
+    conn_params = {
+        **connection.get_connection_params(),
+        "connection_factory": PooledConnection,
+        "cursor_factory": PreparingCursor,
+    }
+    raw_connection = psycopg2.connect(**conn_params)
+    raw_connection.autocommit = True
+    version = mocker.patch.object(model_registry, "get_table_version")
+    version.return_value = 1
+    sql = (
+        'SELECT "dummy_prepared"."a" FROM "dummy_prepared" '
+        'WHERE "dummy_prepared"."a" > %s'
+    )
+    try:
+        with raw_connection.cursor() as cursor:
+            cursor.execute('CREATE TEMP TABLE "dummy_prepared" (a int)')
+            cursor.execute('INSERT INTO "dummy_prepared" VALUES (1), (2), (3)', [])
+
+            # prepared on second run, then executed by name
+            for _ in range(3):
+                cursor.execute(sql, [1])
+                assert cursor.fetchall() == [(2,), (3,)]
+            cursor.execute("SELECT count(*) FROM pg_prepared_statements")
+            assert cursor.fetchone()[0] == 1
+
+            # altered table gets new statements
+            version.return_value = 2
+            for _ in range(2):
+                cursor.execute(sql, [2])
+                assert cursor.fetchall() == [(3,)]
+            assert len(raw_connection.statements.statements) == 2
+    finally:
+        raw_connection.close()
+
+
+@pytest.mark.django_db
+def test_prepared_statements_eviction(mocker):
+    conn_params = {
+        **connection.get_connection_params(),
+        "connection_factory": PooledConnection,
+        "cursor_factory": PreparingCursor,
+    }
+    raw_connection = psycopg2.connect(**conn_params)
+    raw_connection.autocommit = True
+    raw_connection.statements.max_size = 1
+    mocker.patch.object(model_registry, "get_table_version", return_value=1)
+    select = 'SELECT "dummy_prepared"."a" FROM "dummy_prepared" WHERE '
+    try:
+        with raw_connection.cursor() as cursor:
+            cursor.execute('CREATE TEMP TABLE "dummy_prepared" (a int)')
+            for sql in (f'{select}"dummy_prepared"."a" > %s', f"{select}%s = 1"):
+                for _ in range(2):
+                    cursor.execute(sql, [1])
+            # the first statement was evicted
+            assert raw_connection.statements.deallocate == ["dt_1"]
+
+            # PREPARE fails on parameter of unknown type, the query still runs
+            for _ in range(2):
+                cursor.execute(f"{select}%s IS NULL", [1])
+                assert cursor.fetchall() == []
+            # failed statement neither evicted nor leaked the cached one
+            assert raw_connection.statements.deallocate == []
+            assert list(raw_connection.statements.statements.values()) == [("dt_2", 1)]
+            cursor.execute("SELECT name FROM pg_prepared_statements")
+            assert cursor.fetchall() == [("dt_2",)]
+    finally:
+        raw_connection.close()
+
+
+def test_benchmark_compare():
+    baseline = {
+        "get_model[columns=5]": {"time_ms": 2.0, "queries": 1, "peak_memory_kb": 20},
+        "insert[rows=10]": {"time_ms": 50.0, "queries": 3, "peak_memory_kb": 500},
+    }
+    results = {
+        # within threshold and noise floor
+        "get_model[columns=5]": {"time_ms": 2.9, "queries": 1, "peak_memory_kb": 80},
+        "insert[rows=10]": {"time_ms": 80.0, "queries": 4, "peak_memory_kb": 500},
+        "new[rows=10]": {"time_ms": 1.0, "queries": 1, "peak_memory_kb": 1},
+    }
+    assert compare(results, baseline, threshold=0.5) == [
+        "insert[rows=10]: 4 queries, baseline 3",
+        "insert[rows=10]: time_ms 80.0, baseline 50.0",
+    ]
+
+
+def test_benchmark_rows_per_sec():
+    case = Case("insert", {"rows": 1000}, run=lambda _: None, repeat=1, rows=1000)
+    result = case.measure()
+    assert result["queries"] == 0
+    assert result["rows_per_sec"] > 1000
+    assert "rows_per_sec" not in Case("get", {}, run=lambda _: None).measure()
@@ -1,12 +1,33 @@
 from django.urls import path
 
+from .async_views import AsyncAddRowsDynamicModelView, AsyncListDynamicTableRowsView
 from .views import (
     AddRowsDynamicModelView,
+    AggregateDynamicTableRowsView,
+    AttachDynamicModelPartitionView,
     CreateUpdateDynamicModelView,
+    DatabaseStatsView,
+    DetachDynamicModelPartitionView,
+    DynamicModelChangesView,
+    DynamicModelChangeView,
+    DynamicModelJobsView,
+    DynamicModelJobView,
+    DynamicModelSummariesView,
+    DynamicModelSummaryView,
+    DynamicModelIndexesView,
+    DynamicModelPartitionsView,
+    DynamicModelPartitionView,
+    DynamicModelStatsView,
     ListDynamicTableRowsView,
+    UploadRowsDynamicModelView,
 )
 
 urlpatterns = [
+    path(
+        "database/stats",
+        DatabaseStatsView.as_view(),
+        name="database_stats",
+    ),
     path(
         "table",
         CreateUpdateDynamicModelView.as_view(
@@ -25,14 +46,94 @@ urlpatterns = [
         ),
         name="table_update",
     ),
+    path(
+        "table/<int:id>/indexes",
+        DynamicModelIndexesView.as_view(),
+        name="table_indexes",
+    ),
+    path(
+        "table/<int:id>/partitions",
+        DynamicModelPartitionsView.as_view(),
+        name="table_partitions",
+    ),
+    path(
+        "table/<int:id>/partitions/<str:name>",
+        DynamicModelPartitionView.as_view(),
+        name="table_partition",
+    ),
+    path(
+        "table/<int:id>/partitions/<str:name>/attach",
+        AttachDynamicModelPartitionView.as_view(),
+        name="table_partition_attach",
+    ),
+    path(
+        "table/<int:id>/partitions/<str:name>/detach",
+        DetachDynamicModelPartitionView.as_view(),
+        name="table_partition_detach",
+    ),
+    path(
+        "table/<int:id>/changes",
+        DynamicModelChangesView.as_view(),
+        name="table_changes",
+    ),
+    path(
+        "table/<int:id>/changes/<int:change_id>",
+        DynamicModelChangeView.as_view(),
+        name="table_change",
+    ),
+    path(
+        "table/<int:id>/jobs",
+        DynamicModelJobsView.as_view(),
+        name="table_jobs",
+    ),
+    path(
+        "table/<int:id>/jobs/<int:job_id>",
+        DynamicModelJobView.as_view(),
+        name="table_job",
+    ),
+    path(
+        "table/<int:id>/summaries",
+        DynamicModelSummariesView.as_view(),
+        name="table_summaries",
+    ),
+    path(
+        "table/<int:id>/summaries/<str:name>",
+        DynamicModelSummaryView.as_view(),
+        name="table_summary",
+    ),
+    path(
+        "table/<int:id>/stats",
+        DynamicModelStatsView.as_view(),
+        name="table_stats",
+    ),
     path(
         "table/<int:id>/row",
         AddRowsDynamicModelView.as_view(),
         name="table_create_rows",
     ),
+    path(
+        "table/<int:id>/row/async",
+        AsyncAddRowsDynamicModelView.as_view(),
+        name="table_create_rows_async",
+    ),
+    path(
+        "table/<int:id>/row/upload",
+        UploadRowsDynamicModelView.as_view(),
+        name="table_upload_rows",
+    ),
     path(
         "table/<int:id>/rows",
         ListDynamicTableRowsView.as_view(),
         name="table_retrieve_rows",
     ),
+    path(
+        "table/<int:id>/rows/async",
+        AsyncListDynamicTableRowsView.as_view(),
+        name="table_retrieve_rows_async",
+    ),
+    path(
+        "table/<int:id>/rows/aggregate",
+        AggregateDynamicTableRowsView.as_view(),
+        name="table_aggregate_rows",
+    ),
 ]
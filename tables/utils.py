@@ -1,11 +1,31 @@
-from typing import Union, Any
+import copy
+from typing import Union, Any, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import admin
-from django.db import connection, models
+from django.db import DatabaseError, connection, models, transaction
 from django.db.models.query import QuerySet
 from django.core.exceptions import ObjectDoesNotExist
 from rest_framework import serializers
 
-from .models import DynamicModel, DynamicModelField
+from .metrics import phase
+from .models import DynamicModel, normalize_field_options
+from .registry import model_registry
+
+# Django model field class for every supported DynamicModelField.type
+FIELD_CLASSES = {
+    "string": models.CharField,
+    "int": models.IntegerField,
+    "float": models.FloatField,
+    "bool": models.BooleanField,
+}
+
+# field types a table can be partitioned by, id is an int field
+PARTITION_FIELD_TYPES = {
+    "range": ("int", "float"),
+    "list": ("string", "int"),
+    "hash": tuple(FIELD_CLASSES),
+}
 
 
 def prepare_fields(
@@ -29,14 +49,8 @@ def prepare_fields(
                 field.options["name"] = field.name
                 field.options["db_column"] = field.name
 
-            if field.type == "string":
-                model_field = models.CharField(**field.options)
-            elif field.type == "int":
-                model_field = models.IntegerField(**field.options)
-            elif field.type == "float":
-                model_field = models.FloatField(**field.options)
-            elif field.type == "bool":
-                model_field = models.BooleanField(**field.options)
+            if field.type in FIELD_CLASSES:
+                model_field = FIELD_CLASSES[field.type](**field.options)
 
             if single_field_name == field.name:
                 return model_field
@@ -51,14 +65,8 @@ def prepare_fields(
                 field.get("options")["name"] = field.get("name")
                 field.get("options")["db_column"] = field.get("name")
 
-            if field.get("type") == "string":
-                model_field = models.CharField(**field.get("options"))
-            elif field.get("type") == "int":
-                model_field = models.IntegerField(**field.get("options"))
-            elif field.get("type") == "float":
-                model_field = models.FloatField(**field.get("options"))
-            elif field.get("type") == "bool":
-                model_field = models.BooleanField(**field.get("options"))
+            if field.get("type") in FIELD_CLASSES:
+                model_field = FIELD_CLASSES[field.get("type")](**field.get("options"))
 
             if single_field_name == field.get("name"):
                 return model_field
@@ -68,6 +76,30 @@ def prepare_fields(
     return model_fields
 
 
+def build_field(name: str, field_type: str, options: dict = None) -> models.Field:
+    """
+    Create standalone model Field with column named after the field
+    :param name:
+    :param field_type:
+    :param options:
+    :return:
+    """
+    field = FIELD_CLASSES[field_type](**normalize_field_options(options))
+    field.set_attributes_from_name(name)
+    return field
+
+
+def get_field_type(field: models.Field) -> str:
+    """
+    Get DynamicModelField type of model Field
+    :param field:
+    :return:
+    """
+    for field_type, field_class in FIELD_CLASSES.items():
+        if type(field) is field_class:
+            return field_type
+
+
 def create_model(
     name: str, fields: dict = None, options: dict = None, admin_opts: dict = None
 ) -> Any:
@@ -114,27 +146,57 @@ def create_model(
     return model
 
 
+def build_model(model_object: DynamicModel) -> Any:
+    """
+    Build dynamic model class from model_object schema
+    :param model_object:
+    :return:
+    """
+    model_fields = prepare_fields(model_object.fields.all(), remove_extra_options=True)
+
+    return create_model(
+        name=model_object.name,
+        fields=model_fields,
+        options=model_object.options,
+        admin_opts=model_object.admin_opts,
+    )
+
+
 def get_model(model_id: int) -> tuple[Any, DynamicModel]:
     """
-    Get dynamic model and model_object that represents it
+    Get dynamic model and model_object that represents it.
+    Model class is built once per schema version and then served from registry
     :param model_id:
     :return:
     """
-    try:
-        model_object = DynamicModel.objects.get(id=model_id)
-        model_fields = prepare_fields(
-            model_object.fields.all(), remove_extra_options=True
+    with phase("get_model"):
+        try:
+            model_object = DynamicModel.objects.get(id=model_id)
+        except ObjectDoesNotExist as exc:
+            # raise Validation here, this function is used in many places including view functions
+            raise serializers.ValidationError(str(exc))
+
+        model = model_registry.get_or_build(
+            model_object.id, model_object.version, lambda: build_model(model_object)
         )
+    return model, model_object
 
-        model = create_model(
-            name=model_object.name,
-            fields=model_fields,
-            options=model_object.options,
-            admin_opts=model_object.admin_opts,
-        )
-    except ObjectDoesNotExist as exc:
-        # raise Validation here, this function is used in many places including view functions
-        raise serializers.ValidationError(str(exc))
+
+async def aget_model(model_id: int) -> tuple[Any, DynamicModel]:
+    """
+    get_model() for async views, only building a new model class runs in a thread
+    :param model_id:
+    :return:
+    """
+    with phase("get_model"):
+        try:
+            model_object = await DynamicModel.objects.aget(id=model_id)
+        except ObjectDoesNotExist as exc:
+            raise serializers.ValidationError(str(exc))
+
+        model = model_registry.get(model_object.id, model_object.version)
+        if model is None:
+            model, model_object = await sync_to_async(get_model)(model_id)
 
     return model, model_object
 
@@ -198,213 +260,242 @@ def get_single_input_field(
             return field
 
 
-def get_single_model_field(model_fields: QuerySet, name: str) -> DynamicModelField:
+def insert_rows(
+    model: models.Model, rows: list[dict], batch_size: int = None, atomic: bool = True
+) -> list[int]:
     """
-    Get single field by name from dynamic model fields
-    :param model_fields:
-    :param name:
-    :return:
+    Insert rows with multi-row INSERT ... RETURNING id statements.
+    With atomic all batches are inserted in one transaction,
+    otherwise every batch is committed on its own
+    :param model:
+    :param rows:
+    :param batch_size:
+    :param atomic:
+    :return: ids of inserted rows
     """
-    for field in model_fields:
-        if field.name == name:
-            return field
+    batch_size = batch_size or settings.DYNAMIC_TABLES_ROW_BATCH_SIZE
+    row_ids = []
+
+    def insert_batches():
+        for start in range(0, len(rows), batch_size):
+            # bulk_create runs every call in its own transaction
+            row_objects = model.objects.bulk_create(
+                [model(**row) for row in rows[start : start + batch_size]]
+            )
+            row_ids.extend(row_object.id for row_object in row_objects)
+
+    try:
+        if atomic:
+            with transaction.atomic():
+                insert_batches()
+        else:
+            insert_batches()
+    except DatabaseError as exc:
+        # already committed batches are reported back in per-batch mode
+        raise serializers.ValidationError(
+            {"rows": str(exc), "inserted": [] if atomic else row_ids}
+        )
+
+    return row_ids
 
 
-def check_model_fields(model_object: DynamicModel, rows: list) -> bool:
+async def ainsert_rows(
+    model: models.Model, rows: list[dict], batch_size: int = None, atomic: bool = True
+) -> list[int]:
     """
-    Checks if field names in rows are valid model fields
-    :param model_object:
+    insert_rows() for async views
+    :param model:
     :param rows:
-    :return:
+    :param batch_size:
+    :param atomic:
+    :return: ids of inserted rows
     """
-    model_fields = get_model_fields_names(model_object)
-    input_fields = get_input_fields_names(rows)
+    batch_size = batch_size or settings.DYNAMIC_TABLES_ROW_BATCH_SIZE
+    row_ids = []
 
-    for field in input_fields.values():
-        if field not in model_fields.values():
-            return False
+    try:
+        if atomic:
+            # bulk_create inserts all batches of a single call in one transaction
+            row_objects = await model.objects.abulk_create(
+                [model(**row) for row in rows], batch_size=batch_size
+            )
+            row_ids = [row_object.id for row_object in row_objects]
+        else:
+            for start in range(0, len(rows), batch_size):
+                row_objects = await model.objects.abulk_create(
+                    [model(**row) for row in rows[start : start + batch_size]]
+                )
+                row_ids.extend(row_object.id for row_object in row_objects)
+    except DatabaseError as exc:
+        raise serializers.ValidationError(
+            {"rows": str(exc), "inserted": [] if atomic else row_ids}
+        )
 
-    return True
+    return row_ids
 
 
-def create_model_db(model: models.Model):
+def get_upsert_options(model: models.Model, unique_fields: list[str]) -> dict:
     """
-    Create model in DB, uses schema_editor to perform DB query
+    bulk_create() options of INSERT ... ON CONFLICT over unique fields
     :param model:
+    :param unique_fields:
     :return:
     """
-    with connection.schema_editor() as schema_editor:
-        schema_editor.create_model(model)
-
-
-def update_model(old_model: DynamicModel, new_model: dict):
+    update_fields = [
+        field.name
+        for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in unique_fields
+    ]
+    if not update_fields:
+        # nothing to update, rows with existing keys are skipped
+        return {"ignore_conflicts": True}
+    return {
+        "update_conflicts": True,
+        "unique_fields": unique_fields,
+        "update_fields": update_fields,
+    }
+
+
+def dedupe_rows(rows: list[dict], unique_fields: list[str]) -> list[dict]:
+    # a statement can't update the same row twice, the last row of a key wins
+    return list(
+        {tuple(row.get(name) for name in unique_fields): row for row in rows}.values()
+    )
+
+
+def upsert_rows(
+    model: models.Model,
+    rows: list[dict],
+    unique_fields: list[str],
+    batch_size: int = None,
+    atomic: bool = True,
+) -> int:
     """
-    Performs dynamic model update in DB
-    Rename table, Update model options, Update model fields
-
-    :param old_model:
-    :param new_model:
-    :return:
+    Insert rows, rows with the same unique fields values as existing ones
+    update them instead, with INSERT ... ON CONFLICT DO UPDATE statements
+    :param model:
+    :param rows:
+    :param unique_fields:
+    :param batch_size:
+    :param atomic:
+    :return: number of inserted and updated rows
     """
-    if old_model.name != new_model.get("name"):
-        rename_model_table(old_model.name, new_model.get("name"))
-        old_model.name = new_model.get("name")
-
-    if old_model.options != new_model.get("options"):
-        old_model.options = new_model.get("options")
-
-    old_model.save()
-    model, model_object = get_model(old_model.id)
-
-    if old_model.fields.count() != len(new_model.get("fields")):
-        update_model_fields(model, model_object, new_model.get("fields"))
-    else:
-        for model_field, input_field in zip(
-            old_model.fields.all(), new_model.get("fields")
-        ):
-            is_same = compare_fields(model_field, input_field)
-            if not is_same:
-                update_model_fields(model, model_object, new_model.get("fields"))
-                break
-
-    old_model.save()
+    batch_size = batch_size or settings.DYNAMIC_TABLES_ROW_BATCH_SIZE
+    rows = dedupe_rows(rows, unique_fields)
+    options = get_upsert_options(model, unique_fields)
+    written = 0
+
+    def upsert_batches():
+        nonlocal written
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start : start + batch_size]
+            model.objects.bulk_create([model(**row) for row in batch], **options)
+            written += len(batch)
 
+    try:
+        if atomic:
+            with transaction.atomic():
+                upsert_batches()
+        else:
+            upsert_batches()
+    except DatabaseError as exc:
+        raise serializers.ValidationError(
+            {"rows": str(exc), "upserted": 0 if atomic else written}
+        )
 
-def compare_fields(model_field: DynamicModelField, input_field: dict) -> bool:
-    is_name_equal = model_field.name == input_field.get("name")
-    is_type_equal = model_field.type == input_field.get("type")
-    is_options_equal = model_field.options == input_field.get("options")
-
-    return is_name_equal and is_type_equal and is_options_equal
+    return written
 
 
-def update_model_fields(
-    model: models.Model, model_object: DynamicModel, new_fields: list[dict]
-):
+async def aupsert_rows(
+    model: models.Model,
+    rows: list[dict],
+    unique_fields: list[str],
+    batch_size: int = None,
+    atomic: bool = True,
+) -> int:
     """
-    Update dynamic model fields in DB.
-    Rename, Remove, Alter, Add model's table column
+    upsert_rows() for async views
     :param model:
-    :param model_object:
-    :param new_fields:
-    :return:
+    :param rows:
+    :param unique_fields:
+    :param batch_size:
+    :param atomic:
+    :return: number of inserted and updated rows
     """
-    model_fields = get_model_fields_names(model_object)
-    input_fields = get_input_fields_names(new_fields, rows_object=False)
-
-    for field_id, model_field_name in model_fields.items():
-        if model_field_name not in input_fields.values():
-            if field_id in input_fields.keys():
-                rename_model_field(model, model_field_name, input_fields[field_id])
-                model_fields[field_id] = input_fields[field_id]
-                new_field = get_single_input_field(new_fields, input_fields[field_id])
-
-                model_old_field, _ = DynamicModelField.objects.get_or_create(
-                    name=model_field_name,
-                    type=new_field.get("type"),
-                    options=new_field.get("options"),
-                )
-                model_object.fields.remove(model_old_field)
-
-                model_new_field, _ = DynamicModelField.objects.get_or_create(
-                    name=new_field.get("name"),
-                    type=new_field.get("type"),
-                    options=new_field.get("options"),
-                )
-                model_object.fields.add(model_new_field)
-                model_object.save()
-            else:
-                field = prepare_fields(
-                    model_object.fields.all(), single_field_name=model_field_name
-                )
-                model_remove_table_field(model, field)
-                old_field_object = get_single_model_field(
-                    model_object.fields.all(), model_field_name
-                )
-                field, _ = DynamicModelField.objects.get_or_create(
-                    name=old_field_object.name,
-                    type=old_field_object.type,
-                    options=old_field_object.options,
-                )
+    batch_size = batch_size or settings.DYNAMIC_TABLES_ROW_BATCH_SIZE
+    rows = dedupe_rows(rows, unique_fields)
+    options = get_upsert_options(model, unique_fields)
+    written = 0
 
-                model_object.fields.remove(field)
-
-    for new_field in input_fields.values():
-        new_field_object = get_single_input_field(
-            new_fields, new_field, remove_extra_options=True
-        )
-        old_field_object = get_single_model_field(model_object.fields.all(), new_field)
-        field = prepare_fields(new_fields, single_field_name=new_field)
-        model_field = prepare_fields(
-            model_object.fields.all(), single_field_name=new_field
-        )
-
-        if new_field in model_fields.values():
-            model_alter_table_field(model, model_field, field)
-            old_field, _ = DynamicModelField.objects.get_or_create(
-                name=old_field_object.name,
-                type=old_field_object.type,
-                options=old_field_object.options,
-            )
-            model_object.fields.remove(old_field)
-            new_field, _ = DynamicModelField.objects.get_or_create(
-                name=new_field_object.get("name"),
-                type=new_field_object.get("type"),
-                options=new_field_object.get("options"),
+    try:
+        if atomic:
+            await model.objects.abulk_create(
+                [model(**row) for row in rows], batch_size=batch_size, **options
             )
-            model_object.fields.add(new_field)
+            written = len(rows)
         else:
-            model_add_table_field(model, field)
-
-            field, _ = DynamicModelField.objects.get_or_create(
-                name=new_field_object.get("name"),
-                type=new_field_object.get("type"),
-                options=new_field_object.get("options"),
-            )
-
-            model_object.fields.add(field)
-            model_object.save()
-
-
-def rename_model_table(old_model_name: str, new_model_name: str):
-    with connection.schema_editor() as schema_editor:
-        sql = "ALTER TABLE %(old_table)s RENAME TO %(new_table)s" % {
-            "old_table": f'"tables_{old_model_name}"',
-            "new_table": f'"tables_{new_model_name}"',
-        }
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start : start + batch_size]
+                await model.objects.abulk_create(
+                    [model(**row) for row in batch], **options
+                )
+                written += len(batch)
+    except DatabaseError as exc:
+        raise serializers.ValidationError(
+            {"rows": str(exc), "upserted": 0 if atomic else written}
+        )
 
-        schema_editor.execute(sql)
+    return written
 
 
-def rename_model_field(model: models.Model, old_field_name: str, new_field_name: str):
+def create_model_db(model: models.Model, partitioning: Optional[dict] = None):
+    """
+    Create model in DB, uses schema_editor to perform DB query
+    :param model:
+    :param partitioning: partition scheme, table is created as partitioned one
+    :return:
+    """
     with connection.schema_editor() as schema_editor:
-        sql = "ALTER TABLE %(table)s RENAME COLUMN %(old_column)s TO %(new_column)s" % {
-            "table": f'"tables_{model.__name__}"',
-            "old_column": f'"{old_field_name}"',
-            "new_column": f'"{new_field_name}"',
-        }
-
-        schema_editor.execute(sql)
+        if partitioning:
+            create_partitioned_table(schema_editor, model, partitioning)
+        else:
+            schema_editor.create_model(model)
 
 
-def model_alter_table_field(
-    model: models.Model, old_field: models.Field, new_field: models.Field
+def create_partitioned_table(
+    schema_editor: Any, model: models.Model, partitioning: dict
 ):
-    with connection.schema_editor() as schema_editor:
-        old_field.column = old_field.db_column
-        new_field.column = new_field.db_column
-        schema_editor.alter_field(model, old_field, new_field)
-
-
-def model_add_table_field(model: models.Model, field: models.Field):
-    with connection.schema_editor() as schema_editor:
-        # Without concrete schema_editor.add_field is raising error
-        field.concrete = True
-        field.column = field.db_column
-        schema_editor.add_field(model, field)
-
-
-def model_remove_table_field(model: models.Model, field: models.Field):
-    with connection.schema_editor() as schema_editor:
-        field.column = field.db_column
-        schema_editor.remove_field(model, field)
+    """
+    Create PostgreSQL table partitioned by a field, without partitions.
+    Primary key of partitioned table has to include partition key,
+    so it is (id, partition field)
+    :param schema_editor:
+    :param model:
+    :param partitioning:
+    :return:
+    """
+    quote_name = schema_editor.quote_name
+    key_field = model._meta.get_field(partitioning["field"])
+
+    definitions, params = [], []
+    for field in model._meta.local_fields:
+        if field.primary_key:
+            field = copy.copy(field)
+            field.primary_key = False
+        definition, definition_params = schema_editor.column_sql(model, field)
+        # e.g. GENERATED BY DEFAULT AS IDENTITY of id
+        suffix = field.db_type_suffix(connection=schema_editor.connection)
+        if suffix:
+            definition += f" {suffix}"
+        definitions.append(f"{quote_name(field.column)} {definition}")
+        params += definition_params
+    key_columns = dict.fromkeys([model._meta.pk.column, key_field.column])
+    definitions.append(f"PRIMARY KEY ({', '.join(map(quote_name, key_columns))})")
+
+    schema_editor.execute(
+        f"CREATE TABLE {quote_name(model._meta.db_table)} ({', '.join(definitions)}) "
+        f"PARTITION BY {partitioning['type'].upper()} ({quote_name(key_field.column)})",
+        params or None,
+    )
+    # indexes of db_index fields, created on every partition too
+    schema_editor.deferred_sql.extend(schema_editor._model_indexes_sql(model))
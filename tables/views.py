@@ -1,10 +1,56 @@
+from django.conf import settings
 from rest_framework import generics, serializers, status
 from rest_framework.response import Response
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
 
-from .models import DynamicModel
-from .serializers import DynamicModelSerializer
-from .utils import check_model_fields, get_model
+from .aggregates import aggregate_rows
+from .caching import (
+    cache_page,
+    get_cached_page,
+    get_not_modified_response,
+    get_page_cache_key,
+    set_validators,
+)
+from .backends.postgresql_pool.base import DatabaseWrapper as PooledDatabaseWrapper
+from .backends.postgresql_pool.base import get_pool_stats
+from .export import stream_rows
+from .filters import DynamicTableFilter, DynamicTableOrderingFilter, select_rows
+from .indexes import get_index_status
+from .ingest import RowCleaner, ingest_stream
+from .metrics import phase
+from .jobs import enqueue_job, spool_upload
+from .models import DynamicModel, Job, SchemaChange, Summary
+from .online import start_schema_change
+from .pagination import DynamicTableCursorPagination
+from .partitions import (
+    attach_partition,
+    create_partition,
+    detach_partition,
+    drop_partition,
+    get_partitions,
+)
+from .schema import SchemaPlan
+from .serializers import (
+    AddRowsOptionsSerializer,
+    DynamicModelSerializer,
+    JobSerializer,
+    PartitionBoundsSerializer,
+    PartitionSerializer,
+    SchemaChangeSerializer,
+    SelectRowsSerializer,
+    SummarySerializer,
+    TableStatsOptionsSerializer,
+    UpdateModelOptionsSerializer,
+    UpdateRowsSerializer,
+    UploadRowsOptionsSerializer,
+    get_row_serializer_class,
+    get_row_validator,
+    get_row_values_serializer,
+)
+from .stats import get_table_stats
+from .summaries import create_summary, drop_summary, read_summary
+from .utils import get_model, insert_rows, upsert_rows
 
 
 class CreateUpdateDynamicModelView(generics.CreateAPIView, generics.UpdateAPIView):
@@ -22,6 +68,35 @@ class CreateUpdateDynamicModelView(generics.CreateAPIView, generics.UpdateAPIVie
             serializer.data, status=status.HTTP_201_CREATED, headers=headers
         )
 
+    def update(self, request, *args, **kwargs):
+        options = UpdateModelOptionsSerializer(data=request.query_params)
+        options.is_valid(raise_exception=True)
+        if not any(
+            options.validated_data[name] for name in ("dry_run", "online", "background")
+        ):
+            return super().update(request, *args, **kwargs)
+
+        instance = self.get_object()
+        serializer = self.get_serializer(instance, data=request.data)
+        serializer.is_valid(raise_exception=True)
+        plan = SchemaPlan(instance, serializer.validated_data)
+        if options.validated_data["dry_run"]:
+            # return planned schema changes without applying them
+            return Response(plan.as_dict())
+
+        if options.validated_data["background"]:
+            # checked now and again by the job, after earlier jobs of the table
+            job = enqueue_job(instance, Job.UPDATE_TABLE, {"data": request.data})
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        change = start_schema_change(plan)
+        # backfill and swap run as a job, a stopped worker doesn't leave
+        # the change running for good
+        enqueue_job(instance, Job.SCHEMA_CHANGE, {"change_id": change.id})
+        return Response(
+            SchemaChangeSerializer(change).data, status=status.HTTP_202_ACCEPTED
+        )
+
 
 class GetDynamicSerializer:
     """
@@ -29,12 +104,7 @@ class GetDynamicSerializer:
     """
 
     def get_serializer_class(self):
-        class DynamicTableSerializer(serializers.ModelSerializer):
-            class Meta:
-                model = self.model
-                fields = "__all__"
-
-        return DynamicTableSerializer
+        return get_row_serializer_class(self.model)
 
 
 class AddRowsDynamicModelView(GetDynamicSerializer, generics.CreateAPIView):
@@ -42,30 +112,371 @@ class AddRowsDynamicModelView(GetDynamicSerializer, generics.CreateAPIView):
         model, model_object = get_model(kwargs.get("id"))
         self.model = model
 
-        serializer = self.get_serializer(data=request.data["rows"], many=True)
-        serializer.is_valid(raise_exception=True)
+        options = AddRowsOptionsSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
 
-        # We need to do validations here, as we are dealing with dynamic models
-        # Serializer for dynamic model is also created on the fly
-        fields_names_are_valid = check_model_fields(
-            model_object, request.data.get("rows")
-        )
-        if not fields_names_are_valid:
+        # rows are checked in one pass by validator compiled for the schema version,
+        # not by a row serializer with DRF fields built for every row
+        with phase("validate"):
+            rows = get_row_validator(model).clean(
+                request.data.get("rows"), settings.DYNAMIC_TABLES_INGEST_MAX_ERRORS
+            )
+
+        if options.validated_data["upsert"] and not model_object.natural_key:
             raise serializers.ValidationError(
-                f"field names are not valid for model {model_object.name}"
+                {"upsert": f"model {model_object.name} has no natural_key"}
             )
 
-        row_ids = []
-        for row in request.data.get("rows"):
-            row_object = model.objects.create(**row)
-            row_ids.append(row_object.id)
+        try:
+            if options.validated_data["upsert"]:
+                with phase("upsert_rows"):
+                    upserted = upsert_rows(
+                        model,
+                        rows,
+                        model_object.natural_key,
+                        batch_size=options.validated_data.get("batch_size"),
+                        atomic=options.validated_data["atomic"],
+                    )
+                return Response({"upserted": upserted})
+
+            with phase("insert_rows"):
+                row_ids = insert_rows(
+                    model,
+                    rows,
+                    batch_size=options.validated_data.get("batch_size"),
+                    atomic=options.validated_data["atomic"],
+                )
+        finally:
+            # batches committed before a failed one are written too
+            DynamicModel.objects.bump_write_version(model_object.id)
 
         return Response(row_ids, status=status.HTTP_201_CREATED)
 
 
+class UploadRowsDynamicModelView(generics.GenericAPIView):
+    """
+    Streams CSV or NDJSON request body into dynamic model table,
+    rejected lines are reported instead of aborting the load
+    """
+
+    def post(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        options = UploadRowsOptionsSerializer(data=request.query_params)
+        options.is_valid(raise_exception=True)
+
+        if options.validated_data["background"]:
+            payload = {
+                **spool_upload(request.stream),
+                "content_type": request.content_type,
+            }
+            job = enqueue_job(model_object, Job.UPLOAD_ROWS, payload)
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        try:
+            # request.data is never touched, so the body is not loaded into memory
+            report = ingest_stream(model, request.stream, request.content_type)
+        finally:
+            DynamicModel.objects.bump_write_version(model_object.id)
+        return Response(report, status=status.HTTP_201_CREATED)
+
+
+class DynamicModelIndexesView(generics.GenericAPIView):
+    """
+    Lists secondary indexes of dynamic model table with their build status and size
+    """
+
+    def get(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        return Response(get_index_status(model, model_object.indexes))
+
+
+class DynamicModelPartitionsView(generics.GenericAPIView):
+    """
+    Partitions of partitioned dynamic model table, POST adds a new partition
+    """
+
+    def get(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        return Response(get_partitions(model, model_object))
+
+    def post(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        serializer = PartitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        partition = create_partition(model, model_object, serializer.validated_data)
+        return Response(partition, status=status.HTTP_201_CREATED)
+
+
+class DynamicModelPartitionView(generics.GenericAPIView):
+    """
+    Drops partition of dynamic model table with all its rows
+    """
+
+    def delete(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        drop_partition(model, model_object, kwargs.get("name"))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class AttachDynamicModelPartitionView(generics.GenericAPIView):
+    """
+    Attaches detached partition back to dynamic model table with given bounds
+    """
+
+    def post(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        bounds = PartitionBoundsSerializer(data=request.data)
+        bounds.is_valid(raise_exception=True)
+        return Response(
+            attach_partition(
+                model, model_object, kwargs.get("name"), bounds.validated_data
+            )
+        )
+
+
+class DetachDynamicModelPartitionView(generics.GenericAPIView):
+    """
+    Detaches partition from dynamic model table, the partition table is kept
+    """
+
+    def post(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        return Response(detach_partition(model, model_object, kwargs.get("name")))
+
+
+class DynamicModelSummariesView(generics.GenericAPIView):
+    """
+    Summaries of dynamic model table, POST registers a new one
+    """
+
+    def get(self, request, *args, **kwargs):
+        summaries = Summary.objects.filter(model_id=kwargs.get("id")).order_by("name")
+        return Response(SummarySerializer(summaries, many=True).data)
+
+    def post(self, request, *args, **kwargs):
+        model, model_object = get_model(kwargs.get("id"))
+        serializer = SummarySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        summary = create_summary(model, model_object, serializer.validated_data)
+        return Response(SummarySerializer(summary).data, status=status.HTTP_201_CREATED)
+
+
+class DynamicModelSummaryView(generics.GenericAPIView):
+    """
+    Groups of summary filtered by group_by fields, ?category=a&region__in=eu,us,
+    DELETE drops the summary
+    """
+
+    def get_summary(self) -> Summary:
+        try:
+            return Summary.objects.get(
+                model_id=self.kwargs.get("id"), name=self.kwargs.get("name")
+            )
+        except ObjectDoesNotExist as exc:
+            raise serializers.ValidationError(str(exc))
+
+    def get(self, request, *args, **kwargs):
+        model, _ = get_model(kwargs.get("id"))
+        filters = DynamicTableFilter().get_filters(request)
+        return Response(read_summary(model, self.get_summary(), filters))
+
+    def delete(self, request, *args, **kwargs):
+        drop_summary(self.get_summary())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DynamicModelChangesView(generics.ListAPIView):
+    """
+    Online schema changes of dynamic model, the latest first
+    """
+
+    serializer_class = SchemaChangeSerializer
+
+    def get_queryset(self):
+        return SchemaChange.objects.filter(model_id=self.kwargs["id"]).order_by("-id")
+
+
+class DynamicModelChangeView(generics.RetrieveAPIView):
+    """
+    Status and backfill progress of online schema change
+    """
+
+    serializer_class = SchemaChangeSerializer
+    lookup_url_kwarg = "change_id"
+
+    def get_queryset(self):
+        return SchemaChange.objects.filter(model_id=self.kwargs["id"])
+
+
+class DynamicModelJobsView(generics.ListAPIView):
+    """
+    Background jobs of dynamic model, the latest first
+    """
+
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        return Job.objects.filter(model_id=self.kwargs["id"]).order_by("-id")
+
+
+class DynamicModelJobView(generics.RetrieveAPIView):
+    """
+    Status, progress, duration and result or error of background job
+    """
+
+    serializer_class = JobSerializer
+    lookup_url_kwarg = "job_id"
+
+    def get_queryset(self):
+        return Job.objects.filter(model_id=self.kwargs["id"])
+
+
+class DynamicModelStatsView(generics.GenericAPIView):
+    """
+    Table row count, size and per column statistics,
+    estimated from planner statistics unless ?exact=true
+    """
+
+    def get(self, request, *args, **kwargs):
+        model, _ = get_model(kwargs.get("id"))
+        options = TableStatsOptionsSerializer(data=request.query_params)
+        options.is_valid(raise_exception=True)
+        return Response(get_table_stats(model, exact=options.validated_data["exact"]))
+
+
 class ListDynamicTableRowsView(GetDynamicSerializer, generics.ListAPIView):
+    """
+    Pages of table rows, bulk update and delete of rows selected
+    by id list or filter, each a single UPDATE or DELETE statement
+    """
+
+    pagination_class = DynamicTableCursorPagination
+    filter_backends = (DynamicTableFilter, DynamicTableOrderingFilter)
+
     def get_queryset(self):
         # Get dynamic model and query it
         model, model_object = get_model(self.kwargs.get("id"))
         self.model = model
+        self.model_object = model_object
         return model.objects.all()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        # unchanged rows are answered from dynamic model write version alone
+        not_modified = get_not_modified_response(request, self.model_object)
+        if not_modified is not None:
+            return not_modified
+        queryset = self.filter_queryset(queryset)
+
+        export_format = request.query_params.get("export")
+        if export_format:
+            # full table export is streamed instead of paginated
+            return set_validators(
+                stream_rows(queryset, export_format, self.model_object.name),
+                self.model_object,
+            )
+
+        cache_key = get_page_cache_key(
+            request, self.model_object, request.accepted_media_type
+        )
+        with phase("cache"):
+            response = get_cached_page(cache_key)
+        if response is not None:
+            return set_validators(response, self.model_object)
+
+        # rows are read as plain tuples, no model instances or DRF fields per row
+        row_serializer = get_row_values_serializer(self.model)
+        queryset = queryset.values_list(*row_serializer.columns)
+
+        with phase("paginate"):
+            page = self.paginate_queryset(queryset)
+        if page is not None:
+            with phase("serialize"):
+                rows = row_serializer.to_representation(page)
+            response = self.get_paginated_response(rows)
+        else:
+            with phase("serialize"):
+                response = Response(row_serializer.to_representation(queryset))
+
+        cache_page(cache_key, response)
+        return set_validators(response, self.model_object)
+
+    def patch(self, request, *args, **kwargs):
+        options = UpdateRowsSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        queryset = select_rows(
+            self.get_queryset(),
+            options.validated_data.get("ids"),
+            options.validated_data.get("filter"),
+        )
+        try:
+            with phase("validate"):
+                values = RowCleaner(self.model).clean_values(
+                    options.validated_data["values"]
+                )
+        except ValidationError as exc:
+            raise serializers.ValidationError(
+                {
+                    "values": exc.message_dict
+                    if hasattr(exc, "error_dict")
+                    else exc.messages
+                }
+            )
+
+        try:
+            with transaction.atomic():
+                updated = queryset.update(**values)
+        except DatabaseError as exc:
+            # e.g. values breaking a unique field or the natural key
+            raise serializers.ValidationError({"values": str(exc)})
+        DynamicModel.objects.bump_write_version(self.model_object.id)
+        return Response({"updated": updated})
+
+    def delete(self, request, *args, **kwargs):
+        options = SelectRowsSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        queryset = select_rows(
+            self.get_queryset(),
+            options.validated_data.get("ids"),
+            options.validated_data.get("filter"),
+        )
+        deleted, _ = queryset.delete()
+        DynamicModel.objects.bump_write_version(self.model_object.id)
+        return Response({"deleted": deleted})
+
+
+class AggregateDynamicTableRowsView(generics.GenericAPIView):
+    """
+    Groups filtered rows and computes aggregates in database,
+    ?group_by=category&aggregate=count,sum:price&price__gte=10
+    """
+
+    filter_backends = (DynamicTableFilter,)
+
+    def get_queryset(self):
+        model, _ = get_model(self.kwargs.get("id"))
+        return model.objects.all()
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        group_by, aggregates = (
+            [
+                value
+                for value in DynamicTableFilter.get_list_param(request, key)
+                if value
+            ]
+            for key in ("group_by", "aggregate")
+        )
+        return Response(aggregate_rows(queryset, group_by, aggregates))
+
+
+class DatabaseStatsView(generics.GenericAPIView):
+    """
+    Connection pool wait times and prepared statement cache hit rate
+    of this server process, pooled backend only
+    """
+
+    def get(self, request, *args, **kwargs):
+        pooled = isinstance(connections[DEFAULT_DB_ALIAS], PooledDatabaseWrapper)
+        stats = get_pool_stats(DEFAULT_DB_ALIAS) if pooled else {}
+        return Response({"pooled": pooled, **stats})